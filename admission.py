@@ -0,0 +1,129 @@
+import asyncio
+import heapq
+import math
+import time
+
+# ------------------------------------------------
+# ADMISSION CONTROL
+# ------------------------------------------------
+# At most `capacity` requests (sum of per-backend caps) are in flight; the
+# rest wait in a bounded queue. A request is shed straight away when the
+# queue is full, or when the expected wait for its place in line already
+# exceeds its deadline, instead of being forwarded to time out upstream.
+#
+# The queue is weighted fair (WFQ): each waiter is tagged with a virtual
+# finish time, max(vtime, its client's last tag) + 1 / weight, and free
+# slots go to the smallest tag; vtime is the tag last served. A client
+# with many requests waiting only gets its weighted share of the slots,
+# and a quiet client's request goes ahead of the backlog. Without client
+# keys everyone is one client and the queue is FIFO.
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after=1):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _Client:
+    __slots__ = ("finish", "queued", "weight")
+
+    def __init__(self, weight):
+        self.finish = 0.0  # tag of its last queued request
+        self.queued = 0
+        self.weight = weight
+
+
+class Admission:
+    def __init__(self, capacity, max_queue=1000, timeout=1.0):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.inflight = 0
+        # EWMA of how long a request holds its slot, to predict queue waits
+        self.hold = 0.0
+        self._waiters = []  # heap of (tag, seq, fut, client); abandoned ones skipped lazily
+        self._queued = 0
+        self._seq = 0
+        self._vtime = 0.0
+        self._clients = {}  # client -> _Client, only while it has requests queued
+        self._backlog = 0.0  # sum of the queued clients' weights
+
+    @property
+    def depth(self):
+        return self._queued
+
+    def expected_wait(self, position: int) -> float:
+        return position * self.hold / max(self.capacity, 1)
+
+    async def acquire(self, timeout: float = None, client=None, weight: float = 1.0) -> float:
+        """Take a slot, waiting up to `timeout`; returns seconds spent queued."""
+        if self.inflight < self.capacity and not self._queued:
+            self.inflight += 1
+            return 0.0
+        timeout = self.timeout if timeout is None else timeout
+        c = self._clients.get(client)
+        tag = max(self._vtime, c.finish if c else 0.0) + 1.0 / (c.weight if c else weight)
+        # waiters ahead, by virtual time: every backlogged client gets
+        # weight slots per unit of it
+        backlog = self._backlog + (0.0 if c else weight)
+        position = min(self._queued + 1, math.ceil((tag - self._vtime) * backlog - 1e-9))
+        retry_after = max(1, round(self.expected_wait(position - 1)))
+        if self._queued >= self.max_queue:
+            raise Overloaded("queue full", retry_after)
+        if self.expected_wait(position) > timeout:
+            raise Overloaded("deadline cannot be met", retry_after)
+
+        start = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        if c is None:
+            c = self._clients[client] = _Client(weight)
+            self._backlog += weight
+        c.finish = tag
+        c.queued += 1
+        self._queued += 1
+        self._seq += 1
+        heapq.heappush(self._waiters, (tag, self._seq, fut, client))
+        try:
+            done, _ = await asyncio.wait({fut}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(fut, client)
+            raise
+        if not done:
+            self._abandon(fut, client)
+            raise Overloaded("queue timeout", retry_after)
+        return time.perf_counter() - start
+
+    def _dequeued(self, client):
+        self._queued -= 1
+        c = self._clients[client]
+        c.queued -= 1
+        if not c.queued:
+            del self._clients[client]
+            self._backlog -= c.weight
+
+    def _abandon(self, fut, client):
+        if fut.done() and not fut.cancelled():
+            self.release()  # slot was handed over as we gave up
+        else:
+            fut.cancel()  # its heap entry is dropped when it comes up
+            self._dequeued(client)
+            if len(self._waiters) > 2 * self._queued + 64:
+                self._waiters = [w for w in self._waiters if not w[2].done()]
+                heapq.heapify(self._waiters)
+
+    def release(self, held: float = None):
+        if held is not None:
+            self.hold = held if not self.hold else 0.9 * self.hold + 0.1 * held
+        self.inflight -= 1
+        self.grant()
+
+    def grant(self):
+        """Hand free slots to waiters; also call after capacity grows."""
+        while self._waiters and self.inflight < self.capacity:
+            tag, _, fut, client = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                self.inflight += 1
+                self._vtime = tag
+                self._dequeued(client)
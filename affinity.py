@@ -0,0 +1,83 @@
+import hashlib
+from array import array
+
+# ------------------------------------------------
+# MAGLEV LOOKUP TABLE
+# ------------------------------------------------
+# Each backend fills table slots following its own permutation of the
+# table, so removing one backend only re-homes the slots it owned and
+# every other key keeps its backend (Maglev, Eisenbud et al. 2016).
+DEFAULT_TABLE_SIZE = 65537  # prime, comfortably > 100 x pool size
+
+
+def stable_hash(data: str, salt: bytes = b"") -> int:
+    # hash() is salted per process; workers and restarts must agree
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8, salt=salt).digest(), "big")
+
+
+class MaglevTable:
+    def __init__(self, backends=(), size: int = DEFAULT_TABLE_SIZE):
+        self.size = size
+        self.backends = ()
+        self._table = array("H")
+        self._perms = {}  # url -> (offset, skip), cached across rebuilds
+        if backends:
+            self.build(backends)
+
+    def _perm(self, url):
+        p = self._perms.get(url)
+        if p is None:
+            offset = stable_hash(url, b"offset") % self.size
+            skip = stable_hash(url, b"skip") % (self.size - 1) + 1
+            p = self._perms[url] = (offset, skip)
+        return p
+
+    def build(self, backends):
+        """Rebuild for a new backend set; a no-op when the set is unchanged."""
+        backends = tuple(sorted(set(backends)))
+        if backends == self.backends:
+            return False
+        m = self.size
+        table = array("H", [0xFFFF]) * m
+        if backends:
+            perms = [self._perm(u) for u in backends]
+            nxt = [0] * len(backends)
+            filled = 0
+            while True:
+                for i, (offset, skip) in enumerate(perms):
+                    c = (offset + nxt[i] * skip) % m
+                    while table[c] != 0xFFFF:
+                        nxt[i] += 1
+                        c = (offset + nxt[i] * skip) % m
+                    table[c] = i
+                    nxt[i] += 1
+                    filled += 1
+                    if filled == m:
+                        break
+                if filled == m:
+                    break
+        self._table = table
+        self.backends = backends
+        return True
+
+    def lookup(self, key: str):
+        if not self.backends:
+            return None
+        return self.backends[self._table[stable_hash(key) % self.size]]
+
+
+# ------------------------------------------------
+# AFFINITY KEYS
+# ------------------------------------------------
+def request_key(request, spec: str = "client_ip") -> str:
+    """
+    Affinity key for `request`: "client_ip", "path" or "header:<name>".
+    A missing header falls back to the client IP.
+    """
+    if spec == "path":
+        return request.url.path
+    if spec.startswith("header:"):
+        value = request.headers.get(spec[len("header:"):])
+        if value:
+            return value
+    return request.client.host if request.client else ""
@@ -0,0 +1,95 @@
+"""
+Raw ASGI entry point for custom1: the same registry, probes, selection,
+retries, hedging, cache and admission, without FastAPI routing, dependency
+resolution or StreamingResponse on the proxy path.
+
+    uvicorn asgi_proxy:app --port 8080
+
+/metrics, /admin/*, websockets and the lifespan events (probes, pools,
+registry reload) are handed to custom1's FastAPI app unchanged.
+"""
+import json
+
+import anyio
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import cache
+import custom1
+import lbmetrics
+import longlived
+import streaming
+
+PROXY_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "DELETE", "PATCH"})
+_HOP_BY_HOP = streaming.HOP_BY_HOP
+
+
+def _framework(path: str) -> bool:
+    return path == "/metrics" or path.startswith("/admin/") or path == "/admin"
+
+
+async def _error(send, status, detail, headers=None):
+    # same body as FastAPI's HTTPException handler
+    body = json.dumps({"detail": detail}).encode()
+    raw = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    raw += [(k.lower().encode(), str(v).encode()) for k, v in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _relay(send, resp, release):
+    """Stream an upstream response straight onto the ASGI send channel."""
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": resp.status_code,
+            "headers": [(k, v) for k, v in resp.headers.raw if k.lower() not in _HOP_BY_HOP],
+        })
+        async for chunk in resp.aiter_raw():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        # shielded: a client disconnect cancels us, and release must still run
+        with anyio.CancelScope(shield=True):
+            try:
+                await resp.aclose()
+            finally:
+                release()
+
+
+async def _proxy(scope, receive, send):
+    if scope["method"] not in PROXY_METHODS:
+        return await _error(send, 405, "Method Not Allowed")
+    # Request only wraps scope/receive; headers etc. are parsed on first use
+    request = Request(scope, receive)
+    path = scope["path"][1:]
+    try:
+        custom1.throttle(request)
+        if longlived.is_sse(request.headers):
+            response = await custom1._sse(path, request)
+            return await response(scope, receive, send)
+        if custom1.CACHING and request.method in cache.CACHEABLE_METHODS \
+                and not custom1.response_cache.bypass(request):
+            # cache hits are small prebuilt responses; keep custom1's path
+            response = await custom1._cached(path, request)
+            return await response(scope, receive, send)
+        resp, release = await custom1._forward(path, request)
+    except HTTPException as e:
+        return await _error(send, e.status_code, e.detail, e.headers)
+    await _relay(send, resp, release)
+
+
+class FastPath:
+    """Proxy requests raw; everything else goes to the wrapped FastAPI app."""
+
+    def __init__(self, framework_app):
+        self.framework_app = framework_app
+        self.proxy = lbmetrics.RequestMetrics(_proxy)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not _framework(scope["path"]):
+            return await self.proxy(scope, receive, send)
+        return await self.framework_app(scope, receive, send)
+
+
+app = FastPath(custom1.app)
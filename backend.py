@@ -1,5 +1,9 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
+import os
+import random
 import psutil
 
 app = FastAPI()
@@ -7,11 +11,55 @@ app = FastAPI()
 # Expose Prometheus metrics at /metrics
 Instrumentator().instrument(app).expose(app)
 
-@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
-async def catch_all(path: str, request: Request):
+# Stand-in behaviour for benchmarks (bench.py sets these per backend):
+#   BACKEND_ID           name reported in responses (default host:port)
+#   BACKEND_DELAY_MS     added service time per request
+#   BACKEND_JITTER_MS    extra uniform random delay on top
+#   BACKEND_ERROR_RATE   fraction of requests answered with a 500
+# A request can also ask for its own with ?delay_ms= / ?fail=1.
+# Long-lived: a WebSocket on any path says hello and echoes; a request with
+# Accept: text/event-stream gets an event every ?interval_ms= (default 1000).
+BACKEND_ID = os.environ.get("BACKEND_ID")
+DELAY = float(os.environ.get("BACKEND_DELAY_MS", 0)) / 1000
+JITTER = float(os.environ.get("BACKEND_JITTER_MS", 0)) / 1000
+ERROR_RATE = float(os.environ.get("BACKEND_ERROR_RATE", 0))
+
+@app.websocket("/{path:path}")
+async def echo(websocket: WebSocket, path: str):
+    await websocket.accept()
+    await websocket.send_json({"server": BACKEND_ID or f"{websocket.url.hostname}:{websocket.url.port}"})
+    try:
+        while True:
+            await websocket.send_text(await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+
+async def events(server, interval):
+    n = 0
+    while True:
+        yield f"id: {n}\ndata: {server}\n\n".encode()
+        n += 1
+        await asyncio.sleep(interval)
+
+@app.api_route("/{path:path}", methods=["GET", "HEAD", "POST", "PUT", "DELETE", "PATCH"])
+async def catch_all(path: str, request: Request, response: Response):
+    server = BACKEND_ID or f"{request.url.hostname}:{request.url.port}"
+    if "text/event-stream" in request.headers.get("accept", ""):
+        interval = float(request.query_params.get("interval_ms", 1000)) / 1000
+        return StreamingResponse(events(server, interval), media_type="text/event-stream",
+                                 headers={"X-Backend": server})
+    delay = DELAY + random.random() * JITTER + float(request.query_params.get("delay_ms", 0)) / 1000
+    if delay:
+        await asyncio.sleep(delay)
+    if request.query_params.get("fail") or random.random() < ERROR_RATE:
+        raise HTTPException(500, "Injected error", headers={"X-Backend": server})
+    body = await request.body()
+    response.headers["X-Backend"] = server
     return {
         "message": f"Hello from backend server!",
+        "server": server,
         "path": path,
         "method": request.method,
-        "body": await request.body()
+        # the size only: echoing large benchmark payloads would dominate the timing
+        "body_bytes": len(body),
     }
@@ -0,0 +1,341 @@
+"""
+Load-generation benchmark: starts stand-in backends (backend.py) and each
+balancer variant in turn, drives it open-loop and writes a JSON report.
+
+    python bench.py --rate 300 --duration 20 --delays 5,5,40
+    python bench.py --mode ramp --rate 50 --ramp-to 1000 --variants custom1,main2
+    python bench.py --rate 2000 --variants custom1,asgi_proxy     # rps per LB core
+
+rps/core is successful requests per CPU-second used by the balancer
+process (and its workers) during the measured run, so variants can be
+compared even when the box is saturated.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import psutil
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+VARIANTS = ("main1", "main2", "main3", "custom", "custom1", "asgi_proxy")
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+# ------------------------------------------------
+# LATENCY HISTOGRAM
+# ------------------------------------------------
+class LatencyHistogram:
+    """
+    HDR-style: log-spaced buckets `precision` apart (1% by default), so any
+    percentile is within that relative error, in constant memory.
+    """
+
+    def __init__(self, lowest=1e-5, highest=120.0, precision=0.01):
+        self.lowest = lowest
+        self.log_base = math.log1p(precision)
+        self.counts = [0] * (self._index(highest) + 1)
+        self.total = 0
+        self.max = 0.0
+        self.sum = 0.0
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self.log_base) + 1
+
+    def record(self, value):
+        self.counts[min(self._index(value), len(self.counts) - 1)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.total:
+            return 0.0
+        target = math.ceil(p / 100 * self.total)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                # upper edge of the bucket, never above the real maximum
+                return min(self.lowest * math.exp(i * self.log_base), self.max)
+        return self.max
+
+    def summary(self):
+        out = {f"p{p:g}": round(self.percentile(p) * 1000, 3) for p in PERCENTILES}
+        out["mean"] = round(self.sum / self.total * 1000, 3) if self.total else 0.0
+        out["max"] = round(self.max * 1000, 3)
+        return out  # milliseconds
+
+
+def jain_index(counts):
+    """Jain's fairness index: 1.0 = perfectly even, 1/n = all on one backend."""
+    if not counts or not any(counts):
+        return 0.0
+    return sum(counts) ** 2 / (len(counts) * sum(c * c for c in counts))
+
+
+# ------------------------------------------------
+# PROCESSES
+# ------------------------------------------------
+def _uvicorn(app, port, cwd, env=None, workers=1):
+    cmd = [sys.executable, "-m", "uvicorn", f"{app}:app", "--app-dir", REPO,
+           "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    return subprocess.Popen(cmd, cwd=cwd, env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def _wait_ready(url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _stop(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(5)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def _cpu_seconds(proc):
+    """User + system CPU of a process and its children (uvicorn workers)."""
+    try:
+        p = psutil.Process(proc.pid)
+        procs = [p, *p.children(recursive=True)]
+    except psutil.NoSuchProcess:
+        return 0.0
+    total = 0.0
+    for q in procs:
+        try:
+            t = q.cpu_times()
+            total += t.user + t.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def _per_backend(values, n, default):
+    values = [v for v in (values or "").split(",") if v]
+    return [float(values[i % len(values)]) if values else default for i in range(n)]
+
+
+# ------------------------------------------------
+# LOAD GENERATOR
+# ------------------------------------------------
+def arrival_times(mode, rate, duration, ramp_to=None):
+    """Send offsets in seconds: evenly spaced, or with the rate rising linearly."""
+    if mode == "constant":
+        return [i / rate for i in range(int(rate * duration))]
+    # rate(t) = r0 + (r1 - r0) t / T; invert the cumulative count for each send
+    r0, r1 = rate, ramp_to or rate * 10
+    a = (r1 - r0) / (2 * duration)
+    total = int((r0 + r1) / 2 * duration)
+    if a == 0:
+        return [i / r0 for i in range(total)]
+    return [(-r0 + math.sqrt(r0 * r0 + 4 * a * i)) / (2 * a) for i in range(total)]
+
+
+async def drive(url, offsets, concurrency, payload, timeout):
+    """
+    Open loop: request i is sent at offsets[i] whether or not earlier ones
+    finished, and its latency counts from that scheduled time (no
+    coordinated omission). Sends beyond `concurrency` outstanding are
+    counted as dropped instead of queued.
+    """
+    hist = LatencyHistogram()
+    backends = Counter()
+    status = Counter()
+    errors = Counter()
+    dropped = 0
+    outstanding = 0
+    body = os.urandom(payload) if payload else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def one(scheduled):
+            nonlocal outstanding
+            try:
+                if body is None:
+                    r = await client.get(url)
+                else:
+                    r = await client.post(url, content=body)
+                hist.record(time.perf_counter() - scheduled)
+                status[r.status_code] += 1
+                backend = r.headers.get("x-backend")
+                if backend:
+                    backends[backend] += 1
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            finally:
+                outstanding -= 1
+
+        tasks = []
+        start = time.perf_counter()
+        for offset in offsets:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if outstanding >= concurrency:
+                dropped += 1
+                continue
+            outstanding += 1
+            tasks.append(asyncio.create_task(one(start + offset)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    ok = sum(n for code, n in status.items() if code < 400)
+    return {
+        "sent": len(tasks),
+        "dropped": dropped,
+        "ok": ok,
+        "status": {str(k): v for k, v in sorted(status.items())},
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": hist.summary(),
+        "backends": dict(sorted(backends.items())),
+    }
+
+
+# ------------------------------------------------
+# RUN
+# ------------------------------------------------
+async def run_variant(name, args, workdir, backend_ids):
+    port = args.lb_port
+    env = {"LB_SERVERS_FILE": os.path.join(workdir, "servers.json")}
+    env.update(dict(kv.split("=", 1) for kv in args.env))
+    lb = _uvicorn(name, port, workdir, env, args.workers)
+    try:
+        await _wait_ready(f"http://localhost:{port}/")
+        url = f"http://localhost:{port}/{args.path.lstrip('/')}"
+        if args.warmup:
+            await drive(url, arrival_times("constant", args.rate, args.warmup), args.concurrency, args.payload, args.timeout)
+        cpu = _cpu_seconds(lb)
+        result = await drive(url, arrival_times(args.mode, args.rate, args.duration, args.ramp_to),
+                             args.concurrency, args.payload, args.timeout)
+        cpu = _cpu_seconds(lb) - cpu
+    finally:
+        _stop([lb])
+    result["lb_cpu_s"] = round(cpu, 3)
+    result["rps_per_core"] = round(result["ok"] / cpu, 1) if cpu > 0 else None
+    counts = [result["backends"].get(b, 0) for b in backend_ids]
+    result["fairness"] = {
+        "jain": round(jain_index(counts), 4),
+        "max_min_ratio": round(max(counts) / min(counts), 3) if min(counts) else None,
+    }
+    return result
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="lb-bench-")
+    n = args.backends
+    delays = _per_backend(args.delays, n, 0.0)
+    jitters = _per_backend(args.jitters, n, 0.0)
+    error_rates = _per_backend(args.error_rates, n, 0.0)
+    ports = [args.backend_port + i for i in range(n)]
+    backend_ids = [f"b{i}" for i in range(n)]
+    with open(os.path.join(workdir, "servers.json"), "w") as f:
+        json.dump([{"url": f"http://localhost:{p}"} for p in ports], f)
+
+    backends = [
+        _uvicorn("backend", port, workdir, {
+            "BACKEND_ID": bid,
+            "BACKEND_DELAY_MS": str(delay),
+            "BACKEND_JITTER_MS": str(jitter),
+            "BACKEND_ERROR_RATE": str(rate),
+        })
+        for port, bid, delay, jitter, rate in zip(ports, backend_ids, delays, jitters, error_rates)
+    ]
+    report = {
+        "config": {
+            "mode": args.mode, "rate": args.rate, "ramp_to": args.ramp_to, "duration_s": args.duration,
+            "concurrency": args.concurrency, "payload_bytes": args.payload, "path": args.path,
+            "workers": args.workers, "env": args.env,
+            "backends": [
+                {"id": bid, "port": p, "delay_ms": d, "jitter_ms": j, "error_rate": e}
+                for bid, p, d, j, e in zip(backend_ids, ports, delays, jitters, error_rates)
+            ],
+        },
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "variants": {},
+    }
+    try:
+        await asyncio.gather(*(_wait_ready(f"http://localhost:{p}/") for p in ports))
+        for name in args.variants.split(","):
+            print(f"--- {name}", file=sys.stderr)
+            try:
+                report["variants"][name] = await run_variant(name, args, workdir, backend_ids)
+            except Exception as e:
+                report["variants"][name] = {"error": str(e)}
+    finally:
+        _stop(backends)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print_table(report)
+    print(f"\nreport written to {args.report}")
+
+
+def print_table(report):
+    cols = ("variant", "ok", "drop", "err", "rps", "rps/core", "p50", "p99", "p99.9", "max", "jain")
+    print(("{:<11}" + "{:>9}" * (len(cols) - 1)).format(*cols))
+    for name, r in report["variants"].items():
+        if "error" in r:
+            print(f"{name:<11} failed: {r['error']}")
+            continue
+        lat = r["latency_ms"]
+        errs = sum(r["errors"].values()) + sum(v for k, v in r["status"].items() if int(k) >= 400)
+        print(("{:<11}" + "{:>9}" * (len(cols) - 1)).format(
+            name, r["ok"], r["dropped"], errs, r["throughput_rps"], r["rps_per_core"],
+            lat["p50"], lat["p99"], lat["p99.9"], lat["max"], r["fairness"]["jain"],
+        ))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--variants", default=",".join(VARIANTS), help="comma-separated app modules to compare")
+    p.add_argument("--mode", choices=("constant", "ramp"), default="constant")
+    p.add_argument("--rate", type=float, default=200.0, help="requests/s (start rate when ramping)")
+    p.add_argument("--ramp-to", type=float, help="final requests/s in ramp mode (default 10x --rate)")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds of measured load per variant")
+    p.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured load first")
+    p.add_argument("--concurrency", type=int, default=256, help="max outstanding requests")
+    p.add_argument("--payload", type=int, default=0, help="POST body bytes (0 = GET)")
+    p.add_argument("--path", default="/bench")
+    p.add_argument("--timeout", type=float, default=10.0)
+    p.add_argument("--backends", type=int, default=3)
+    p.add_argument("--delays", default="", help="per-backend delay ms, e.g. 5,5,50 (cycled)")
+    p.add_argument("--jitters", default="", help="per-backend random extra delay ms")
+    p.add_argument("--error-rates", default="", help="per-backend 500 rate, e.g. 0,0,0.1")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn workers per balancer")
+    p.add_argument("--env", action="append", default=[], metavar="K=V", help="extra env for the balancer")
+    p.add_argument("--lb-port", type=int, default=8080)
+    p.add_argument("--backend-port", type=int, default=8001)
+    p.add_argument("--report", default="bench_report.json")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
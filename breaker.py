@@ -0,0 +1,150 @@
+import time
+
+# ------------------------------------------------
+# CIRCUIT BREAKERS / OUTLIER EJECTION
+# ------------------------------------------------
+# Driven by real traffic: consecutive 5xx, connect errors and latency
+# outliers trip a backend's breaker. An open breaker ejects the backend for
+# base_ejection * 2^(n-1) seconds (n = ejections in a row, capped), then
+# lets a single trial request through (half-open) to decide whether to
+# close again or re-open for longer. At most max_ejected_fraction of the
+# pool can be ejected at once, so a bad deploy can't empty it.
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Breaker:
+    __slots__ = ("state", "failures", "ejections", "until", "trial", "closed_since")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.ejections = 0
+        self.until = 0.0
+        self.trial = False
+        self.closed_since = 0.0
+
+
+class Breakers:
+    def __init__(self, urls, threshold=5, base_ejection=5.0, max_ejection=300.0,
+                 max_ejected_fraction=0.5, outlier_factor=5.0, on_change=None):
+        self.threshold = threshold
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.max_ejected_fraction = max_ejected_fraction
+        self.outlier_factor = outlier_factor
+        self.on_change = on_change
+        self._b = {url: Breaker() for url in urls}
+        self._ejected = set()
+        self._next_expiry = float("inf")
+
+    def __getitem__(self, url):
+        return self._b[url]
+
+    def __contains__(self, url):
+        return url in self._b
+
+    def add(self, url):
+        self._b.setdefault(url, Breaker())
+
+    def remove(self, url):
+        self._b.pop(url, None)
+        self._ejected.discard(url)
+
+    @property
+    def ejected(self):
+        """Backends currently open (not half-open)."""
+        return self._ejected
+
+    def is_outlier(self, rtt: float, expected: float) -> bool:
+        """rtt far above what the request was expected to take (0 = unknown)."""
+        return expected > 0 and rtt > self.outlier_factor * expected
+
+    def poll(self, now: float = None):
+        """Move expired ejections to half-open; O(1) unless one is due."""
+        now = time.monotonic() if now is None else now
+        if now < self._next_expiry:
+            return
+        nxt = float("inf")
+        for url in list(self._ejected):
+            b = self._b[url]
+            if b.until <= now:
+                b.state, b.trial = HALF_OPEN, False
+                self._ejected.discard(url)
+            else:
+                nxt = min(nxt, b.until)
+        self._next_expiry = nxt
+        self._changed()
+
+    def allow(self, url) -> bool:
+        """Whether a request may go to `url` now; claims the half-open trial."""
+        b = self._b[url]
+        if b.state == CLOSED:
+            return True
+        if b.state == HALF_OPEN and not b.trial:
+            b.trial = True
+            return True
+        return False
+
+    def release(self, url):
+        """Give back a half-open trial claimed by allow() that ended with no outcome."""
+        b = self._b.get(url)
+        if b is not None and b.state == HALF_OPEN:
+            b.trial = False
+
+    def record(self, url, ok: bool, now: float = None):
+        now = time.monotonic() if now is None else now
+        b = self._b.get(url)
+        if b is None:
+            return  # removed from the pool while the request was in flight
+        if ok:
+            if b.state == HALF_OPEN:
+                b.state, b.trial, b.closed_since = CLOSED, False, now
+            elif b.ejections and now - b.closed_since > self.max_ejection:
+                b.ejections = 0  # stable for a while: forget past ejections
+            b.failures = 0
+            return
+        b.failures += 1
+        if b.state == HALF_OPEN or (b.state == CLOSED and b.failures >= self.threshold):
+            self._trip(url, b, now)
+
+    def _trip(self, url, b, now):
+        if b.state == CLOSED and len(self._ejected) + 1 > self.max_ejected_fraction * len(self._b):
+            return  # ejection cap reached: keep serving from it
+        b.ejections += 1
+        b.state, b.trial, b.failures = OPEN, False, 0
+        b.until = now + min(self.base_ejection * 2 ** (b.ejections - 1), self.max_ejection)
+        self._ejected.add(url)
+        self._next_expiry = min(self._next_expiry, b.until)
+        self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+
+# ------------------------------------------------
+# RETRY BUDGET
+# ------------------------------------------------
+class RetryBudget:
+    """
+    Retries may add at most `ratio` extra load on top of first attempts,
+    plus a small `min_per_sec` allowance so low-traffic services can retry.
+    """
+
+    def __init__(self, ratio=0.2, min_per_sec=10.0, cap=20.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.cap = cap
+        self.tokens = 0.0
+        self._stamp = time.monotonic()
+
+    def deposit(self):
+        now = time.monotonic()
+        self.tokens = min(self.cap, self.tokens + self.ratio + (now - self._stamp) * self.min_per_sec)
+        self._stamp = now
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from fastapi.responses import Response
+
+# ------------------------------------------------
+# RESPONSE CACHE
+# ------------------------------------------------
+# In-process LRU of small upstream responses, bounded by entry count and
+# total bytes. Freshness comes from the response's Cache-Control /
+# Expires; a per-path TTL (longest prefix wins) covers responses that say
+# nothing. Concurrent misses for the same key share one upstream request.
+#
+# The only Vary accepted is Accept-Encoding, which is part of the key.
+# Requests with Authorization or Cookie only store, and are only served,
+# responses marked public or s-maxage (shareable between users).
+CACHEABLE_METHODS = frozenset({"GET", "HEAD"})
+CACHEABLE_STATUS = frozenset({200, 203, 301, 404})
+
+
+class Entry:
+    __slots__ = ("status", "headers", "body", "expires", "stored", "size", "shared")
+
+    def __init__(self, status, headers, body, ttl, shared=False):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.shared = shared  # may be served to requests with credentials
+        self.stored = time.time()
+        self.expires = self.stored + ttl
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+
+def _directives(value: str) -> dict:
+    out = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            out[name.lower()] = arg.strip('"')
+    return out
+
+
+class ResponseCache:
+    def __init__(self, max_entries=10_000, max_bytes=64 << 20, max_entry_bytes=1 << 20, path_ttls=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # longest prefix first
+        self.path_ttls = sorted((path_ttls or {}).items(), key=lambda kv: -len(kv[0]))
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---- policy -------------------------------------------------------
+    @staticmethod
+    def key(request) -> str:
+        # Accept-Encoding is part of the key: a gzip body is only replayed to
+        # clients that asked for gzip
+        enc = ",".join(sorted(e.strip() for e in request.headers.get("accept-encoding", "").lower().split(",") if e.strip()))
+        return f"{request.method} {request.url.path}?{request.url.query} {enc}"
+
+    @staticmethod
+    def credentialed(request) -> bool:
+        return "authorization" in request.headers or "cookie" in request.headers
+
+    @staticmethod
+    def shared(headers) -> bool:
+        """The response may be stored for, and served to, requests with credentials."""
+        cc = _directives(headers.get("cache-control", ""))
+        return "public" in cc or "s-maxage" in cc
+
+    @staticmethod
+    def bypass(request) -> bool:
+        """Client asked for a fresh answer."""
+        cc = _directives(request.headers.get("cache-control", ""))
+        return "no-cache" in cc or "no-store" in cc or request.headers.get("pragma") == "no-cache"
+
+    def ttl(self, path: str, status: int, headers, credentialed: bool = False) -> float:
+        """Seconds `resp` may be served from cache (0 = don't store)."""
+        if status not in CACHEABLE_STATUS or "set-cookie" in headers:
+            return 0.0
+        if credentialed and not self.shared(headers):
+            return 0.0  # possibly personalised
+        if headers.get("vary", "").strip().lower() not in ("", "accept-encoding"):
+            return 0.0
+        cc = _directives(headers.get("cache-control", ""))
+        if "no-store" in cc or "private" in cc or "no-cache" in cc:
+            return 0.0
+        for name in ("s-maxage", "max-age"):
+            if name in cc:
+                try:
+                    return max(float(cc[name]), 0.0)
+                except ValueError:
+                    return 0.0
+        if "expires" in headers:
+            try:
+                return max(parsedate_to_datetime(headers["expires"]).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return 0.0  # invalid Expires means already expired
+        for prefix, ttl in self.path_ttls:
+            if path.startswith(prefix):
+                return float(ttl)
+        return 0.0
+
+    # ---- storage ------------------------------------------------------
+    def get(self, key, credentialed=False):
+        entry = self._entries.get(key)
+        if entry is None or (credentialed and not entry.shared):
+            return None
+        if entry.expires <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key).size
+
+    async def fetch(self, key, loader, on_coalesce=None):
+        """
+        Run `loader()` once per key at a time; concurrent callers wait for
+        the leader's result. Returns (result, leader) so waiters can tell
+        they got a shared answer. If the leader is cancelled, a waiter runs
+        `loader()` in its place.
+        """
+        fut = self._inflight.get(key)
+        if fut is not None and on_coalesce:
+            on_coalesce()
+        while fut is not None:
+            try:
+                return await asyncio.shield(fut), False
+            except asyncio.CancelledError:
+                # the leader's client went away, not ours: take over the load
+                if not fut.cancelled() or _cancelling():
+                    raise
+            fut = self._inflight.get(key)
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody was waiting
+            raise
+        else:
+            fut.set_result(result)
+            return result, True
+        finally:
+            del self._inflight[key]
+
+
+def _cancelling() -> bool:
+    task = asyncio.current_task()
+    return bool(task and getattr(task, "cancelling", lambda: 0)())
+
+
+def respond(entry: Entry) -> Response:
+    response = Response(content=entry.body, status_code=entry.status)
+    response.raw_headers = entry.headers + [(b"age", str(int(time.time() - entry.stored)).encode())]
+    return response
@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import hmac
+import heapq
+import json
+import logging
+import random
+import socket
+import time
+import zlib
+
+import latency
+from affinity import stable_hash
+
+# ------------------------------------------------
+# CLUSTER MODE (UDP gossip between LB instances)
+# ------------------------------------------------
+# Every `interval` seconds each instance sends a digest to `fanout` random
+# live peers (to the seed addresses while it knows none): its membership
+# view (node -> address, heartbeat) and, per backend, the newest probe
+# result it knows of, its own latency EWMA, in-flight count and breaker
+# ejection. Membership spreads transitively from the seeds; a node whose
+# heartbeat hasn't moved for `dead_after` seconds is dropped.
+#
+# Probing is shared out by rendezvous hashing: a backend is probed by the
+# `replicas` live nodes with the highest hash(node, url). Probe results are
+# relayed with their age, and every node keeps the newest one it has
+# heard, so a backend going down is found once and known cluster-wide
+# within a few rounds. When a node dies its backends move to the next
+# nodes in hash order.
+#
+# Remote observations merge into the local stats table:
+#   healthy      newest probe result from any node (on_health is called)
+#   latency      a peer's EWMA is fed to latency.observe like a local
+#                sample whenever it has moved since we last took it
+#   peer_active  sum of live peers' in-flight requests (strategies.inflight)
+#   ejections    peer_ejected: backends ejected by at least eject_quorum of
+#                the live peers that route to them (on_ejections is called)
+# Times travel as ages, so peers need no clock sync. With `key` set every
+# datagram carries an HMAC and unsigned or forged ones are dropped. A
+# digest that doesn't fit in one datagram is split by backend; part 0
+# replaces what a peer said before, later parts add to it.
+#
+# With `uvicorn --workers N` one worker binds the port and gossips for the
+# instance. If the stats table is shared it records that worker's pid, and
+# the others probe nothing and read peer ejections from the table (the
+# gossiping worker writes peer_active, peer_ejected and health there);
+# they retry the port, so another worker takes over if it dies. With
+# private tables every worker keeps probing all backends itself.
+VERSION = 1
+MAX_DATAGRAM = 65000
+log = logging.getLogger("lb.cluster")
+_MAC_BYTES = 16
+
+
+class Peer:
+    __slots__ = ("node", "addr", "heartbeat", "seen", "received", "active", "ejected", "latency")
+
+    def __init__(self, node, addr, heartbeat, now):
+        self.node = node
+        self.addr = addr
+        self.heartbeat = heartbeat  # (incarnation, counter)
+        self.seen = now  # when its heartbeat last moved
+        self.received = 0.0  # when its own digest last arrived
+        self.active = {}  # url -> its in-flight requests
+        self.ejected = set()
+        self.latency = {}  # url -> stamp of the EWMA we last took
+
+
+class Cluster:
+    def __init__(self, stats, urls, bind=("0.0.0.0", 7946), seeds=(), node=None, key=None,
+                 interval=0.5, fanout=3, replicas=2, dead_after=None, stale_after=None,
+                 eject_quorum=0.5, ejected=None):
+        """
+        `urls` is the live member list (read on every round), `ejected()`
+        this instance's breaker-ejected set.
+        """
+        self.stats = stats
+        self.urls = urls
+        self.bind = bind
+        self.seeds = [s for s in seeds if s != bind]
+        host = bind[0] if bind[0] not in ("0.0.0.0", "::", "") else socket.gethostname()
+        self.node = node or f"{host}:{bind[1]}"
+        self.key = key.encode() if isinstance(key, str) else key
+        self.interval = interval
+        self.fanout = fanout
+        self.replicas = replicas
+        self.dead_after = dead_after or 10 * interval
+        self.stale_after = stale_after or 4 * interval
+        self.eject_quorum = eject_quorum
+        self.ejected = ejected
+        self.on_health = None  # on_health(url, ok): a remote probe result changed it
+        self.on_members = None  # on_members(): live membership (probe ownership) changed
+        self.on_ejections = None  # on_ejections(): peer_ejected changed
+        self.peers = {}  # node -> Peer, dead ones kept as tombstones
+        self.probes = {}  # url -> (ok, when): newest probe result heard
+        self.peer_ejected = set()
+        self.sent = self.received = self.dropped = 0
+        self._heartbeat = [time.time_ns() // 1_000_000, 0]
+        self._live = frozenset()
+        self._transport = None
+        self._task = None
+
+    # ---- membership ----------------------------------------------------
+    def live(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [p for p in self.peers.values() if now - p.seen < self.dead_after]
+
+    def owners(self, url, nodes=None):
+        """The nodes that probe url: top `replicas` by rendezvous hash."""
+        nodes = nodes or [self.node, *self._live]
+        return heapq.nlargest(self.replicas, nodes, key=lambda n: stable_hash(f"{n}|{url}"))
+
+    def owned(self, urls):
+        """The part of urls this node probes (all of them while it is alone)."""
+        if self._transport is None:
+            # another worker of this instance probes for it, if there is one
+            return [] if self.stats.gossiper() else list(urls)
+        if not self._live:
+            return list(urls)
+        nodes = [self.node, *self._live]
+        return [u for u in urls if self.node in self.owners(u, nodes)]
+
+    def _refresh_members(self, now):
+        live = frozenset(p.node for p in self.live(now))
+        if live != self._live:
+            self._live = live
+            if self.on_members:
+                self.on_members()
+        for node in [n for n, p in self.peers.items() if now - p.seen > 10 * self.dead_after]:
+            del self.peers[node]  # tombstone expired
+
+    def ejections(self):
+        """Backends the peers eject, as seen by the gossiping worker."""
+        if self._transport is None and self.stats.gossiper():
+            return {u for u in self.urls if u in self.stats and self.stats[u]["peer_ejected"]}
+        return self.peer_ejected
+
+    # ---- local input ---------------------------------------------------
+    def record_probe(self, url, ok):
+        self.probes[url] = (ok, time.monotonic())
+
+    # ---- wire format ---------------------------------------------------
+    def _digest(self, now):
+        clock = latency.clock()
+        ejected = self.ejected() if self.ejected else ()
+        backends = []
+        for url in self.urls:
+            if url not in self.stats:
+                continue
+            row = self.stats[url]
+            probe = self.probes.get(url)
+            lat = row["latency"]
+            backends.append([
+                url,
+                -1 if probe is None else int(probe[0]),
+                round(now - probe[1], 3) if probe else 0,
+                round(lat, 6),
+                round(max(clock - row["stamp"], 0.0), 3) if lat else 0,
+                row["active"],
+                int(url in ejected),
+            ])
+        members = [[p.node, p.addr[0], p.addr[1], *p.heartbeat] for p in self.live(now)]
+        return {
+            "v": VERSION, "n": self.node, "p": self.bind[1], "h": self._heartbeat,
+            "m": members, "b": backends,
+        }
+
+    def _encode(self, msg):
+        payload = zlib.compress(json.dumps(msg, separators=(",", ":")).encode())
+        if self.key:
+            payload = hmac.new(self.key, payload, hashlib.sha256).digest()[:_MAC_BYTES] + payload
+        return payload
+
+    def _decode(self, data):
+        if self.key:
+            mac, data = data[:_MAC_BYTES], data[_MAC_BYTES:]
+            if not hmac.compare_digest(mac, hmac.new(self.key, data, hashlib.sha256).digest()[:_MAC_BYTES]):
+                return None
+        try:
+            msg = json.loads(zlib.decompress(data))
+        except (zlib.error, ValueError):
+            return None
+        return msg if isinstance(msg, dict) and msg.get("v") == VERSION else None
+
+    # ---- receiving -----------------------------------------------------
+    def datagram_received(self, data, addr):
+        msg = self._decode(data)
+        if msg is None or msg.get("n") == self.node:
+            self.dropped += 1
+            return
+        self.received += 1
+        try:
+            self._merge(msg, addr)
+        except (KeyError, TypeError, ValueError, IndexError):
+            self.dropped += 1
+
+    def _merge(self, msg, addr):
+        now = time.monotonic()
+        sender = self._heard(msg["n"], (addr[0], int(msg["p"])), tuple(msg["h"]), now)
+        for node, host, port, inc, count in msg["m"]:
+            if node != self.node:
+                self._heard(node, (host, port), (inc, count), now)
+        sender.received = now
+        if not msg.get("i"):  # first part of a digest
+            sender.active.clear()
+            sender.ejected.clear()
+
+        members = set(self.urls)
+        clock = latency.clock()
+        changed = []
+        for url, ok, probe_age, lat, lat_age, active, ejected in msg["b"]:
+            if url not in members:
+                continue
+            sender.active[url] = active
+            if ejected:
+                sender.ejected.add(url)
+            if lat:
+                # only when the peer's EWMA moved since we last took it
+                stamp = clock - lat_age
+                if stamp > sender.latency.get(url, float("-inf")) + 1e-3:
+                    sender.latency[url] = stamp
+                    sample = latency.current({"latency": lat, "stamp": stamp}, clock)
+                    latency.observe(self.stats[url], sample, clock)
+            if ok >= 0:
+                when = now - probe_age
+                mine = self.probes.get(url)
+                if mine is None or when > mine[1] + 1e-3:
+                    self.probes[url] = (bool(ok), when)
+                    if bool(self.stats[url]["healthy"]) != bool(ok):
+                        changed.append((url, bool(ok)))
+        for url, ok in changed:
+            if self.on_health:
+                self.on_health(url, ok)
+            else:
+                self.stats[url]["healthy"] = ok
+
+    def _heard(self, node, addr, heartbeat, now):
+        peer = self.peers.get(node)
+        if peer is None:
+            peer = self.peers[node] = Peer(node, addr, heartbeat, now)
+        elif heartbeat > peer.heartbeat:
+            peer.heartbeat, peer.seen, peer.addr = heartbeat, now, addr
+        return peer
+
+    # ---- sending -------------------------------------------------------
+    def _round(self):
+        now = time.monotonic()
+        self._heartbeat[1] += 1
+        self._refresh_members(now)
+        self._apply(now)
+        live = self.live(now)
+        targets = [p.addr for p in random.sample(live, min(self.fanout, len(live)))]
+        if not live:
+            targets = list(self.seeds)
+        elif self.seeds and random.random() < 0.1:
+            targets.append(random.choice(self.seeds))  # heal partitions / find restarted seeds
+        if not targets:
+            return
+        for data in self._datagrams(now):
+            for addr in targets:
+                self._transport.sendto(data, addr)
+                self.sent += 1
+
+    def _datagrams(self, now):
+        """The digest encoded, split by backend into parts that fit MAX_DATAGRAM."""
+        msg = self._digest(now)
+        backends = msg["b"]
+        parts = 1
+        while True:
+            size = -(-len(backends) // parts)
+            out = [self._encode({**msg, "b": backends[i:i + size], "i": k})
+                   for k, i in enumerate(range(0, max(len(backends), 1), size or 1))]
+            if all(len(d) <= MAX_DATAGRAM for d in out):
+                return out
+            if size <= 1:
+                raise ValueError(f"cluster digest part is over {MAX_DATAGRAM} bytes with a single backend")
+            parts *= 2
+
+    def _apply(self, now):
+        """Fold fresh peers' in-flight counts and ejections into local state."""
+        fresh = [p for p in self.peers.values() if now - p.received < self.stale_after]
+        for url in self.urls:
+            if url in self.stats:
+                self.stats[url]["peer_active"] = sum(p.active.get(url, 0) for p in fresh)
+        ejected = set()
+        for url in self.urls:
+            routing = [p for p in fresh if url in p.active]
+            votes = sum(url in p.ejected for p in routing)
+            if votes and votes >= self.eject_quorum * len(routing):
+                ejected.add(url)
+            if url in self.stats:
+                self.stats[url]["peer_ejected"] = url in ejected  # for the other workers
+        if ejected != self.peer_ejected:
+            self.peer_ejected = ejected
+            if self.on_ejections:
+                self.on_ejections()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+            try:
+                self._round()
+            except Exception:
+                log.exception("cluster gossip round failed")
+
+    # ---- lifecycle -----------------------------------------------------
+    async def start(self):
+        if not await self._bind():
+            # e.g. another uvicorn worker holds the port: stand by for it
+            log.info("cluster port %s:%s is taken; not gossiping from this process", *self.bind)
+            self._task = asyncio.create_task(self._standby())
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def _bind(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _Protocol(self), local_addr=self.bind)
+        except OSError:
+            return False
+        self.stats.set_gossiper()
+        return True
+
+    async def _standby(self):
+        gossiper = self.stats.gossiper()
+        while True:
+            await asyncio.sleep(4 * self.interval * random.uniform(0.9, 1.1))
+            if not self.stats.gossiper() and await self._bind():
+                log.info("cluster: gossiping from this process now")
+                self._task = asyncio.create_task(self._run())
+                if self.on_members:
+                    self.on_members()
+                return
+            if bool(self.stats.gossiper()) != bool(gossiper):
+                gossiper = self.stats.gossiper()
+                if self.on_members:
+                    self.on_members()  # owned() changed
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self.stats.set_gossiper(False)
+
+    def export(self):
+        now = time.monotonic()
+        return {
+            "node": self.node,
+            "peers": [
+                {"node": p.node, "addr": f"{p.addr[0]}:{p.addr[1]}", "live": p.node in self._live,
+                 "last_seen": round(now - p.seen, 3)}
+                for p in self.peers.values()
+            ],
+            "probed_here": self.owned(self.urls),
+            "gossiping": self._transport is not None,
+            "peer_ejected": sorted(self.ejections()),
+        }
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def datagram_received(self, data, addr):
+        self.cluster.datagram_received(data, addr)
+
+
+def parse_addr(text, default_port=7946):
+    host, _, port = text.strip().rpartition(":")
+    return (host or "0.0.0.0", int(port)) if port.isdigit() else (text.strip(), default_port)
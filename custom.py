@@ -1,12 +1,21 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 import httpx
 import json
 import time
 from threading import Lock
 from typing import Dict
 import asyncio
+import os
 import psutil
 from prometheus_fastapi_instrumentator import Instrumentator
+import streaming
+import strategies
+import affinity
+import latency
+import probe
+import upstream
+import routes
+import ratelimit
 
 app = FastAPI()
 Instrumentator().instrument(app).expose(app)
@@ -22,8 +31,10 @@ server_stats: Dict[str, Dict] = {
     url: {
         "cpu": 0.0,
         "mem": 0.0,
-        "latency_avg": 0.0,
-        "active_connections": 0,
+        "latency": 0.0,  # peak EWMA, see latency.py
+        "stamp": 0.0,
+        "active": 0,
+        "work": 0.0,  # learned route cost of the requests in flight, see routes.py
         "healthy": True,
         "last_ping": 0.0
     } for url in server_urls
@@ -34,66 +45,80 @@ stats_lock = Lock()
 # =======================
 # HEALTH + METRIC PINGER
 # =======================
-async def collect_metrics():
-    while True:
-        for url in server_urls:
-            try:
-                start = time.perf_counter()
-                async with httpx.AsyncClient(timeout=1.0) as client:
-                    res = await client.get(f"{url}/metrics")
-                latency = time.perf_counter() - start
-
-                if res.status_code == 200:
-                    data = res.json()
-                    with stats_lock:
-                        server_stats[url].update({
-                            "cpu": data.get("cpu", 0.0),
-                            "mem": data.get("mem", 0.0),
-                            "healthy": True,
-                            "latency_avg": latency,
-                            "last_ping": time.time()
-                        })
-                else:
-                    server_stats[url]["healthy"] = False
-
-            except Exception:
-                with stats_lock:
-                    server_stats[url]["healthy"] = False
-
-        await asyncio.sleep(5)
+# one pooled client for all probes; scheduling is in probe.py
+probe_client = httpx.AsyncClient(timeout=1.0)
+# proxied requests get a pooled, pre-warmed connection set per backend (upstream.py)
+upstream_pools = upstream.Pools(server_urls)
+
+async def check_server(url, timeout):
+    res = await probe_client.get(f"{url}/metrics", timeout=timeout)
+    res.raise_for_status()
+    try:
+        data = res.json()
+    except ValueError:
+        data = None  # Prometheus text format: up, but no cpu/mem figures
+    return data if isinstance(data, dict) else {}
+
+def record_probe(url, ok, data, rtt):
+    with stats_lock:
+        stats = server_stats[url]
+        changed = stats["healthy"] != ok
+        stats["healthy"] = ok
+        if isinstance(data, dict):  # this probe succeeded
+            stats.update({
+                "cpu": data.get("cpu", 0.0),
+                "mem": data.get("mem", 0.0),
+                "last_ping": time.time()
+            })
+            latency.observe(stats, rtt)
+    if changed:
+        strategy.on_health_change([u for u in server_urls if server_stats[u]["healthy"]])
+
+prober = probe.ProbeScheduler(check_server, record_probe, server_urls)
 
 @app.on_event("startup")
 async def startup():
-    asyncio.create_task(collect_metrics())
+    prober.start()
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await prober.stop()
+    await probe_client.aclose()
+    await upstream_pools.aclose()
 
 # ===============
 # SERVER CHOICE
 # ===============
-def choose_server(method: str, size: int, client_ip: str):
+# path -> backend pool and learned per-route cost (LB_ROUTES_FILE, loaded once)
+router = routes.Router(os.environ.get("LB_ROUTES_FILE"))
+router.reload()
+
+# cpu/mem/latency score with a stronger localhost preference than custom1;
+# with routes, balance on outstanding route cost instead
+CUSTOM_SCORING = {"weights": {"cpu": 0.4, "mem": 0.3, "latency": 0.3}, "local_bonus": 0.2, "jitter": 0.0}
+strategy_name = os.environ.get("LB_STRATEGY") or ("least_work" if router.path else "scored")
+strategy = strategies.get_strategy(strategy_name, **(CUSTOM_SCORING if strategy_name == "scored" else {}))
+# maglev affinity key: client_ip | path | header:<name>
+AFFINITY_KEY = os.environ.get("LB_AFFINITY_KEY") or "client_ip"
+
+def choose_server(method: str, size: int, client_ip: str, key: str = None, pool: str = None):
+    members = router.pools.get(pool) if pool else None
     with stats_lock:
-        candidates = [url for url in server_urls if server_stats[url]["healthy"]]
+        candidates = [url for url in server_urls if server_stats[url]["healthy"] and (members is None or url in members)]
         if not candidates:
             raise Exception("No healthy servers available")
 
-        # Simple scoring
-        def score(url):
-            cpu = server_stats[url]["cpu"]
-            mem = server_stats[url]["mem"]
-            latency = server_stats[url]["latency_avg"]
-            load_score = cpu * 0.4 + mem * 0.3 + latency * 0.3
-
-            # Add weight if POST or large request
-            if method.upper() == "POST" or size > 100000:
-                load_score += 1.0
+        return strategy.pick(candidates, server_stats, method, size, key or client_ip)
 
-            # (Fake) geolocation: prioritize localhost for now
-            if "127.0.0.1" in url or "localhost" in url:
-                load_score -= 0.2
-
-            return load_score
-
-        sorted_servers = sorted(candidates, key=score)
-        return sorted_servers[0]
+# per-client token buckets: LB_RATE_LIMIT requests/s (0 = off), LB_RATE_BURST,
+# keyed by the LB_CLIENT_KEY_HEADER header when sent, else the client IP
+rate_limiter = ratelimit.RateLimiter(
+    rate=float(os.environ.get("LB_RATE_LIMIT", 0)),
+    burst=float(os.environ.get("LB_RATE_BURST", 0)) or None,
+    header=os.environ.get("LB_CLIENT_KEY_HEADER"),
+)
 
 # ==============
 # PROXY ROUTING
@@ -101,25 +126,34 @@ def choose_server(method: str, size: int, client_ip: str):
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
     client_ip = request.client.host
+    wait = rate_limiter.take(*rate_limiter.classify(request))
+    if wait:
+        raise HTTPException(429, "Too Many Requests", headers={"Retry-After": str(ratelimit.retry_after(wait))})
     method = request.method
-    body = await request.body()
-    size = len(body)
+    size = streaming.body_size(request)
 
-    backend_url = choose_server(method, size, client_ip)
-    full_url = f"{backend_url}/{path}"
+    route = router.match(path, method)
+    cost = router.cost(route)
+    key = affinity.request_key(request, AFFINITY_KEY)
+    backend_url = choose_server(method, size, client_ip, key, route.pool)
 
     with stats_lock:
-        server_stats[backend_url]["active_connections"] += 1
+        server_stats[backend_url]["active"] += 1
+        server_stats[backend_url]["work"] += cost
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=full_url,
-                headers=request.headers.raw,
-                content=body
-            )
-            return response.json()
-    finally:
+    def release():
         with stats_lock:
-            server_stats[backend_url]["active_connections"] -= 1
+            server_stats[backend_url]["active"] -= 1
+            server_stats[backend_url]["work"] -= cost
+
+    start = time.perf_counter()
+    try:
+        response = await upstream_pools.send(backend_url, path, request)
+        rtt = time.perf_counter() - start
+        latency.observe(server_stats[backend_url], rtt)
+        router.observe(route, rtt)
+    except BaseException:
+        release()
+        prober.poke(backend_url)
+        raise
+    return streaming.relay(response, release)
@@ -1,152 +1,954 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, Response, HTTPException, WebSocket
+from pydantic import BaseModel
 import httpx
 import json
+import hmac
 import time
+import math
 import asyncio
-import random
-from prometheus_fastapi_instrumentator import Instrumentator
+import os
+from lbmetrics import Counter, Gauge, Histogram
+import lbmetrics
+import streaming
+import strategies
+import affinity
+import latency
+import shared_state
+import breaker
+import hedge
+import cache
+import admission
+import registry
+import probe
+import tuner
+import upstream
+import longlived
+import cluster
+import routes
+import ratelimit
 
 app = FastAPI()
-Instrumentator().instrument(app).expose(app)
+# lb_inflight, lb_requests_total{code}, lb_request_duration_seconds
+app.add_middleware(lbmetrics.RequestMetrics)
 
 # ------------------------------------------------
-# CONFIG & CLIENT POOL
+# UPSTREAM POOLS (see upstream.py)
 # ------------------------------------------------
-with open("servers.json") as f:
-    server_urls = [s["url"] for s in json.load(f)]
-
-client = httpx.AsyncClient(
-    timeout=5.0,
-    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+# a connection pool per backend, sized from its weight and recent peak
+# concurrency, pre-warmed on join / recovery and reaped when idle.
+# LB_UPSTREAM_HTTP2=1 negotiates h2 (https backends), =prior speaks h2c;
+# any other value leaves it off.
+upstream_pools = upstream.Pools(
+    timeout=float(os.environ.get("LB_UPSTREAM_TIMEOUT", 5.0)),
+    per_weight=int(os.environ.get("LB_POOL_CONNECTIONS", 20)),
+    max_connections=int(os.environ.get("LB_POOL_MAX", 200)),
+    warm=int(os.environ.get("LB_POOL_WARM", 2)),
+    idle=float(os.environ.get("LB_POOL_IDLE", 30.0)),
+    http2=upstream.http2_mode(os.environ.get("LB_UPSTREAM_HTTP2")),
+    metrics=True,
 )
+# probes get their own small client, so a saturated pool can't fail them
+probe_client = httpx.AsyncClient(timeout=2.0, limits=httpx.Limits(max_connections=64))
 
 @app.on_event("shutdown")
 async def _():
-    await client.aclose()
+    if lb_cluster:
+        lb_cluster.close()
+    await prober.stop()
+    await upstream_pools.aclose()
+    await probe_client.aclose()
+    server_stats.close()
 
 # ------------------------------------------------
-# SHARED STATS + LOCK
+# SHARED STATS
 # ------------------------------------------------
-stats_lock = asyncio.Lock()
-server_stats = {
-    url: {
-        "cpu": 0.0,
-        "mem": 0.0,
-        "latency": 0.0,
-        "active": 0,
-        "healthy": True,
-        "last_ping": time.time(),
-    }
-    for url in server_urls
-}
+# per backend: cpu, mem, latency (peak EWMA, see latency.py), stamp,
+# active, healthy, last_ping, plus registry state (weight, draining,
+# member, max_concurrency, slow start). LB_SHARED_STATE=1 puts the table in shared memory so
+# `uvicorn --workers N` processes all balance on the same counts.
+if os.environ.get("LB_SHARED_STATE"):
+    server_stats = shared_state.StatsTable.shared([])
+else:
+    server_stats = shared_state.StatsTable.local([])
 
 # ------------------------------------------------
-# PARALLEL HEALTH CHECKER
+# BACKEND REGISTRY (servers.json, hot-reloaded)
 # ------------------------------------------------
-async def _check_one(url):
-    start = time.perf_counter()
-    r = await client.get(f"{url}/metrics")
+# backends added later or recovering from a failed probe ramp up to their
+# weight over LB_SLOW_START seconds (0 = off)
+backend_registry = registry.Registry(
+    server_stats, os.environ.get("LB_SERVERS_FILE") or "servers.json",
+    slow_start=float(os.environ.get("LB_SLOW_START", 30.0)),
+)
+backend_registry.reload()
+RELOAD_INTERVAL = float(os.environ.get("LB_RELOAD_INTERVAL", 1.0))
+# current pool, updated in place by sync_backends
+server_urls = backend_registry.members()
+# healthy, not draining and not ejected by a breaker; see refresh_available
+healthy_urls = list(server_urls)
+
+# ------------------------------------------------
+# BACKEND METRICS (see lbmetrics.py, served on /metrics)
+# ------------------------------------------------
+# children are created when a backend joins and dropped when it leaves,
+# so the proxy path only indexes a list and adds
+UPSTREAM_SECONDS = Histogram("lb_upstream_latency_seconds", "Time to upstream response headers", ["backend"])
+UPSTREAM_RESPONSES = Counter(
+    "lb_upstream_responses_total", "Upstream attempts by status class (error: no response)", ["backend", "code"],
+)
+BACKEND_INFLIGHT = Gauge("lb_backend_inflight", "Requests in flight to the backend (all workers)", ["backend"])
+BACKEND_HEALTHY = Gauge("lb_backend_healthy", "1 if the last health probe succeeded", ["backend"])
+BACKEND_EJECTED = Gauge("lb_backend_ejected", "1 while the backend's circuit breaker holds it out", ["backend"])
+BACKEND_STREAMS = Gauge("lb_backend_streams", "Open WebSocket / SSE streams to the backend (all workers)", ["backend"])
+BACKEND_MSG_RATE = Gauge("lb_backend_stream_messages_per_second", "Stream messages/s, EWMA (all workers)", ["backend"])
+BACKEND_WEIGHT = Gauge("lb_backend_effective_weight", "Weight after slow start", ["backend"])
+RESPONSE_CLASSES = (*lbmetrics.STATUS_CLASSES, "error")
+# url -> (latency child, response children indexed like RESPONSE_CLASSES)
+backend_metrics = {}
+
+def _stat(url, field):
+    return server_stats[url][field] if url in server_stats else 0.0
+
+def track_backend(url):
+    if url in backend_metrics:
+        return
+    backend_metrics[url] = (UPSTREAM_SECONDS.labels(url), [UPSTREAM_RESPONSES.labels(url, c) for c in RESPONSE_CLASSES])
+    BACKEND_INFLIGHT.labels(url).set_function(lambda: _stat(url, "active"))
+    BACKEND_HEALTHY.labels(url).set_function(lambda: _stat(url, "healthy"))
+    BACKEND_EJECTED.labels(url).set_function(lambda: url in breakers.ejected)
+    BACKEND_STREAMS.labels(url).set_function(lambda: _stat(url, "streams"))
+    BACKEND_MSG_RATE.labels(url).set_function(lambda: _stat(url, "msg_rate"))
+    BACKEND_WEIGHT.labels(url).set_function(
+        lambda: strategies.effective_weight(server_stats[url]) if url in server_stats else 0.0)
+
+def untrack_backend(url):
+    backend_metrics.pop(url, None)
+    UPSTREAM_SECONDS.remove(url)
+    for c in RESPONSE_CLASSES:
+        UPSTREAM_RESPONSES.remove(url, c)
+    for g in (BACKEND_INFLIGHT, BACKEND_HEALTHY, BACKEND_EJECTED, BACKEND_STREAMS, BACKEND_MSG_RATE, BACKEND_WEIGHT):
+        g.remove(url)
+
+for _url in server_urls:
+    track_backend(_url)
+    upstream_pools.add(_url, server_stats[_url]["weight"])
+
+RETRIES = Counter("lb_retries_total", "Upstream attempts after the first for a request")
+SELECTION_SECONDS = Histogram(
+    "lb_selection_seconds", "Time to rank candidate backends",
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2),
+)
+
+# ------------------------------------------------
+# HEALTH PROBES (see probe.py)
+# ------------------------------------------------
+async def _check_one(url, timeout):
+    r = await probe_client.get(f"{url}/metrics", timeout=timeout)
     r.raise_for_status()
-    latency = time.perf_counter() - start
-    data = r.json()
-    return url, data.get("cpu", 0.0), data.get("mem", 0.0), latency
+    try:
+        data = r.json()
+    except ValueError:
+        data = None  # e.g. a Prometheus text /metrics: reachable, no cpu/mem
+    return data if isinstance(data, dict) else {}
+
+def _probed(url, ok, data, rtt):
+    # ok is the health after rise/fall; data is an exception if this probe failed
+    s = server_stats[url]
+    if isinstance(data, dict):
+        s.update({"cpu": data.get("cpu", 0.0), "mem": data.get("mem", 0.0), "last_ping": time.time()})
+        latency.observe(s, rtt)
+    if lb_cluster:
+        lb_cluster.record_probe(url, ok)
+    set_health(url, ok)
 
-async def collect_metrics():
+def set_health(url, ok):
+    s = server_stats[url]
+    if bool(s["healthy"]) != ok:
+        s["healthy"] = ok
+        if ok:
+            backend_registry.ramp(url)  # slow start: caches are likely cold
+            asyncio.create_task(upstream_pools.warm(url))
+        refresh_available()
+
+# ------------------------------------------------
+# CLUSTER MODE (LB_CLUSTER_BIND=host:port, see cluster.py)
+# ------------------------------------------------
+# LB instances gossip backend state over UDP: each backend is probed by
+# LB_CLUSTER_PROBE_REPLICAS instances instead of all of them, and peers'
+# probe results, latency, in-flight counts and ejections feed selection
+# here. LB_CLUSTER_PEERS lists seed addresses; LB_CLUSTER_KEY signs
+# datagrams. With --workers N one worker gossips for the instance; with
+# LB_SHARED_STATE=1 the others leave probing to it and share its view.
+lb_cluster = None
+if os.environ.get("LB_CLUSTER_BIND"):
+    lb_cluster = cluster.Cluster(
+        server_stats, server_urls,
+        bind=cluster.parse_addr(os.environ["LB_CLUSTER_BIND"]),
+        seeds=[cluster.parse_addr(a) for a in os.environ.get("LB_CLUSTER_PEERS", "").split(",") if a.strip()],
+        node=os.environ.get("LB_CLUSTER_NODE"),
+        key=os.environ.get("LB_CLUSTER_KEY"),
+        interval=float(os.environ.get("LB_CLUSTER_INTERVAL", 0.5)),
+        fanout=int(os.environ.get("LB_CLUSTER_FANOUT", 3)),
+        replicas=int(os.environ.get("LB_CLUSTER_PROBE_REPLICAS", 2)),
+        ejected=lambda: breakers.ejected,
+    )
+    lb_cluster.on_health = set_health
+    lb_cluster.on_members = lambda: prober.set_targets(probe_targets(server_urls))
+    lb_cluster.on_ejections = lambda: refresh_available()
+    Gauge("lb_cluster_peers", "Live LB peers").set_function(lambda: len(lb_cluster.live()))
+    Gauge("lb_cluster_probed_backends", "Backends this instance probes").set_function(lambda: len(prober))
+    CLUSTER_MESSAGES = Counter("lb_cluster_messages_total", "Gossip datagrams", ["direction"])
+    CLUSTER_MESSAGES.labels("sent").set_function(lambda: lb_cluster.sent)
+    CLUSTER_MESSAGES.labels("received").set_function(lambda: lb_cluster.received)
+    CLUSTER_MESSAGES.labels("dropped").set_function(lambda: lb_cluster.dropped)
+
+def probe_targets(urls):
+    return lb_cluster.owned(urls) if lb_cluster else list(urls)
+
+prober = probe.ProbeScheduler(
+    _check_one, _probed, server_urls,
+    base_interval=float(os.environ.get("LB_PROBE_INTERVAL", 2.0)),
+    min_interval=float(os.environ.get("LB_PROBE_MIN_INTERVAL", 0.5)),
+    max_interval=float(os.environ.get("LB_PROBE_MAX_INTERVAL", 5.0)),
+    concurrency=int(os.environ.get("LB_PROBE_CONCURRENCY", 64)),
+    # probes in a row before a backend counts as back up / down
+    rise=int(os.environ.get("LB_PROBE_RISE", 2)),
+    fall=int(os.environ.get("LB_PROBE_FALL", 2)),
+)
+PROBES = Counter("lb_probes_total", "Health probes sent", ["result"])
+PROBE_SECONDS = Histogram("lb_probe_duration_seconds", "Health probe duration")
+PROBES_INFLIGHT = Gauge("lb_probes_inflight", "Health probes outstanding")
+PROBES_INFLIGHT.set_function(lambda: prober.inflight)
+DETECTION = Histogram(
+    "lb_probe_detection_seconds", "Time from a backend's last good probe to the probe that found it down",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0),
+)
+
+def _on_probe(url, ok, seconds):
+    PROBES.labels("ok" if ok else "fail").inc()
+    PROBE_SECONDS.observe(seconds)
+
+prober.on_probe = _on_probe
+prober.on_down = lambda url, seconds: DETECTION.observe(seconds)
+
+def sync_backends():
+    """Bring server_urls, breakers and the candidate list in line with the registry."""
+    members = backend_registry.members()
+    if members != server_urls:
+        for url in set(server_urls) - set(members):
+            breakers.remove(url)
+            untrack_backend(url)
+            upstream_pools.remove(url)
+        for url in members:
+            breakers.add(url)
+            track_backend(url)
+            if url not in upstream_pools:
+                upstream_pools.add(url, server_stats[url]["weight"])
+                asyncio.create_task(upstream_pools.warm(url))
+        server_urls[:] = members
+        prober.set_targets(probe_targets(members))
+    for url in members:
+        upstream_pools.set_weight(url, server_stats[url]["weight"])
+    server_stats.reap()  # drop the counts of workers that died
+    refresh_available()  # also picks up drain flags set by other workers
+
+async def watch_backends():
     while True:
-        tasks = [_check_one(u) for u in server_urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        now = time.time()
-        healthy_any = False
-
-        async with stats_lock:
-            for res in results:
-                if isinstance(res, Exception):
-                    continue
-                url, cpu, mem, lat = res
-                s = server_stats[url]
-                s.update({"cpu": cpu, "mem": mem, "latency": lat, "healthy": True, "last_ping": now})
-                healthy_any = True
-
-            if not healthy_any:
-                # avoid deadlock: mark all healthy
-                for s in server_stats.values():
-                    s["healthy"] = True
-
-        await asyncio.sleep(5)
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            backend_registry.reload()
+        except Exception as e:
+            print(f"servers.json reload failed: {e}")
+        if router.reload():
+            track_routes()
+        sync_backends()
 
 @app.on_event("startup")
 async def _():
-    asyncio.create_task(collect_metrics())
+    refresh_available()  # first pool lists
+    if lb_cluster:
+        await lb_cluster.start()
+    prober.start()
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
+    asyncio.create_task(watch_backends())
+
+# ------------------------------------------------
+# ROUTES AND POOLS (LB_ROUTES_FILE, see routes.py)
+# ------------------------------------------------
+# path patterns -> named backend pools, each route with a learned cost
+# (EWMA of upstream time) that counts as the backend's outstanding "work"
+# while its requests are in flight. Without a routes file every request
+# is the "default" route and may use any backend.
+router = routes.Router(
+    os.environ.get("LB_ROUTES_FILE"),
+    alpha=float(os.environ.get("LB_ROUTE_COST_ALPHA", 0.1)),
+    initial_cost=float(os.environ.get("LB_ROUTE_INITIAL_COST", 0.01)),
+)
+router.reload()
+# pool -> its serving backends; lists are updated in place by refresh_available
+pool_urls = {}
+ROUTE_REQUESTS = Counter("lb_route_requests_total", "Requests by route", ["route"])
+ROUTE_COST = Gauge("lb_route_cost_seconds", "Learned cost (upstream time EWMA) of the route", ["route"])
+route_metrics = {}  # route name -> its ROUTE_REQUESTS child
+
+def track_routes():
+    for name in set(route_metrics) - set(router.routes):
+        route_metrics.pop(name)
+        ROUTE_REQUESTS.remove(name)
+        ROUTE_COST.remove(name)
+    for name, route in router.routes.items():
+        if name not in route_metrics:
+            route_metrics[name] = ROUTE_REQUESTS.labels(name)
+        ROUTE_COST.labels(name).set_function(lambda r=route: router.cost(r))
+
+track_routes()
+
+def route_candidates(route):
+    """Serving backends for the route; [] when its pool has none."""
+    return healthy_urls if route.pool is None else pool_urls.get(route.pool, [])
 
 # ------------------------------------------------
 # SERVER SELECTION
 # ------------------------------------------------
-async def choose_backends(method: str, size: int):
-    # 1) snapshot stats under lock
-    async with stats_lock:
-        snapshot = {
-            url: stats.copy()
-            for url, stats in server_stats.items()
-        }
-
-    # 2) filter healthy (or fallback to all)
-    cand = [u for u, st in snapshot.items() if st["healthy"]]
-    if not cand:
-        cand = list(snapshot.keys())
-
-    # 3) compute scores off‐lock
-    scored = []
-    for url in cand:
-        st = snapshot[url]
-        sc = (
-            st["cpu"] * 0.25
-            + st["mem"] * 0.15
-            + st["latency"] * 0.25
-            + st["active"] * 0.35
-        )
-        if method.upper() == "POST" or size > 100_000:
-            sc += 1.0
-        if "localhost" in url:
-            sc -= 0.1
-        sc += random.random() * 0.05  # jitter
-        scored.append((sc, url))
-
-    # 4) return URLs sorted by score
-    scored.sort(key=lambda x: x[0])
-    return [url for _, url in scored]
+# pick with LB_STRATEGY=p2c|scored|least_connections|least_work|round_robin|random|maglev
+# (least_work by default when routes are configured)
+strategy = strategies.get_strategy(os.environ.get("LB_STRATEGY") or ("least_work" if router.path else "scored"))
+# maglev affinity key: client_ip | path | header:<name>
+AFFINITY_KEY = os.environ.get("LB_AFFINITY_KEY") or "client_ip"
+
+# ------------------------------------------------
+# WEIGHT TUNING (LB_TUNE=1, scored only; see tuner.py)
+# ------------------------------------------------
+weight_tuner = None
+if os.environ.get("LB_TUNE") and isinstance(strategy, strategies.Scored):
+    weight_tuner = tuner.Tuner(
+        strategy,
+        epoch=int(os.environ.get("LB_TUNE_EPOCH", 500)),
+        error_cost=float(os.environ.get("LB_TUNE_ERROR_COST", 1.0)),
+        # learned weights are loaded from here at start and saved in the
+        # background every LB_TUNE_SAVE_INTERVAL seconds while they change;
+        # each worker tunes separately and the last one to save wins
+        state_path=os.environ.get("LB_TUNE_STATE"),
+    )
+    if os.environ.get("LB_TUNE_FREEZE"):
+        weight_tuner.freeze()
+TUNE_SAVE_INTERVAL = float(os.environ.get("LB_TUNE_SAVE_INTERVAL", 10.0))
+tuner_task = None
+
+@app.on_event("startup")
+async def _():
+    global tuner_task
+    if weight_tuner and weight_tuner.state_path:
+        tuner_task = asyncio.create_task(weight_tuner.persist(TUNE_SAVE_INTERVAL))
+
+@app.on_event("shutdown")
+async def _():
+    if tuner_task:
+        tuner_task.cancel()
+        await weight_tuner.flush()
+
+def _scoring_weight(name):
+    if weight_tuner and name in weight_tuner.theta:
+        return weight_tuner.weights()[name]  # learned value, not the perturbed one
+    if name in ("local_bonus", "heavy_penalty"):
+        return getattr(strategy, name)
+    return strategy.weights.get(name, 0.0)
+
+if isinstance(strategy, strategies.Scored):
+    SCORING_WEIGHT = Gauge("lb_scoring_weight", "Scored strategy weights (learned centre when tuning)", ["name"])
+    for _name in [*strategy.weights, "local_bonus", "heavy_penalty"]:
+        SCORING_WEIGHT.labels(_name).set_function(lambda n=_name: _scoring_weight(n))
+if weight_tuner:
+    Gauge("lb_tuner_objective", "Tuner objective of the last epoch: mean latency + error cost").set_function(
+        lambda: weight_tuner.objective or 0.0)
+    Gauge("lb_tuner_updates", "Weight updates made by the tuner").set_function(lambda: weight_tuner.updates)
+    Gauge("lb_tuner_frozen", "1 if the tuner is frozen").set_function(lambda: weight_tuner.frozen)
+
+async def choose_backends(method: str, size: int, key: str = None, urls: list = None):
+    # stats are only mutated on the event loop, so the strategy reads them
+    # in place; the candidate lists are maintained by refresh_available.
+    start = time.perf_counter()
+    breakers.poll()
+    order = strategy.order(healthy_urls if urls is None else urls, server_stats, method, size, key)
+    SELECTION_SECONDS.observe(time.perf_counter() - start)
+    return order
+
+# ------------------------------------------------
+# CIRCUIT BREAKERS + RETRY BUDGET
+# ------------------------------------------------
+def refresh_available():
+    # healthy, not draining and not ejected; if nothing qualifies fall back
+    # to everything not ejected (probes may be wrong), and finally to the
+    # whole pool. Draining backends only come back if all are draining.
+    ejected = breakers.ejected | lb_cluster.ejections() if lb_cluster else breakers.ejected
+    serving = [u for u in server_urls if not server_stats[u]["draining"]] or list(server_urls)
+    avail = [u for u in serving if server_stats[u]["healthy"] and u not in ejected]
+    if not avail:
+        avail = [u for u in serving if u not in ejected] or serving
+    healthy_urls[:] = avail
+    strategy.on_health_change(healthy_urls)
+    for name, members in router.pools.items():
+        # same fallbacks within the pool; a pool never borrows other backends
+        pool_urls.setdefault(name, [])[:] = [u for u in avail if u in members] \
+            or [u for u in serving if u in members and u not in ejected] \
+            or [u for u in serving if u in members]
+    for name in pool_urls.keys() - router.pools.keys():
+        del pool_urls[name]
+    if ADMISSION:
+        admission_ctl.capacity = admission_capacity(healthy_urls)
+        admission_ctl.grant()
+
+breakers = breaker.Breakers(server_urls, on_change=refresh_available)
+retry_budget = breaker.RetryBudget()
+
+# ------------------------------------------------
+# HEDGING (LB_HEDGE=1)
+# ------------------------------------------------
+HEDGING = bool(os.environ.get("LB_HEDGE"))
+route_latency = hedge.RouteLatency(quantile=float(os.environ.get("LB_HEDGE_QUANTILE", 0.95)))
+# hedges may add at most 5% extra requests (plus 1/s)
+hedge_budget = breaker.RetryBudget(ratio=0.05, min_per_sec=1.0, cap=5.0)
+HEDGEABLE = Counter("lb_hedgeable_requests_total", "Idempotent requests eligible for hedging")
+HEDGED = Counter("lb_hedged_requests_total", "Requests that sent a hedge to a second backend")
+HEDGE_WINS = Counter("lb_hedge_wins_total", "Hedged requests answered first by the hedge")
+
+# ------------------------------------------------
+# RESPONSE CACHE (LB_CACHE=1)
+# ------------------------------------------------
+CACHING = bool(os.environ.get("LB_CACHE"))
+response_cache = cache.ResponseCache(
+    max_entries=int(os.environ.get("LB_CACHE_MAX_ENTRIES", 10_000)),
+    max_bytes=int(os.environ.get("LB_CACHE_MAX_BYTES", 64 << 20)),
+    # per-path TTLs for responses without Cache-Control/Expires, e.g. {"/static": 300}
+    path_ttls=json.loads(os.environ.get("LB_CACHE_TTLS", "{}")),
+)
+CACHE_HITS = Counter("lb_cache_hits_total", "Requests answered from the response cache")
+CACHE_MISSES = Counter("lb_cache_misses_total", "Cacheable requests that went upstream")
+CACHE_COALESCED = Counter("lb_cache_coalesced_total", "Cache misses that shared another request's upstream call")
+
+# ------------------------------------------------
+# ADMISSION CONTROL (LB_MAX_CONCURRENCY=<per backend>)
+# ------------------------------------------------
+# a servers.json max_concurrency overrides LB_MAX_CONCURRENCY for its
+# backend and is enforced even when admission queueing is off
+MAX_CONCURRENCY = int(os.environ.get("LB_MAX_CONCURRENCY", 0))
+ADMISSION = MAX_CONCURRENCY > 0
+
+def concurrency_cap(url):
+    """In-flight limit for url (all workers); 0 = none."""
+    return server_stats[url]["max_concurrency"] or MAX_CONCURRENCY
+
+def admission_capacity(urls):
+    # the caps are for all workers together, the queue is per worker: each
+    # admits its share (refreshed with the pool lists as workers come and go)
+    return math.ceil(sum(concurrency_cap(u) for u in urls) / server_stats.processes())
+
+admission_ctl = admission.Admission(
+    capacity=admission_capacity(server_urls),
+    max_queue=int(os.environ.get("LB_QUEUE_SIZE", 1000)),
+    timeout=float(os.environ.get("LB_QUEUE_TIMEOUT", 1.0)),
+)
+QUEUE_DEPTH = Gauge("lb_queue_depth", "Requests waiting for admission")
+QUEUE_WAIT = Histogram(
+    "lb_queue_wait_seconds", "Time spent waiting for admission",
+    buckets=(0.0, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SHED = Counter("lb_shed_requests_total", "Requests rejected with 503 by admission control", ["reason"])
+
+# ------------------------------------------------
+# PER-CLIENT RATE LIMITS AND FAIR QUEUING (see ratelimit.py)
+# ------------------------------------------------
+# LB_RATE_LIMIT requests/s per client (LB_RATE_BURST at once, default one
+# second's worth; 0 = off), answered with 429 past it. Clients are keyed by
+# the LB_CLIENT_KEY_HEADER header (e.g. x-api-key) when it carries a key
+# listed in LB_CLIENT_CLASSES, else by IP.
+# With admission on, its queue is shared fairly between the same client
+# keys. LB_CLIENT_CLASSES gives listed clients their own limits and a
+# weight in that queue, e.g.
+#   {"batch": {"clients": ["10.0.0.7"], "rate": 5, "weight": 0.5},
+#    "gold": {"clients": ["key-123"], "rate": 200, "burst": 400, "weight": 4}}
+rate_limiter = ratelimit.RateLimiter(
+    rate=float(os.environ.get("LB_RATE_LIMIT", 0)),
+    burst=float(os.environ.get("LB_RATE_BURST", 0)) or None,
+    classes=json.loads(os.environ.get("LB_CLIENT_CLASSES", "{}")),
+    header=os.environ.get("LB_CLIENT_KEY_HEADER"),
+    max_keys=int(os.environ.get("LB_RATE_LIMIT_KEYS", 100_000)),
+)
+RATE_LIMITING = rate_limiter.enabled
+THROTTLED = Counter("lb_throttled_requests_total", "Requests rejected with 429 by the client's rate limit", ["class"])
+QUEUED = Counter("lb_queued_requests_total", "Requests that waited for admission", ["class"])
+for _cls in rate_limiter.classes:
+    THROTTLED.labels(_cls)
+    QUEUED.labels(_cls)
+Gauge("lb_rate_limit_clients", "Clients with a partly used token bucket").set_function(lambda: len(rate_limiter))
+
+def over_limit(conn) -> float:
+    """Spend a token for the request or WebSocket's client; seconds to wait if it had none."""
+    if not RATE_LIMITING:
+        return 0.0
+    client, cls = rate_limiter.classify(conn)
+    wait = rate_limiter.take(client, cls)
+    if wait:
+        THROTTLED.labels(cls.name).inc()
+    return wait
+
+def throttle(request):
+    """429 when the client is over its rate limit; checked once per request,
+    before the cache and stream paths."""
+    wait = over_limit(request)
+    if wait:
+        raise HTTPException(429, "Too Many Requests", headers={"Retry-After": str(ratelimit.retry_after(wait))})
+
+# ------------------------------------------------
+# ADMIN API (registered before the catch-all proxy route)
+# ------------------------------------------------
+# off (403) unless LB_ADMIN_TOKEN is set: it can add upstreams and drain
+# or remove backends. The token is sent as the X-Admin-Token header.
+ADMIN_TOKEN = os.environ.get("LB_ADMIN_TOKEN")
+
+class BackendSpec(BaseModel):
+    url: str
+    weight: float = 1.0
+    max_concurrency: int = None
+
+class DrainSpec(BaseModel):
+    url: str
+    draining: bool = True
+
+class WeightSpec(BaseModel):
+    url: str
+    weight: float
+
+def _admin(request: Request, url: str = None):
+    if not ADMIN_TOKEN:
+        raise HTTPException(403, "Admin API disabled: set LB_ADMIN_TOKEN")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(401, "Bad admin token")
+    if url is not None and url not in backend_registry:
+        raise HTTPException(404, f"Unknown backend {url}")
+
+def _describe(url):
+    s = server_stats[url]
+    return {
+        "url": url,
+        "weight": s["weight"],
+        "effective_weight": strategies.effective_weight(s),
+        "max_concurrency": concurrency_cap(url),
+        "draining": bool(s["draining"]),
+        "removing": s["draining"] == registry.REMOVING,
+        "healthy": s["healthy"],
+        "active": s["active"],
+        "peer_active": s["peer_active"],
+        "work": s["work"],
+        "latency": latency.current(s),
+        "breaker": breakers[url].state if url in breakers else None,
+        "serving": url in healthy_urls,
+    }
+
+@app.get("/admin/backends")
+async def list_backends(request: Request):
+    _admin(request)
+    return [_describe(u) for u in server_urls]
+
+@app.post("/admin/backends", status_code=201)
+async def add_backend(spec: BackendSpec, request: Request):
+    _admin(request)
+    if not spec.url.startswith(("http://", "https://")):
+        raise HTTPException(422, "url must be http:// or https://")
+    if spec.weight < 0 or (spec.max_concurrency or 0) < 0:
+        raise HTTPException(422, "weight and max_concurrency must be >= 0")
+    try:
+        backend_registry.add(spec.url.rstrip("/"), spec.weight, spec.max_concurrency)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(422, str(e))
+    sync_backends()
+    return _describe(spec.url.rstrip("/"))
+
+@app.delete("/admin/backends")
+async def remove_backend(url: str, request: Request):
+    # drained first: dropped once its in-flight requests have finished
+    _admin(request, url)
+    backend_registry.remove(url)
+    sync_backends()
+    return {"url": url, "removing": True}
+
+@app.post("/admin/backends/drain")
+async def drain_backend(spec: DrainSpec, request: Request):
+    _admin(request, spec.url)
+    backend_registry.drain(spec.url, spec.draining)
+    sync_backends()
+    return _describe(spec.url)
+
+@app.put("/admin/backends/weight")
+async def set_backend_weight(spec: WeightSpec, request: Request):
+    _admin(request, spec.url)
+    if spec.weight < 0:
+        raise HTTPException(422, "weight must be >= 0")
+    backend_registry.set_weight(spec.url, spec.weight)
+    return _describe(spec.url)
+
+@app.get("/admin/routes")
+async def list_routes(request: Request):
+    _admin(request)
+    return {
+        "routes": [
+            {"name": r.name, "pool": r.pool, "methods": sorted(r.methods) if r.methods else None,
+             "cost": router.cost(r), "samples": r.samples}
+            for r in router.routes.values()
+        ],
+        "pools": {name: {"members": sorted(members), "serving": pool_urls.get(name, [])}
+                  for name, members in router.pools.items()},
+    }
+
+@app.get("/admin/clients")
+async def get_clients(request: Request):
+    _admin(request)
+    return {**rate_limiter.export(), "rate_limiting": RATE_LIMITING, "fair_queuing": ADMISSION}
+
+@app.get("/admin/cluster")
+async def get_cluster(request: Request):
+    _admin(request)
+    if lb_cluster is None:
+        raise HTTPException(404, "Cluster mode is off (LB_CLUSTER_BIND)")
+    return lb_cluster.export()
+
+class TunerSpec(BaseModel):
+    frozen: bool = None
+    weights: dict = None
+
+@app.get("/admin/tuner")
+async def get_tuner(request: Request):
+    _admin(request)
+    if weight_tuner is None:
+        raise HTTPException(404, "Tuning is off (LB_TUNE=1 with LB_STRATEGY=scored)")
+    return weight_tuner.export()
+
+@app.put("/admin/tuner")
+async def set_tuner(spec: TunerSpec, request: Request):
+    # import exported weights and/or freeze/unfreeze
+    _admin(request)
+    if weight_tuner is None:
+        raise HTTPException(404, "Tuning is off (LB_TUNE=1 with LB_STRATEGY=scored)")
+    if spec.weights:
+        weight_tuner.set_weights(spec.weights)
+    if spec.frozen is not None:
+        weight_tuner.freeze(spec.frozen)
+    return weight_tuner.export()
+
+# ------------------------------------------------
+# LONG-LIVED STREAMS (WebSocket / SSE, see longlived.py)
+# ------------------------------------------------
+# balanced on open streams and message rate (LB_STREAM_STRATEGY, default
+# least_streams), not on per-request active counts; no admission, retries
+# after the first byte, hedging or caching. Every LB_STREAM_REBALANCE_INTERVAL
+# seconds up to LB_STREAM_REBALANCE_MAX streams on draining / unhealthy /
+# overloaded (> LB_STREAM_SLACK x weighted share) backends are asked to
+# reconnect.
+stream_strategy = strategies.get_strategy(os.environ.get("LB_STREAM_STRATEGY") or "least_streams")
+streams = longlived.StreamTracker(server_stats)
+STREAM_REBALANCE_INTERVAL = float(os.environ.get("LB_STREAM_REBALANCE_INTERVAL", 5.0))
+STREAM_REBALANCE_MAX = int(os.environ.get("LB_STREAM_REBALANCE_MAX", 5))
+STREAM_SLACK = float(os.environ.get("LB_STREAM_SLACK", 1.25))
+SSE_RETRY_MS = int(os.environ.get("LB_SSE_RETRY_MS", 1000))
+# SSE: no read timeout, events may be minutes apart
+SSE_TIMEOUT = httpx.Timeout(5.0, read=None)
+STREAMS_OPENED = Counter("lb_streams_opened_total", "Long-lived streams proxied", ["kind"])
+STREAMS_REBALANCED = Counter("lb_streams_rebalanced_total", "Streams asked to reconnect", ["reason"])
+streams.on_rebalance = lambda url, reason: STREAMS_REBALANCED.labels(reason).inc()
+
+def stream_candidates(path, method="GET"):
+    """(pool, failover order) for a new stream."""
+    route = router.match(path, method)
+    urls = route_candidates(route)
+    return route.pool, stream_strategy.order(urls, server_stats) if urls else []
+
+async def watch_streams():
+    while True:
+        await asyncio.sleep(STREAM_REBALANCE_INTERVAL)
+        streams.tick()
+        streams.rebalance(healthy_urls, STREAM_REBALANCE_MAX, STREAM_SLACK, pool_urls)
+
+@app.on_event("startup")
+async def _():
+    asyncio.create_task(watch_streams())
+
+async def _sse(path: str, request: Request):
+    last_exc = None
+    pool, candidates = stream_candidates(path, request.method)
+    for backend in candidates:
+        if backend not in breakers or not breakers.allow(backend):
+            continue
+        stream = streams.opened(backend, "sse", pool)
+        try:
+            resp = await upstream_pools.send(backend, path, request, timeout=SSE_TIMEOUT)
+        except asyncio.CancelledError:
+            streams.closed(stream)
+            breakers.release(backend)
+            raise
+        except httpx.HTTPError as e:
+            streams.closed(stream)
+            breakers.record(backend, False)
+            prober.poke(backend)
+            last_exc = HTTPException(502, str(e))
+            if streaming.has_body(request):
+                break
+            continue
+        breakers.record(backend, resp.status_code < 500)
+        STREAMS_OPENED.labels("sse").inc()
+
+        return streaming.relay(resp, lambda stream=stream: streams.closed(stream),
+                               body=longlived.sse_body(resp, stream, streams, SSE_RETRY_MS))
+    raise last_exc or HTTPException(503, "No backend available", headers={"Retry-After": "1"})
+
+@app.websocket("/{path:path}")
+async def ws_proxy(websocket: WebSocket, path: str):
+    if longlived.ws_connect is None:
+        await websocket.close(longlived.WS_TRY_AGAIN, "WebSocket proxying needs the websockets package")
+        return
+    if over_limit(websocket):
+        await websocket.close(longlived.WS_TRY_AGAIN, "Too Many Requests")
+        return
+    upstream_ws = stream = None
+    pool, candidates = stream_candidates(path)
+    for backend in candidates:
+        if backend not in breakers or not breakers.allow(backend):
+            continue
+        # counted before the handshake, so concurrent connects spread out
+        stream = streams.opened(backend, "ws", pool)
+        try:
+            upstream_ws = await longlived.ws_open(
+                longlived.ws_url(backend, path, websocket.url.query), websocket)
+            breakers.record(backend, True)
+            break
+        except (OSError, asyncio.TimeoutError, longlived.InvalidHandshake):
+            streams.closed(stream)
+            breakers.record(backend, False)
+            prober.poke(backend)
+        except asyncio.CancelledError:
+            streams.closed(stream)
+            breakers.release(backend)
+            raise
+    if upstream_ws is None:
+        await websocket.close(longlived.WS_TRY_AGAIN, "No backend available")
+        return
+    STREAMS_OPENED.labels("ws").inc()
+    try:
+        await websocket.accept(subprotocol=upstream_ws.subprotocol)
+        await longlived.ws_relay(websocket, upstream_ws, stream, streams)
+    finally:
+        streams.closed(stream)
+        await upstream_ws.close()
 
 # ------------------------------------------------
 # PROXY ROUTING
 # ------------------------------------------------
-@app.api_route("/{path:path}", methods=["GET","POST","PUT","DELETE","PATCH"])
-async def proxy(path: str, request: Request):
+async def _attempt(backend: str, path: str, request: Request, route: routes.Route, cost: float):
+    """One upstream try. Returns (backend, resp, release) with the backend's active count and work held."""
+    row = server_stats[backend]
+    row.incr("active")
+    row.incr("work", cost)
+    released = False
+
+    def release():
+        # decrement active and work once the response body has been relayed
+        nonlocal released
+        if not released:
+            released = True
+            row.incr("active", -1)
+            row.incr("work", -cost)
+
+    metrics = backend_metrics.get(backend)
+    start = time.perf_counter()
+    try:
+        resp = await upstream_pools.send(backend, path, request)
+    except asyncio.CancelledError:
+        # lost a hedge race or the client left: not the backend's fault
+        release()
+        breakers.release(backend)
+        raise
+    except Exception:
+        if metrics:
+            metrics[1][-1].inc()
+        breakers.record(backend, False)
+        prober.poke(backend)  # check it now rather than at its next slot
+        if weight_tuner:
+            weight_tuner.observe(time.perf_counter() - start, False)
+        release()
+        raise
+
+    # time to upstream headers feeds the backend's peak EWMA and the route's
+    # cost; an outlier is judged against the route's cost so far, so a heavy
+    # pool isn't held to the light routes' latency
+    rtt = time.perf_counter() - start
+    expected = router.baseline(route)
+    latency.observe(row, rtt)
+    router.observe(route, rtt)
+    if metrics:
+        metrics[0].observe(rtt)
+        metrics[1][min(max(resp.status_code // 100, 1), 5) - 1].inc()
+    breakers.record(backend, resp.status_code < 500 and not breakers.is_outlier(rtt, expected))
+    if weight_tuner:
+        weight_tuner.observe(rtt, resp.status_code < 500)
+    if HEDGING:
+        route_latency.observe(hedge.route_of(path), rtt)
+    return backend, resp, release
+
+async def _forward(path: str, request: Request):
+    """Admission, then _dispatch; returns (resp, release) or raises HTTPException."""
+    if not ADMISSION:
+        return await _dispatch(path, request)
+    client, cls = rate_limiter.classify(request)
+    try:
+        waited = await admission_ctl.acquire(client=client, weight=cls.weight)
+    except admission.Overloaded as e:
+        SHED.labels(str(e)).inc()
+        raise HTTPException(503, f"Overloaded: {e}", headers={"Retry-After": str(e.retry_after)})
+    finally:
+        QUEUE_DEPTH.set(admission_ctl.depth)
+    QUEUE_WAIT.observe(waited)
+    if waited:
+        QUEUED.labels(cls.name).inc()
+    admitted = time.perf_counter()
+    try:
+        resp, release = await _dispatch(path, request)
+    except BaseException:
+        admission_ctl.release(time.perf_counter() - admitted)
+        raise
+
+    def done():
+        release()
+        admission_ctl.release(time.perf_counter() - admitted)
+        QUEUE_DEPTH.set(admission_ctl.depth)
+    return resp, done
+
+async def _dispatch(path: str, request: Request):
+    """Select, retry and hedge as configured; returns (resp, release) or raises HTTPException."""
     method = request.method
-    body = await request.body()
-    size = len(body)
+    size = streaming.body_size(request)
+    # a streamed body can only be sent once; bodiless requests may be retried
+    replayable = not streaming.has_body(request)
+    hedgeable = HEDGING and replayable and hedge.is_idempotent(method, path)
 
-    backends = await choose_backends(method, size)
+    route = router.match(path, method)
+    if route.name in route_metrics:
+        route_metrics[route.name].inc()
+    candidates = route_candidates(route)
+    if not candidates:
+        raise HTTPException(503, f"No backend available in pool {route.pool}", headers={"Retry-After": "1"})
+    cost = router.cost(route)
+    key = affinity.request_key(request, AFFINITY_KEY)
+    backends = await choose_backends(method, size, key, candidates)
     last_exc = None
+    attempts = 0
+    tried = set()
+    retry_budget.deposit()
+    if hedgeable:
+        HEDGEABLE.inc()
+        hedge_budget.deposit()
 
-    for backend in backends:
-        url = f"{backend}/{path}"
-        # bump active
-        async with stats_lock:
-            server_stats[backend]["active"] += 1
+    for i, backend in enumerate(backends):
+        if backend in tried or backend not in breakers:
+            continue  # already tried, or removed from the pool meanwhile
+        cap = concurrency_cap(backend)
+        if cap and server_stats[backend]["active"] >= cap:
+            continue  # at its concurrency cap
+        # skip open/half-open-busy breakers, but always try the last candidate
+        if not breakers.allow(backend) and i + 1 < len(backends):
+            continue
+        if attempts and not retry_budget.withdraw():
+            breakers.release(backend)
+            break  # out of retry budget: don't multiply load during an incident
+        attempts += 1
+        if attempts > 1:
+            RETRIES.inc()
+        tried.add(backend)
 
+        delay = route_latency.threshold(hedge.route_of(path)) if hedgeable and attempts == 1 else None
+        alt = next((b for b in backends[i + 1:] if b in breakers and breakers[b].state == breaker.CLOSED), None)
         try:
-            resp = await client.request(
-                method, url,
-                headers=request.headers.raw,
-                content=body,
-            )
-            if resp.status_code < 500:
-                return resp.json()
-            last_exc = HTTPException(resp.status_code, f"{backend} → {resp.status_code}")
+            if delay is not None and alt is not None:
+
+                def hedged(alt=alt):
+                    # only a hedge actually sent uses up alt for the retry loop
+                    tried.add(alt)
+                    HEDGED.inc()
+
+                backend, resp, release = await hedge.first_of(
+                    lambda: _attempt(backend, path, request, route, cost),
+                    lambda: _attempt(alt, path, request, route, cost),
+                    delay, hedge_budget, on_hedge=hedged,
+                )
+                if backend == alt:
+                    HEDGE_WINS.inc()
+            else:
+                backend, resp, release = await _attempt(backend, path, request, route, cost)
+        except httpx.ConnectError as e:
+            # nothing was sent yet, so the next backend can take the request
+            last_exc = HTTPException(502, str(e))
+            continue
         except Exception as e:
             last_exc = HTTPException(502, str(e))
-        finally:
-            # decrement active
-            async with stats_lock:
-                server_stats[backend]["active"] = max(0, server_stats[backend]["active"] - 1)
+            if not replayable:
+                break
+            continue
+
+        if resp.status_code >= 500 and replayable and i + 1 < len(backends):
+            await resp.aclose()
+            release()
+            last_exc = HTTPException(resp.status_code, f"{backend} → {resp.status_code}")
+            continue
+        return resp, release
 
+    if last_exc is None and attempts == 0:
+        raise HTTPException(503, "All backends at capacity", headers={"Retry-After": "1"})
     raise last_exc or HTTPException(502, "Bad Gateway")
+
+async def _cached(path: str, request: Request):
+    key = response_cache.key(request)
+    credentialed = response_cache.credentialed(request)
+    entry = response_cache.get(key, credentialed)
+    if entry is not None:
+        CACHE_HITS.inc()
+        return cache.respond(entry)
+
+    passthrough = []
+
+    async def load():
+        CACHE_MISSES.inc()
+        resp, release = await _forward(path, request)
+        ttl = response_cache.ttl(request.url.path, resp.status_code, resp.headers, credentialed)
+        length = resp.headers.get("content-length", "")
+        if ttl <= 0 or not length.isdigit() or int(length) > response_cache.max_entry_bytes:
+            passthrough.append((resp, release))
+            return None
+        try:
+            body = b"".join([chunk async for chunk in resp.aiter_raw()])
+        finally:
+            await resp.aclose()
+            release()
+        headers = [(k, v) for k, v in resp.headers.raw if k.lower() not in streaming.HOP_BY_HOP]
+        entry = cache.Entry(resp.status_code, headers, body, ttl, response_cache.shared(resp.headers))
+        response_cache.put(key, entry)
+        return entry
+
+    entry, _ = await response_cache.fetch(key, load, on_coalesce=CACHE_COALESCED.inc)
+    if entry is not None and (entry.shared or not credentialed):
+        return cache.respond(entry)
+    if passthrough:
+        return streaming.relay(*passthrough[0])
+    # the shared answer wasn't cacheable: go upstream ourselves
+    return streaming.relay(*await _forward(path, request))
+
+@app.get("/metrics")
+async def metrics():
+    return Response(lbmetrics.render(), media_type=lbmetrics.CONTENT_TYPE)
+
+@app.api_route("/{path:path}", methods=["GET","HEAD","POST","PUT","DELETE","PATCH"])
+async def proxy(path: str, request: Request):
+    throttle(request)
+    if longlived.is_sse(request.headers):
+        return await _sse(path, request)
+    if CACHING and request.method in cache.CACHEABLE_METHODS and not response_cache.bypass(request):
+        return await _cached(path, request)
+    return streaming.relay(*await _forward(path, request))
@@ -0,0 +1,121 @@
+import asyncio
+import math
+import os
+
+# ------------------------------------------------
+# HEDGED REQUESTS
+# ------------------------------------------------
+# For idempotent requests, if the first backend hasn't sent headers after
+# the route's observed p95 (LB_HEDGE_QUANTILE), the same request goes to
+# the next-best backend and whichever answers first wins ("The Tail at
+# Scale", Dean & Barroso). A budget caps the extra load.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD"})
+# extra idempotent route prefixes, e.g. LB_IDEMPOTENT_ROUTES=/search,/api/lookup
+IDEMPOTENT_ROUTES = tuple(p for p in os.environ.get("LB_IDEMPOTENT_ROUTES", "").split(",") if p)
+
+# log-spaced buckets: 1ms * 1.25^i up to ~60s
+_BASE, _GROWTH, _NBUCKETS = 0.001, 1.25, 50
+_LOG_GROWTH = math.log(_GROWTH)
+BOUNDS = [_BASE * _GROWTH ** i for i in range(_NBUCKETS)]
+MAX_ROUTES = 1024
+
+
+def is_idempotent(method: str, path: str) -> bool:
+    return method in IDEMPOTENT_METHODS or (bool(IDEMPOTENT_ROUTES) and ("/" + path).startswith(IDEMPOTENT_ROUTES))
+
+
+def route_of(path: str) -> str:
+    # first path segment; keeps the number of tracked routes small
+    return "/" + path.split("/", 1)[0]
+
+
+class RouteLatency:
+    """Per-route bucketed latency with halving once a route has `window` samples."""
+
+    def __init__(self, quantile=0.95, min_samples=20, window=2000, floor=0.005):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.floor = floor
+        self._routes = {}
+
+    def observe(self, route: str, rtt: float):
+        h = self._routes.get(route)
+        if h is None:
+            if len(self._routes) >= MAX_ROUTES:
+                route = "*"
+                h = self._routes.get(route)
+            if h is None:
+                h = self._routes[route] = [0] * (_NBUCKETS + 1)
+        i = 0 if rtt <= _BASE else min(int(math.log(rtt / _BASE) / _LOG_GROWTH) + 1, _NBUCKETS - 1)
+        h[i] += 1
+        h[_NBUCKETS] += 1
+        if h[_NBUCKETS] >= self.window:
+            # age out old samples so the threshold follows the route
+            for j in range(_NBUCKETS):
+                h[j] //= 2
+            h[_NBUCKETS] = sum(h[:_NBUCKETS])
+
+    def threshold(self, route: str):
+        """Hedge delay for `route`, or None until enough samples are seen."""
+        h = self._routes.get(route) or self._routes.get("*")
+        if h is None or h[_NBUCKETS] < self.min_samples:
+            return None
+        target = self.quantile * h[_NBUCKETS]
+        seen = 0
+        for i in range(_NBUCKETS):
+            seen += h[i]
+            if seen >= target:
+                return max(BOUNDS[i], self.floor)
+        return max(BOUNDS[-1], self.floor)
+
+
+async def first_of(primary, secondary, delay, budget, on_hedge=None):
+    """
+    Run `primary()`; if it hasn't finished after `delay` and the budget
+    allows, also run `secondary()` (and call `on_hedge()`). Returns the
+    first successful result and cancels the other attempt. Both are
+    coroutine factories returning (backend, resp, release); a loser that
+    still produced a response is closed.
+    """
+    first = asyncio.ensure_future(primary())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        _abandon(first)
+        raise
+    if done or not budget.withdraw():
+        return await first
+    if on_hedge:
+        on_hedge()
+    second = asyncio.ensure_future(secondary())
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # both may have finished in the same round
+                    for loser in (done | pending) - {task}:
+                        _abandon(loser)
+                    return task.result()
+                error = error or task.exception()
+    except asyncio.CancelledError:
+        for task in pending:
+            _abandon(task)
+        raise
+    raise error
+
+
+def _abandon(task):
+    task.cancel()
+    task.add_done_callback(_discard)
+
+
+def _discard(task):
+    # close a losing response that completed before it saw the cancellation
+    if not task.cancelled() and task.exception() is None:
+        _, resp, release = task.result()
+        asyncio.ensure_future(resp.aclose())
+        release()
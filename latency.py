@@ -0,0 +1,41 @@
+import math
+import os
+import time
+
+# ------------------------------------------------
+# PEAK-EWMA LATENCY
+# ------------------------------------------------
+# Passive latency signal updated from every proxied response (Finagle's
+# "peak EWMA"): a slower sample replaces the average at once, faster ones
+# are blended in with a weight that depends on the time since the last
+# sample, and the value decays while a backend gets no traffic so an idle
+# backend is eventually tried again. Everything is kept in the backend's
+# stats dict ("latency", "stamp") so any stats store can carry it.
+DECAY = float(os.environ.get("LB_EWMA_DECAY", 10.0))  # seconds
+# time source for stamps and decay; simulate.py swaps in its virtual clock
+clock = time.monotonic
+
+
+def observe(st, rtt: float, now: float = None):
+    now = clock() if now is None else now
+    prev = st.get("latency", 0.0)
+    if rtt > prev:
+        st["latency"] = rtt
+    else:
+        w = math.exp(-max(now - st.get("stamp", 0.0), 0.0) / DECAY)
+        st["latency"] = prev * w + rtt * (1.0 - w)
+    st["stamp"] = now
+
+
+def current(st, now: float = None) -> float:
+    """The EWMA decayed up to `now`."""
+    lat = st.get("latency", 0.0)
+    if not lat:
+        return 0.0
+    now = clock() if now is None else now
+    return lat * math.exp(-max(now - st.get("stamp", 0.0), 0.0) / DECAY)
+
+
+def cost(st, now: float = None) -> float:
+    """Expected wait on this backend: latency scaled by requests in flight."""
+    return current(st, now) * (st.get("active", 0) + 1)
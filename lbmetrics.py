@@ -0,0 +1,242 @@
+import math
+import time
+from bisect import bisect_left
+
+# ------------------------------------------------
+# NATIVE METRICS
+# ------------------------------------------------
+# A small Prometheus-text registry for the proxy's own metrics, cheap
+# enough for the hot path: a labelled child is created once (e.g. per
+# backend when it joins) and then updated with a plain attribute add; a
+# histogram observation is one bisect into fixed buckets. Label strings
+# are formatted when the child is created, so rendering /metrics only
+# joins precomputed text. The API is the subset of prometheus_client the
+# apps use (labels / inc / dec / set / set_function / observe).
+#
+# Values are per process; with `--workers N` scrape each worker, or read
+# the shared-state gauges (set_function over the StatsTable).
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _fmt(v) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v == -math.inf:
+        return "-Inf"
+    if v != v:
+        return "NaN"
+    return str(int(v)) if float(v).is_integer() and abs(v) < 1e15 else repr(float(v))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra="") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def unregister(self, metric):
+        self._metrics.pop(metric.name, None)
+
+    def render(self) -> bytes:
+        out = []
+        for m in self._metrics.values():
+            out.append(f"# HELP {m.name} {m.help}\n# TYPE {m.name} {m.kind}\n")
+            m.render(out)
+        return "".join(out).encode()
+
+
+REGISTRY = Registry()
+
+
+def render(registry=REGISTRY) -> bytes:
+    return registry.render()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, **kwargs):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children = {}
+        if not self.labelnames:
+            # unlabelled metrics act as their own single child
+            default = self._child(())
+            for attr in ("inc", "dec", "set", "set_function", "get", "observe"):
+                if hasattr(default, attr):
+                    setattr(self, attr, getattr(default, attr))
+        if registry is not None:
+            registry.register(self)
+
+    def _child(self, values):
+        child = self._children[values] = self._new_child(_labels(self.labelnames, values))
+        return child
+
+    def labels(self, *values):
+        """Child for these label values; keep it around on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            values = tuple(str(v) for v in values)
+            # e.g. labels(200) after labels("200"): same series, keep its child
+            child = self._children.get(values) or self._child(values)
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def render(self, out):
+        for child in list(self._children.values()):
+            child.render(self.name, out)
+
+
+class _Value:
+    __slots__ = ("labels", "value", "fn")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0.0
+        self.fn = None
+
+    def inc(self, n=1.0):
+        self.value += n
+
+    def dec(self, n=1.0):
+        self.value -= n
+
+    def set(self, v):
+        self.value = v
+
+    def set_function(self, fn):
+        """Read the value from fn() at render time instead."""
+        self.fn = fn
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+    def render(self, name, out):
+        out.append(f"{name}{self.labels} {_fmt(float(self.get()))}\n")
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self, labels):
+        return _Value(labels)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self, labels):
+        return _Value(labels)
+
+
+class _Buckets:
+    __slots__ = ("labels", "bounds", "counts", "sum", "_le")
+
+    def __init__(self, labels, bounds, le):
+        self.labels = labels
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._le = le
+
+    def observe(self, v):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def render(self, name, out):
+        total = 0
+        for le, n in zip(self._le, self.counts):
+            total += n
+            out.append(f"{name}_bucket{le} {total}\n")
+        out.append(f"{name}_count{self.labels} {total}\n{name}_sum{self.labels} {_fmt(self.sum)}\n")
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self, labels):
+        # `le` label strings for every bucket, +Inf last
+        inner = labels[1:-1] if labels else ""
+        le = [_labels((), (), (inner + "," if inner else "") + f'le="{_fmt(b)}"')
+              for b in (*self.bounds, math.inf)]
+        return _Buckets(labels, self.bounds, le)
+
+
+# ------------------------------------------------
+# REQUEST METRICS (ASGI)
+# ------------------------------------------------
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+
+class RequestMetrics:
+    """
+    Raw ASGI wrapper in place of the instrumentator middleware: in-flight
+    requests, requests by status class and duration until the last body
+    byte was sent. Children are created up front, one per status class;
+    wrappers with the same prefix and registry share one set of series.
+    """
+    _shared = {}
+
+    def __init__(self, app, prefix="lb", exclude=("/metrics",), registry=REGISTRY):
+        self.app = app
+        self.exclude = frozenset(exclude)
+        key = (prefix, id(registry))
+        if key not in self._shared:
+            requests = Counter(f"{prefix}_requests_total", "Client requests by response status class",
+                               ["code"], registry=registry)
+            self._shared[key] = (
+                Gauge(f"{prefix}_inflight", "Client requests in progress", registry=registry),
+                [requests.labels(c) for c in STATUS_CLASSES],
+                Histogram(f"{prefix}_request_duration_seconds",
+                          "Client request duration, to the last response byte", registry=registry),
+            )
+        self.inflight, self.by_class, self.duration = self._shared[key]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            return await self.app(scope, receive, send)
+        status = 500  # if the app fails before starting a response
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.inflight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.duration.observe(time.perf_counter() - start)
+            self.by_class[min(max(status // 100, 1), 5) - 1].inc()
+            self.inflight.dec()
@@ -0,0 +1,251 @@
+import asyncio
+import math
+import random
+import time
+
+import strategies
+
+try:
+    from websockets.asyncio.client import connect as ws_connect
+    from websockets.exceptions import ConnectionClosed, InvalidHandshake
+except ImportError:  # WebSocket proxying is optional
+    ws_connect = None
+    ConnectionClosed = InvalidHandshake = Exception
+
+# ------------------------------------------------
+# LONG-LIVED CONNECTIONS (WebSocket / SSE)
+# ------------------------------------------------
+# A stream holds a backend for minutes or hours, so it is counted in the
+# "streams" column instead of "active", and its messages feed a per-worker
+# "msg_rate" EWMA; strategies.LeastStreams balances on both.
+#
+# Rebalancing is gradual: each round closes at most `max_close` of this
+# worker's streams, first on backends that left the serving set (draining,
+# unhealthy, ejected), then on backends holding more than `slack` times
+# their weighted share. A stream opened on a routes.py pool is only
+# weighed against the other streams of that pool, on the pool's backends.
+# Clients get a reconnect hint: WebSocket close code
+# 1012 (service restart), or an SSE `retry:` with jitter so they don't all
+# come back at once. The reconnect is balanced like any new stream.
+WS_RECONNECT = 1012
+WS_TRY_AGAIN = 1013  # no backend reachable
+_WS_SKIP = frozenset({
+    "host", "connection", "upgrade", "keep-alive", "te", "trailer", "transfer-encoding",
+    "sec-websocket-key", "sec-websocket-version", "sec-websocket-extensions", "sec-websocket-protocol",
+})
+
+
+class Stream:
+    __slots__ = ("backend", "kind", "pool", "opened", "messages", "closing")
+
+    def __init__(self, backend, kind, pool=None):
+        self.backend = backend
+        self.kind = kind  # "ws" | "sse"
+        self.pool = pool  # routes.py pool it was balanced in, None = any backend
+        self.opened = time.monotonic()
+        self.messages = 0
+        self.closing = asyncio.Event()  # set by rebalance
+
+
+class StreamTracker:
+    def __init__(self, stats, halflife=10.0):
+        self.stats = stats
+        self.halflife = halflife
+        self.open = {}  # backend -> {Stream}, this worker's only
+        self._counts = {}  # messages since the last tick
+        self._rates = {}
+        self._last = time.monotonic()
+        self.on_rebalance = None  # on_rebalance(backend, reason)
+
+    def opened(self, backend, kind, pool=None) -> Stream:
+        stream = Stream(backend, kind, pool)
+        self.open.setdefault(backend, set()).add(stream)
+        self.stats[backend].incr("streams")
+        return stream
+
+    def closed(self, stream):
+        streams = self.open.get(stream.backend)
+        if streams is None or stream not in streams:
+            return
+        streams.discard(stream)
+        if not streams:
+            del self.open[stream.backend]
+        self.stats[stream.backend].incr("streams", -1)
+
+    def message(self, stream, n=1):
+        stream.messages += n
+        self._counts[stream.backend] = self._counts.get(stream.backend, 0) + n
+
+    def tick(self):
+        """Fold the message counts since the last tick into msg_rate."""
+        now = time.monotonic()
+        dt, self._last = now - self._last, now
+        if dt <= 0:
+            return
+        alpha = 1.0 - math.exp(-dt * math.log(2) / self.halflife)
+        for url in set(self._rates) | set(self._counts):
+            rate = self._rates.get(url, 0.0)
+            rate += alpha * (self._counts.get(url, 0) / dt - rate)
+            if rate < 1e-3 and url not in self.open:
+                self._rates.pop(url, None)
+                rate = 0.0
+            else:
+                self._rates[url] = rate
+            if url in self.stats:
+                self.stats[url].set_own("msg_rate", rate)
+        self._counts.clear()
+
+    def rebalance(self, serving, max_close=5, slack=1.25, pools=None) -> int:
+        """
+        Ask up to max_close streams to reconnect elsewhere; returns how many.
+        `serving` takes new streams, `pools` maps a pool name to the backends
+        serving it.
+        """
+        budget = max_close
+        groups = {None: serving, **(pools or {})}
+        # backends that no longer take the stream's group: move it off
+        # (unless the group has nowhere else to go)
+        for url in list(self.open):
+            for pool, urls in groups.items():
+                if urls and url not in urls:
+                    budget -= self._close(url, budget, "drain", pool)
+                    if budget <= 0:
+                        return max_close
+        # then anything well above its weighted share of the group's streams
+        # (effective weight, so a backend in slow start takes streams gradually)
+        for pool, urls in groups.items():
+            counts = {u: self._count(u, pool) for u in urls}
+            total = sum(counts.values())
+            if not total:
+                continue
+            weights = {u: strategies.effective_weight(self.stats[u]) for u in urls}
+            total_w = sum(weights.values())
+            if total_w <= 0:
+                continue
+            for url in sorted(urls, key=lambda u: -counts[u]):
+                fair = total * weights[url] / total_w
+                excess = counts[url] - max(slack * fair, fair + 1)
+                if excess >= 1:
+                    budget -= self._close(url, min(budget, int(excess)), "overload", pool)
+                if budget <= 0:
+                    return max_close
+        return max_close - budget
+
+    def _count(self, url, pool):
+        return sum(1 for s in self.open.get(url, ()) if s.pool == pool)
+
+    def _close(self, url, n, reason, pool=None):
+        # oldest first: they have been placed least recently
+        victims = sorted((s for s in self.open.get(url, ()) if s.pool == pool and not s.closing.is_set()),
+                         key=lambda s: s.opened)[:n]
+        for s in victims:
+            s.closing.set()
+            if self.on_rebalance:
+                self.on_rebalance(url, reason)
+        return len(victims)
+
+
+def is_sse(headers) -> bool:
+    return "text/event-stream" in headers.get("accept", "")
+
+
+def ws_url(backend, path, query):
+    base = "ws" + backend[4:] if backend.startswith("http") else backend
+    return f"{base}/{path}?{query}" if query else f"{base}/{path}"
+
+
+# ------------------------------------------------
+# WEBSOCKET RELAY
+# ------------------------------------------------
+async def ws_open(url, websocket, open_timeout=5.0):
+    """Upstream connection with the client's subprotocols and headers."""
+    headers = [(k, v) for k, v in websocket.headers.items() if k.lower() not in _WS_SKIP]
+    protocols = [p.strip() for p in websocket.headers.get("sec-websocket-protocol", "").split(",") if p.strip()]
+    return await ws_connect(url, additional_headers=headers, user_agent_header=None,
+                            subprotocols=protocols or None, open_timeout=open_timeout,
+                            max_size=None, compression=None)
+
+
+async def ws_relay(websocket, upstream, stream, tracker):
+    """Full duplex until either side closes or the stream is rebalanced."""
+
+    async def client_to_upstream():
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                await upstream.close(msg.get("code", 1000))
+                return
+            data = msg.get("text")
+            await upstream.send(data if data is not None else msg.get("bytes", b""))
+            tracker.message(stream)
+
+    async def upstream_to_client():
+        try:
+            async for data in upstream:
+                if isinstance(data, str):
+                    await websocket.send_text(data)
+                else:
+                    await websocket.send_bytes(data)
+                tracker.message(stream)
+        except ConnectionClosed:
+            pass
+        code = upstream.close_code or 1000
+        await websocket.close(code if code not in (1005, 1006) else 1011)
+
+    async def rebalanced():
+        await stream.closing.wait()
+        await websocket.close(WS_RECONNECT, "rebalance")
+        await upstream.close(1001)
+
+    tasks = [asyncio.create_task(c()) for c in (client_to_upstream, upstream_to_client, rebalanced)]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await upstream.close()
+
+
+# ------------------------------------------------
+# SSE RELAY
+# ------------------------------------------------
+async def sse_body(resp, stream, tracker, retry_ms=1000):
+    """
+    Upstream event-stream bytes; on rebalance, finish at the next event
+    boundary with a jittered `retry:` so the client reconnects.
+    """
+    chunks = resp.aiter_raw().__aiter__()
+    closing = asyncio.ensure_future(stream.closing.wait())
+    retry = f"retry: {int(retry_ms * (1 + random.random()))}\n\n".encode()
+    at_boundary = True
+    nxt = None
+    try:
+        while True:
+            if nxt is None:
+                nxt = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait((nxt,) if closing.done() else (nxt, closing), return_when=asyncio.FIRST_COMPLETED)
+            if not nxt.done():
+                # rebalanced while waiting; mid-event, wait for the rest of it
+                if at_boundary:
+                    nxt.cancel()
+                    yield retry
+                    return
+                continue
+            try:
+                chunk = nxt.result()
+            except StopAsyncIteration:
+                return
+            nxt = None
+            events = chunk.count(b"\n\n") + chunk.count(b"\r\n\r\n")
+            if events:
+                tracker.message(stream, events)
+            at_boundary = chunk.endswith((b"\n\n", b"\r\n\r\n"))
+            yield chunk
+            if closing.done() and at_boundary:
+                yield retry
+                return
+    finally:
+        closing.cancel()
+        if nxt is not None:
+            nxt.cancel()
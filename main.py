@@ -31,11 +31,19 @@
 
 #     return response.json()
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 import httpx
 import json
 import asyncio
-from threading import Lock
+import os
+import time
+import streaming
+import strategies
+import affinity
+import latency
+import shared_state
+import probe
+import upstream
 
 app = FastAPI()
 
@@ -45,82 +53,80 @@ with open("servers.json") as f:
 
 server_urls = [server["url"] for server in servers]
 
-# Step 1: Round Robin
-last_server_index = -1
-round_robin_lock = Lock()
+# Step 1 + 2: Selection strategy (LB_STRATEGY), least connections by default
+strategy = strategies.get_strategy(os.environ.get("LB_STRATEGY") or "least_connections")
+# maglev affinity key: client_ip | path | header:<name>
+AFFINITY_KEY = os.environ.get("LB_AFFINITY_KEY") or "client_ip"
+
+# Step 2 + 3 + 4: Active connections, health and peak-EWMA latency, read by
+# the strategy. LB_SHARED_STATE=1 shares them between uvicorn workers.
+if os.environ.get("LB_SHARED_STATE"):
+    server_stats = shared_state.StatsTable.shared(server_urls)
+else:
+    server_stats = shared_state.StatsTable.local(server_urls)
+health_check_interval = 5  # seconds
 
-# Step 2: Least Connections
-active_connections = {url: 0 for url in server_urls}
-connections_lock = Lock()
+# Health probes: jittered per-backend schedule on one pooled client (probe.py)
+probe_client = httpx.AsyncClient(timeout=2.0)
+# Proxied requests: a pooled, pre-warmed connection set per backend (upstream.py)
+upstream_pools = upstream.Pools(server_urls)
 
-# Step 3: Health Check
-healthy_servers = set(server_urls)
-health_check_interval = 5  # seconds
+async def check_server(url, timeout):
+    response = await probe_client.get(url, timeout=timeout)
+    response.raise_for_status()
+
+def record_health(url, ok, _result, _rtt):
+    if bool(server_stats[url]["healthy"]) != ok:
+        server_stats[url]["healthy"] = ok
+        strategy.on_health_change([u for u in server_urls if server_stats[u]["healthy"]])
 
-# Step 4: Response Time Tracking
-latencies = {url: [] for url in server_urls}
-
-async def health_check():
-    while True:
-        for url in server_urls:
-            try:
-                async with httpx.AsyncClient(timeout=2.0) as client:
-                    response = await client.get(url)
-                    if response.status_code == 200:
-                        healthy_servers.add(url)
-                    else:
-                        healthy_servers.discard(url)
-            except:
-                healthy_servers.discard(url)
-        await asyncio.sleep(health_check_interval)
+prober = probe.ProbeScheduler(check_server, record_health, server_urls, base_interval=health_check_interval, timeout=2.0)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(health_check())
+    prober.start()
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
 
-def choose_server():
-    with connections_lock:
-        available = list(healthy_servers)
+@app.on_event("shutdown")
+async def shutdown_event():
+    await prober.stop()
+    await probe_client.aclose()
+    await upstream_pools.aclose()
+    server_stats.close()
 
-        # Step 1 + 2 + 4: Combine smart strategy
-        if not available:
-            raise Exception("No healthy servers available.")
+def choose_server(key=None):
+    available = [u for u in server_urls if server_stats[u]["healthy"]]
 
-        # Use least connections, then sort by average latency
-        scored = sorted(available, key=lambda url: (active_connections[url], sum(latencies[url]) / len(latencies[url]) if latencies[url] else float('inf')))
-        return scored[0]
+    # Step 1 + 2 + 4: Combine smart strategy
+    if not available:
+        raise HTTPException(503, "No healthy servers available.", headers={"Retry-After": str(health_check_interval)})
+
+    return strategy.pick(available, server_stats, key=key)
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(request: Request, path: str):
+    backend_url = None
     try:
-        backend_url = choose_server()
-        full_url = f"{backend_url}/{path}"
-
-        with connections_lock:
-            active_connections[backend_url] += 1
-
-        async with httpx.AsyncClient() as client:
-            import time
-            start = time.perf_counter()
-            response = await client.request(
-                request.method,
-                full_url,
-                headers=request.headers.raw,
-                content=await request.body()
-            )
-            duration = time.perf_counter() - start
-
-        # Track response time
-        latencies[backend_url].append(duration)
-        if len(latencies[backend_url]) > 10:
-            latencies[backend_url].pop(0)
-
-        return response.json()
-    
+        backend_url = choose_server(affinity.request_key(request, AFFINITY_KEY))
+
+        server_stats[backend_url].incr("active")
+
+        start = time.perf_counter()
+        response = await upstream_pools.send(backend_url, path, request)
+
+        # Track response time (time to upstream headers)
+        latency.observe(server_stats[backend_url], time.perf_counter() - start)
+
     except Exception as e:
-        return {"error": str(e)}
-    
-    finally:
-        with connections_lock:
-            if backend_url in active_connections:
-                active_connections[backend_url] = max(0, active_connections[backend_url] - 1)
+        release(backend_url)
+        if isinstance(e, HTTPException):
+            raise
+        prober.poke(backend_url)
+        raise HTTPException(502, str(e))
+
+    return streaming.relay(response, lambda: release(backend_url))
+
+def release(backend_url):
+    if backend_url in server_stats:
+        server_stats[backend_url].incr("active", -1)
@@ -1,9 +1,11 @@
 from fastapi import FastAPI, Request
-import httpx
+import asyncio
 import json
-from threading import Lock
 from prometheus_fastapi_instrumentator import Instrumentator
 import psutil
+import streaming
+import strategies
+import upstream
 
 app = FastAPI()
 Instrumentator().instrument(app).expose(app)
@@ -12,27 +14,28 @@ with open("servers.json") as f:
     servers = json.load(f)
 
 server_urls = [s["url"] for s in servers]
-last_index = -1
-lock = Lock()
+round_robin = strategies.get_strategy("round_robin")
+
+# a pooled, pre-warmed connection set per backend (upstream.py)
+upstream_pools = upstream.Pools(server_urls)
+
+@app.on_event("startup")
+async def startup():
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upstream_pools.aclose()
 
 def get_next_server():
-    global last_index
-    with lock:
-        last_index = (last_index + 1) % len(server_urls)
-        return server_urls[last_index]
+    return round_robin.pick(server_urls, None)
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
     backend_url = get_next_server()
-    full_url = f"{backend_url}/{path}"
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=request.method,
-            url=full_url,
-            headers=request.headers.raw,
-            content=await request.body()
-        )
-    return response.json()
+    response = await upstream_pools.send(backend_url, path, request)
+    return streaming.relay(response)
 
 @app.get("/metrics")
 async def metrics():
@@ -1,9 +1,10 @@
 from fastapi import FastAPI, Request
 import httpx
 import json
-from threading import Lock
 from prometheus_fastapi_instrumentator import Instrumentator
 import psutil
+import streaming
+import strategies
 
 app = FastAPI()
 Instrumentator().instrument(app).expose(app)
@@ -15,14 +16,10 @@ with open("servers.json") as f:
     servers = json.load(f)
 server_urls = [s["url"] for s in servers]
 
-last_index = -1
-lock = Lock()
+round_robin = strategies.get_strategy("round_robin")
 
 def get_next_server():
-    global last_index
-    with lock:
-        last_index = (last_index + 1) % len(server_urls)
-        return server_urls[last_index]
+    return round_robin.pick(server_urls, None)
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -31,16 +28,10 @@ async def shutdown_event():
 @app.api_route("/{path:path}", methods=["GET","POST","PUT","DELETE","PATCH"])
 async def proxy(path: str, request: Request):
     backend_url = get_next_server()
-    full_url = f"{backend_url}/{path}"
 
     # forward using the *same* client (reuses sockets)
-    response = await client.request(
-        request.method,
-        full_url,
-        headers=request.headers.raw,
-        content=await request.body()
-    )
-    return response.json()
+    response = await streaming.send(client, backend_url, path, request)
+    return streaming.relay(response)
 
 @app.get("/metrics")
 async def metrics():
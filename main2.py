@@ -1,7 +1,10 @@
 from fastapi import FastAPI, Request
-import httpx
+import asyncio
 import json
 from threading import Lock
+import streaming
+import strategies
+import upstream
 
 app = FastAPI()
 
@@ -9,31 +12,40 @@ with open("servers.json") as f:
     servers = json.load(f)
 
 server_urls = [s["url"] for s in servers]
-connections = {url: 0 for url in server_urls}
+connections = {url: {"active": 0} for url in server_urls}
+least_connections = strategies.get_strategy("least_connections")
 lock = Lock()
 
+# a pooled, pre-warmed connection set per backend (upstream.py)
+upstream_pools = upstream.Pools(server_urls)
+
+@app.on_event("startup")
+async def startup():
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upstream_pools.aclose()
+
 def get_least_loaded_server():
     with lock:
-        return min(server_urls, key=lambda url: connections[url])
+        return least_connections.pick(server_urls, connections)
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
     backend_url = get_least_loaded_server()
-    full_url = f"{backend_url}/{path}"
 
     with lock:
-        connections[backend_url] += 1
+        connections[backend_url]["active"] += 1
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=request.method,
-                url=full_url,
-                headers=request.headers.raw,
-                content=await request.body()
-            )
-    finally:
+    def release():
         with lock:
-            connections[backend_url] -= 1
+            connections[backend_url]["active"] -= 1
 
-    return response.json()
+    try:
+        response = await upstream_pools.send(backend_url, path, request)
+    except BaseException:
+        release()
+        raise
+    return streaming.relay(response, release)
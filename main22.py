@@ -3,6 +3,8 @@ import httpx
 import json
 from prometheus_fastapi_instrumentator import Instrumentator
 from threading import Lock
+import streaming
+import strategies
 
 app = FastAPI()
 Instrumentator().instrument(app).expose(app)
@@ -19,40 +21,41 @@ async def close_client():
 with open("servers.json") as f:
     servers = json.load(f)
 server_urls = [s["url"] for s in servers]
-connections = {url: 0 for url in server_urls}
+connections = {url: {"active": 0} for url in server_urls}
+least_connections = strategies.get_strategy("least_connections")
 lock = Lock()
 
 
 def get_least_loaded_server():
     with lock:
-        return min(server_urls, key=lambda url: connections[url])
+        return least_connections.pick(server_urls, connections)
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
     backend_url = get_least_loaded_server()
-    full_url = f"{backend_url}/{path}"
 
     # Increment active connection count
     with lock:
-        connections[backend_url] += 1
+        connections[backend_url]["active"] += 1
+
+    def release():
+        # Decrement active connection count
+        with lock:
+            connections[backend_url]["active"] = max(connections[backend_url]["active"] - 1, 0)
 
     try:
         # Reuse global client for keep-alive
-        response = await client.request(
-            request.method,
-            full_url,
-            headers=request.headers.raw,
-            content=await request.body()
-        )
+        response = await streaming.send(client, backend_url, path, request)
         if response.status_code >= 500:
             # Treat server errors as proxy errors
+            await response.aclose()
             raise HTTPException(status_code=502, detail=f"Upstream error: {response.status_code}")
     except httpx.RequestError as e:
         # Network or timeout failure
+        release()
         raise HTTPException(status_code=502, detail=str(e))
-    finally:
-        # Decrement active connection count
-        with lock:
-            connections[backend_url] = max(connections[backend_url] - 1, 0)
+    except HTTPException:
+        release()
+        raise
 
-    return response.json()
+    return streaming.relay(response, release)
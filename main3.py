@@ -1,7 +1,9 @@
 from fastapi import FastAPI, Request
-import httpx
+import asyncio
 import json
-import random
+import streaming
+import strategies
+import upstream
 
 app = FastAPI()
 
@@ -9,16 +11,22 @@ with open("servers.json") as f:
     servers = json.load(f)
 
 server_urls = [s["url"] for s in servers]
+random_choice = strategies.get_strategy("random")
+
+# a pooled, pre-warmed connection set per backend (upstream.py)
+upstream_pools = upstream.Pools(server_urls)
+
+@app.on_event("startup")
+async def startup():
+    upstream_pools.start()
+    asyncio.create_task(upstream_pools.warm_all())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upstream_pools.aclose()
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
-    backend_url = random.choice(server_urls)
-    full_url = f"{backend_url}/{path}"
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=request.method,
-            url=full_url,
-            headers=request.headers.raw,
-            content=await request.body()
-        )
-    return response.json()
+    backend_url = random_choice.pick(server_urls, None)
+    response = await upstream_pools.send(backend_url, path, request)
+    return streaming.relay(response)
@@ -1,8 +1,9 @@
 from fastapi import FastAPI, Request, HTTPException
 import httpx
 import json
-import random
 from prometheus_fastapi_instrumentator import Instrumentator
+import streaming
+import strategies
 
 app = FastAPI()
 # Expose Prometheus metrics
@@ -19,31 +20,22 @@ async def shutdown_event():
 with open("servers.json") as f:
     servers = json.load(f)
 server_urls = [s["url"] for s in servers]
+random_choice = strategies.get_strategy("random")
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy(path: str, request: Request):
-    # Prepare request data
-    body = await request.body()
-    method = request.method
-    headers = request.headers.raw
-
     # Randomly choose a backend
-    backend_url = random.choice(server_urls)
-    target_url = f"{backend_url}/{path}"
+    backend_url = random_choice.pick(server_urls, None)
 
     try:
         # Use global client to avoid per-request connection overhead
-        resp = await global_client.request(
-            method,
-            target_url,
-            headers=headers,
-            content=body
-        )
+        resp = await streaming.send(global_client, backend_url, path, request)
         # Treat 5xx from backend as failure
         if resp.status_code >= 500:
+            await resp.aclose()
             raise HTTPException(status_code=502, detail=f"Upstream error: {resp.status_code}")
     except httpx.RequestError as e:
         # Network or timeout error
         raise HTTPException(status_code=502, detail=str(e))
 
-    return resp.json()
+    return streaming.relay(resp)
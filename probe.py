@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import random
+import time
+
+# ------------------------------------------------
+# HEALTH-PROBE SCHEDULER
+# ------------------------------------------------
+# Every backend has its own due time on one heap, so probes are spread out
+# instead of all firing on the same tick, and the loop only wakes when the
+# next probe is due (cheap with thousands of backends). After a failure a
+# backend is re-probed after min_interval; each success in a row doubles
+# its interval up to max_interval. Intervals are jittered, and poke() lets
+# live traffic that just failed on a backend have it probed right away. At most
+# `concurrency` probes are outstanding, and each probe's timeout follows
+# that backend's probe latency. New targets are first probed at a random
+# point within min_interval, so a large pool isn't probed all at once.
+#
+# Health only flips after `fall` failed probes in a row (or `rise`
+# successes in a row to come back), so one slow probe under load doesn't
+# eject a backend and restart its slow-start ramp.
+
+
+class Target:
+    __slots__ = ("url", "interval", "rtt", "ok", "healthy", "streak", "last_ok", "gen", "due", "busy")
+
+    def __init__(self, url, interval, gen):
+        self.url = url
+        self.interval = interval
+        self.rtt = 0.0  # EWMA of successful probe latency
+        self.ok = True  # last probe's outcome
+        self.healthy = True  # after rise/fall
+        self.streak = 0  # probes in a row that disagree with healthy
+        self.last_ok = time.monotonic()
+        self.gen = gen
+        self.due = 0.0
+        self.busy = False
+
+
+class ProbeScheduler:
+    def __init__(self, check, on_result, urls=(), base_interval=2.0, min_interval=0.5,
+                 max_interval=5.0, jitter=0.2, concurrency=64, timeout=1.0,
+                 min_timeout=0.1, max_timeout=5.0, timeout_factor=4.0, rise=2, fall=2):
+        """
+        `check(url, timeout)` probes one backend (raises on failure, returns
+        anything on success); `on_result(url, ok, result, rtt)` is called after
+        every probe with the backend's health (rise/fall applied) as `ok` and
+        the check's return value, or the exception if this probe failed, as
+        `result`.
+        """
+        self.check = check
+        self.on_result = on_result
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.rise = rise
+        self.fall = fall
+        self.on_down = None  # on_down(url, seconds since its last good probe)
+        self.on_probe = None  # on_probe(url, ok, seconds) for overhead metrics
+        self.inflight = 0
+        self._sem = asyncio.Semaphore(concurrency)
+        self._targets = {}
+        self._heap = []
+        self._gen = 0
+        self._wake = None
+        self._task = None
+        self._pending = set()
+        self.set_targets(urls)
+
+    # ---- membership ----------------------------------------------------
+    def set_targets(self, urls):
+        """Probe exactly `urls`; new ones are probed within min_interval."""
+        urls = set(urls)
+        for url in self._targets.keys() - urls:
+            del self._targets[url]  # its heap entry is skipped when popped
+        now = time.monotonic()
+        for url in urls - self._targets.keys():
+            self._gen += 1
+            t = self._targets[url] = Target(url, self.base_interval, self._gen)
+            self._schedule(t, now + random.uniform(0, self.min_interval))
+        if self._wake:
+            self._wake.set()
+
+    def poke(self, url):
+        """Probe `url` now unless a probe is already out or due within min_interval."""
+        t = self._targets.get(url)
+        now = time.monotonic()
+        if t is not None and not t.busy and t.due > now + self.min_interval:
+            self._schedule(t, now)
+
+    def _schedule(self, t: Target, due: float):
+        t.due = due
+        heapq.heappush(self._heap, (due, t.gen, t.url))
+        if self._wake and self._heap[0][0] == due:
+            self._wake.set()  # due before whatever the loop is sleeping on
+
+    def __len__(self):
+        return len(self._targets)
+
+    def timeout_for(self, t: Target) -> float:
+        if not t.rtt:
+            return self.timeout
+        return min(max(self.timeout_factor * t.rtt, self.min_timeout), self.max_timeout)
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    # ---- loop -----------------------------------------------------------
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        tasks = [self._task, *self._pending] if self._task else list(self._pending)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, gen, url = heapq.heappop(self._heap)
+                t = self._targets.get(url)
+                if t is None or t.gen != gen or t.due != due:
+                    continue  # removed, re-added or rescheduled since
+                t.busy = True
+                # wait for a free slot here so due probes queue in heap order
+                await self._sem.acquire()
+                task = asyncio.create_task(self._probe(t))
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+            self._wake.clear()
+            delay = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _probe(self, t: Target):
+        self.inflight += 1
+        timeout = self.timeout_for(t)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self.check(t.url, timeout), timeout)
+            ok = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result, ok = e, False
+        finally:
+            t.busy = False
+            self.inflight -= 1
+            self._sem.release()
+        now = time.monotonic()
+        rtt = now - start
+        if self.on_probe:
+            self.on_probe(t.url, ok, rtt)
+        if self._targets.get(t.url) is not t:
+            return  # removed while the probe was out
+
+        if ok:
+            t.rtt = rtt if not t.rtt else 0.8 * t.rtt + 0.2 * rtt
+            t.interval = self.base_interval if not t.ok else min(t.interval * 2, self.max_interval)
+            t.ok, t.last_ok = True, now
+        else:
+            t.interval = self.min_interval if t.ok else min(t.interval * 2, self.base_interval)
+            t.ok = False
+        if ok == t.healthy:
+            t.streak = 0
+        else:
+            t.streak += 1
+            if t.streak >= (self.rise if ok else self.fall):
+                t.healthy, t.streak = ok, 0
+                if not ok and self.on_down:
+                    self.on_down(t.url, now - t.last_ok)
+        self.on_result(t.url, t.healthy, result, rtt)
+        self._schedule(t, now + self._jittered(t.interval))
+
+    def healthy(self, url) -> bool:
+        t = self._targets.get(url)
+        return t is None or t.healthy
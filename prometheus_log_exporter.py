@@ -1,78 +1,110 @@
-import requests
+"""
+Collects the PromQL queries below from Prometheus, concurrently, keeping
+every labelled series, and prints them or appends them to a file.
+
+    python prometheus_log_exporter.py                          # one instant snapshot
+    python prometheus_log_exporter.py --every 5 --out run.ndjson
+    python prometheus_log_exporter.py --start 2026-10-17T12:00:00 --end 2026-10-17T12:10:00 \\
+        --step 5 --out bench.csv                                # range over a benchmark window
+    python prometheus_log_exporter.py --last 600 --out bench.csv
+
+Output rows are (ts, query, labels, value); .csv writes labels as
+`k=v;k=v`, .ndjson as an object. Files are appended to, so a continuous
+run and later ranges can share one file.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
 import sys
+import time
+from datetime import datetime
+
+import httpx
 
 # Configuration
-PROMETHEUS_URL = "http://localhost:9090"
+PROMETHEUS_URL = os.environ.get("PROMETHEUS_URL", "http://localhost:9090")
+CONCURRENCY = 16  # queries in flight at once
+
+# The LB's own metrics (lbmetrics.py, lb_*) where the variant exports them,
+# otherwise the instrumentator's http_* series
+def lb_or_http(native: str, generic: str) -> str:
+    return f"({native}) or ({generic})"
 
 # Define PromQL queries for key metrics
 graph_queries = {
     # Request rates
-    "lb_requests_per_second":             'sum(rate(http_requests_total{job="load_balancer"}[1m]))',
     "backend_requests_per_second":        'sum(rate(http_requests_total{job="backend_servers"}[1m]))',
     "requests_per_second_per_backend":    'sum by (instance)(rate(http_requests_total{job="backend_servers"}[1m]))',
     # "backend_requests_per_second_by_instance":
     #     'sum by (instance)(rate(http_requests_total{job="backend_servers"}[1m]))',
 
     # Total counts
-    "load_balancer_total_requests":       'sum(http_requests_total{job="load_balancer"})',
     "backend_total_requests":             'sum(http_requests_total{job="backend_servers"})',
 
     # Average latency
-    "load_balancer_avg_latency":          'rate(http_request_duration_seconds_sum{job="load_balancer"}[1m]) / rate(http_request_duration_seconds_count{job="load_balancer"}[1m])',
     "backend_avg_latency":                'sum by (instance)(rate(http_request_duration_seconds_sum{job="backend_servers"}[1m])) / sum by (instance)(rate(http_request_duration_seconds_count{job="backend_servers"}[1m]))',
 
     # Latency percentiles (95th & 99th)
-    "load_balancer_p95_latency":         'histogram_quantile(0.95, sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
-    "load_balancer_p99_latency":         'histogram_quantile(0.99, sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
     "backend_p95_latency":               'histogram_quantile(0.95, sum by (le,instance)(rate(http_request_duration_seconds_bucket{job="backend_servers"}[1m])))',
     "backend_p99_latency":               'histogram_quantile(0.99, sum by (le,instance)(rate(http_request_duration_seconds_bucket{job="backend_servers"}[1m])))',
 
     # Error rates
-    "load_balancer_error_rate":           'sum(rate(http_requests_total{job="load_balancer",status!~"2.."}[1m]))',
     "backend_error_rate":                 'sum by (instance)(rate(http_requests_total{job="backend_servers",status!~"2.."}[1m]))',
     
     # Success rates
-    "load_balancer_success_rate":         'sum(rate(http_requests_total{job="load_balancer",status=~"2.."}[1m])) / sum(rate(http_requests_total{job="load_balancer"}[1m]))',
+    "load_balancer_success_rate":         lb_or_http(
+        'sum(rate(lb_requests_total{job="load_balancer",code="2xx"}[1m])) / sum(rate(lb_requests_total{job="load_balancer"}[1m]))',
+        'sum(rate(http_requests_total{job="load_balancer",status=~"2.."}[1m])) / sum(rate(http_requests_total{job="load_balancer"}[1m]))'),
     "backend_success_rate":               'sum(rate(http_requests_total{job="backend_servers",status=~"2.."}[1m])) / sum(rate(http_requests_total{job="backend_servers"}[1m]))',
 
    "backend_overall_avg_latency":
         'rate(http_request_duration_seconds_sum{job="backend_servers"}[1m]) '
         '/ rate(http_request_duration_seconds_count{job="backend_servers"}[1m])',
 
-    # Approximate average queue time in LB
+    # Admission queue (measured by the LB, see custom1 LB_MAX_CONCURRENCY)
     "avg_queue_time":
-       '('
-        'rate(http_request_duration_seconds_sum{job="load_balancer"}[1m]) '
-        '/ rate(http_request_duration_seconds_count{job="load_balancer"}[1m])'
-        ') - ('
-        'rate(http_request_duration_seconds_sum{job="backend_servers"}[1m]) '
-        '/ rate(http_request_duration_seconds_count{job="backend_servers"}[1m])'
-        ')',
+        'rate(lb_queue_wait_seconds_sum{job="load_balancer"}[1m]) '
+        '/ rate(lb_queue_wait_seconds_count{job="load_balancer"}[1m])',
+    "p99_queue_time":
+        'histogram_quantile(0.99, '
+        'sum by (le)(rate(lb_queue_wait_seconds_bucket{job="load_balancer"}[1m])))',
+    "queue_depth":
+        'sum(lb_queue_depth{job="load_balancer"})',
+    "shed_requests_per_second":
+        'sum(rate(lb_shed_requests_total{job="load_balancer"}[1m]))',
 
     # 1. Throughput (Requests/sec)
-    "lb_requests_per_second":
-        'rate(http_requests_total{job="load_balancer"}[1m])',
+    "lb_requests_per_second": lb_or_http(
+        'sum(rate(lb_requests_total{job="load_balancer"}[1m]))',
+        'sum(rate(http_requests_total{job="load_balancer"}[1m]))'),
 
     # 2. Total Requests Forwarded
-    "load_balancer_total_requests":
-        'sum(http_requests_total{job="load_balancer"})',
+    "load_balancer_total_requests": lb_or_http(
+        'sum(lb_requests_total{job="load_balancer"})',
+        'sum(http_requests_total{job="load_balancer"})'),
 
     # 3. Average Latency
-    "load_balancer_avg_latency":
-        'rate(http_request_duration_seconds_sum{job="load_balancer"}[1m]) '
-        '/ rate(http_request_duration_seconds_count{job="load_balancer"}[1m])',
+    "load_balancer_avg_latency": lb_or_http(
+        'sum(rate(lb_request_duration_seconds_sum{job="load_balancer"}[1m])) '
+        '/ sum(rate(lb_request_duration_seconds_count{job="load_balancer"}[1m]))',
+        'sum(rate(http_request_duration_seconds_sum{job="load_balancer"}[1m])) '
+        '/ sum(rate(http_request_duration_seconds_count{job="load_balancer"}[1m]))'),
 
     # 4. Tail Latency (P95 / P99)
-    "load_balancer_p95_latency":
-        'histogram_quantile(0.95, '
-        'sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
-    "load_balancer_p99_latency":
-        'histogram_quantile(0.99, '
-        'sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
+    "load_balancer_p95_latency": lb_or_http(
+        'histogram_quantile(0.95, sum by (le)(rate(lb_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
+        'histogram_quantile(0.95, sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))'),
+    "load_balancer_p99_latency": lb_or_http(
+        'histogram_quantile(0.99, sum by (le)(rate(lb_request_duration_seconds_bucket{job="load_balancer"}[1m])))',
+        'histogram_quantile(0.99, sum by (le)(rate(http_request_duration_seconds_bucket{job="load_balancer"}[1m])))'),
 
     # 5. Error Rate (non-2xx)
-    "load_balancer_error_rate":
-        'rate(http_requests_total{job="load_balancer",status!~"2.."}[1m])',
+    "load_balancer_error_rate": lb_or_http(
+        'sum(rate(lb_requests_total{job="load_balancer",code!="2xx"}[1m]))',
+        'sum(rate(http_requests_total{job="load_balancer",status!~"2.."}[1m]))'),
 
     # 6. Backend Distribution Fairness
     #    (requests/sec per backend instance + stddev across them)
@@ -87,46 +119,173 @@ graph_queries = {
     # "load_balancer_memory_bytes":
     #     'process_resident_memory_bytes{job="load_balancer"}',
 
-    # 8. Active Connections (requires you instrument a Gauge called active_connections)
-    # "load_balancer_active_connections":
-    #     'active_connections{job="load_balancer"}',
-
-    # 9. Queue Time Approximation
-    # "avg_queue_time":
-    #     '('
-    #     'rate(http_request_duration_seconds_sum{job="load_balancer"}[1m]) '
-    #     '/ rate(http_request_duration_seconds_count{job="load_balancer"}[1m])'
-    #     ') - ('
-    #     'rate(http_request_duration_seconds_sum{job="backend_servers"}[1m]) '
-    #     '/ rate(http_request_duration_seconds_count{job="backend_servers"}[1m])'
-    #     ')',
+    # 8. Active Connections (client requests in flight, and per backend)
+    "load_balancer_active_connections":
+        'sum(lb_inflight{job="load_balancer"})',
+    "backend_inflight_by_instance":
+        'max by (backend)(lb_backend_inflight{job="load_balancer"})',
+
+    # 9. Queue Time: measured directly, see avg_queue_time / p99_queue_time above
+
+    # 10. Upstream latency as the LB sees it (to response headers), per backend
+    "upstream_p99_latency_by_backend":
+        'histogram_quantile(0.99, '
+        'sum by (le,backend)(rate(lb_upstream_latency_seconds_bucket{job="load_balancer"}[1m])))',
+    "upstream_error_rate_by_backend":
+        'sum by (backend)(rate(lb_upstream_responses_total{job="load_balancer",code=~"5xx|error"}[1m]))',
+
+    # 11. Retries, selection cost and pool health
+    "retries_per_second":
+        'sum(rate(lb_retries_total{job="load_balancer"}[1m]))',
+    "avg_selection_time":
+        'sum(rate(lb_selection_seconds_sum{job="load_balancer"}[1m])) '
+        '/ sum(rate(lb_selection_seconds_count{job="load_balancer"}[1m]))',
+    "healthy_backends":
+        'sum(max by (backend)(lb_backend_healthy{job="load_balancer"}))',
+    "ejected_backends":
+        'sum(max by (backend)(lb_backend_ejected{job="load_balancer"}))',
 }
 
-def query_prometheus(promql: str):
+# ------------------------------------------------
+# QUERYING
+# ------------------------------------------------
+def _series(data):
+    """(labels, [(ts, value), ...]) per series of a vector/matrix/scalar result."""
+    kind, result = data.get("resultType"), data.get("result", [])
+    if kind == "scalar":
+        return [({}, [(float(result[0]), float(result[1]))])]
+    out = []
+    for r in result:
+        labels = r.get("metric", {})
+        if "values" in r:
+            out.append((labels, [(float(t), float(v)) for t, v in r["values"]]))
+        else:
+            out.append((labels, [(float(r["value"][0]), float(r["value"][1]))]))
+    return out
+
+
+async def query(client, promql, at=None):
+    params = {"query": promql}
+    if at is not None:
+        params["time"] = at
+    r = await client.get("/api/v1/query", params=params)
+    r.raise_for_status()
+    return _series(r.json()["data"])
+
+
+async def query_range(client, promql, start, end, step):
+    r = await client.get("/api/v1/query_range",
+                         params={"query": promql, "start": start, "end": end, "step": step})
+    r.raise_for_status()
+    return _series(r.json()["data"])
+
+
+async def collect(client, queries, at=None, window=None):
     """
-    Query Prometheus API and return the 'value' for the first result.
+    Run every query at once (at most CONCURRENCY in flight). `window` is
+    (start, end, step) for range queries, else an instant query at `at`
+    (default: now). Returns rows (ts, name, labels, value); a failing
+    query is reported on stderr and skipped.
     """
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(name, promql):
+        async with sem:
+            try:
+                if window:
+                    series = await query_range(client, promql, *window)
+                else:
+                    series = await query(client, promql, at)
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                print(f"Error querying Prometheus ({name}): {e}", file=sys.stderr)
+                return []
+        return [(ts, name, labels, value) for labels, points in series for ts, value in points]
+
+    results = await asyncio.gather(*(one(n, q) for n, q in queries.items()))
+    return [row for rows in results for row in rows]
+
+
+# ------------------------------------------------
+# OUTPUT
+# ------------------------------------------------
+def _label_str(labels):
+    return ";".join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+
+class Writer:
+    """Appends rows to .csv or .ndjson (chosen by extension), or prints them."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.csv = bool(path) and path.endswith(".csv")
+        if path and not self.csv and not path.endswith((".ndjson", ".jsonl")):
+            raise ValueError("output must be .csv, .ndjson or .jsonl")
+        if self.csv and not os.path.exists(path):
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerow(("ts", "query", "labels", "value"))
+
+    def write(self, rows):
+        if not self.path:
+            for ts, name, labels, value in rows:
+                print(f"{name}{{{_label_str(labels)}}}: {value}" if labels else f"{name}: {value}")
+            return
+        with open(self.path, "a", newline="") as f:
+            if self.csv:
+                csv.writer(f).writerows((ts, name, _label_str(labels), value) for ts, name, labels, value in rows)
+            else:
+                # NaN and +-Inf -> null: JSON has no literal for them
+                f.writelines(json.dumps({"ts": ts, "query": name, "labels": labels,
+                                        "value": value if math.isfinite(value) else None}, allow_nan=False) + "\n"
+                             for ts, name, labels, value in rows)
+
+
+# ------------------------------------------------
+# CLI
+# ------------------------------------------------
+def _timestamp(value):
+    """Unix seconds or an ISO-8601 time (local time if no zone is given)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+async def run(args, transport=None):
+    writer = Writer(args.out)
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits,
+                                 transport=transport) as client:
+        if args.start or args.last:
+            end = _timestamp(args.end) if args.end else time.time()
+            start = _timestamp(args.start) if args.start else end - args.last
+            writer.write(await collect(client, graph_queries, window=(start, end, args.step)))
+            return
+        while True:
+            tick = time.monotonic()
+            writer.write(await collect(client, graph_queries))
+            if not args.every:
+                return
+            await asyncio.sleep(max(0.0, args.every - (time.monotonic() - tick)))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--url", default=PROMETHEUS_URL)
+    p.add_argument("--out", help="append rows to this .csv / .ndjson file (default: print)")
+    p.add_argument("--every", type=float, help="keep collecting instant values every N seconds")
+    p.add_argument("--start", help="range start (unix seconds or ISO time)")
+    p.add_argument("--end", help="range end (default: now)")
+    p.add_argument("--last", type=float, help="range over the last N seconds")
+    p.add_argument("--step", type=float, default=5.0, help="range resolution in seconds")
+    p.add_argument("--timeout", type=float, default=10.0)
+    return p.parse_args(argv)
+
+
+def main(argv=None):
     try:
-        resp = requests.get(
-            f"{PROMETHEUS_URL}/api/v1/query",
-            params={"query": promql},
-            timeout=5
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("data", {}).get("result", [])
-        if not results:
-            return 0.0
-        return float(results[0]["value"][1])
-    except Exception as e:
-        print(f"Error querying Prometheus ({promql}): {e}", file=sys.stderr)
-        return None
-
-def main():
-    print("Fetching metrics from Prometheus...\n")
-    for name, promql in graph_queries.items():
-        val = query_prometheus(promql)
-        print(f"{name}: {val}")
+        asyncio.run(run(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
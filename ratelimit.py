@@ -0,0 +1,118 @@
+import math
+import time
+from collections import OrderedDict
+
+# ------------------------------------------------
+# PER-CLIENT RATE LIMITING
+# ------------------------------------------------
+# A token bucket per client: the API key header when one is configured and
+# the key is listed in a class, else the client IP. Unknown keys are not
+# trusted as identities, so rotating the header gains nothing. Buckets refill lazily; a bucket is just
+# [tokens, stamp, full_at] and is topped up by rate * elapsed when its
+# client next shows up, so idle clients cost nothing.
+#
+# Buckets sit in an OrderedDict in last-use order. A bucket past its
+# full_at holds `burst` tokens again, which is the same as having no
+# bucket, so such buckets are dropped from the old end as requests come
+# in. `max_keys` bounds memory when more clients than that are active at
+# once: the least recently seen one is forgotten and starts over with a
+# full bucket. Every operation is O(1) amortized however many distinct
+# clients there are.
+#
+# Clients belong to a class with its own rate, burst and fair-queuing
+# weight (see admission.py); unlisted clients are in DEFAULT. Limits are
+# per process: with `--workers N` a client gets up to N times its rate.
+DEFAULT = "default"
+
+
+class ClientClass:
+    __slots__ = ("name", "rate", "burst", "weight")
+
+    def __init__(self, name, rate=0.0, burst=None, weight=1.0):
+        if rate < 0 or (burst is not None and burst < 1) or weight <= 0:
+            raise ValueError(f"client class {name!r}: rate >= 0, burst >= 1 and weight > 0 required")
+        self.name = name
+        self.rate = rate  # tokens per second; 0 = unlimited
+        self.burst = burst or max(rate, 1.0)
+        self.weight = weight
+
+
+class RateLimiter:
+    def __init__(self, rate=0.0, burst=None, weight=1.0, classes=None, header=None, max_keys=100_000):
+        """
+        `classes` is {name: {"clients": [api key or IP, ...], "rate", "burst",
+        "weight"}}, e.g. parsed from LB_CLIENT_CLASSES.
+        """
+        self.default = ClientClass(DEFAULT, rate, burst, weight)
+        self.classes = {DEFAULT: self.default}
+        self._members = {}  # api key or IP -> ClientClass
+        for name, spec in (classes or {}).items():
+            cls = self.classes[name] = ClientClass(
+                name, spec.get("rate", 0.0), spec.get("burst"), spec.get("weight", 1.0))
+            for client in spec.get("clients", ()):
+                self._members[client] = cls
+        self.header = header.lower() if header else None
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # client key -> [tokens, stamp, full_at]
+
+    @property
+    def enabled(self):
+        return any(c.rate > 0 for c in self.classes.values())
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def classify(self, request):
+        """(client key, ClientClass) for a request."""
+        if self.header:
+            key = request.headers.get(self.header)
+            if key and key in self._members:
+                return "key:" + key, self._members[key]
+        host = request.client.host if request.client else ""
+        return "ip:" + host, self._members.get(host, self.default)
+
+    def take(self, client, cls, now=None) -> float:
+        """Spend one of client's tokens: 0.0 if it had one, else seconds until it will."""
+        if cls.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        buckets = self._buckets
+        bucket = buckets.get(client)
+        if bucket is None:
+            tokens = cls.burst
+            bucket = buckets[client] = [0.0, 0.0, 0.0]
+        else:
+            buckets.move_to_end(client)
+            tokens = min(cls.burst, bucket[0] + (now - bucket[1]) * cls.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / cls.rate
+        bucket[0], bucket[1], bucket[2] = tokens, now, now + (cls.burst - tokens) / cls.rate
+        self._evict(now)
+        return wait
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            client = next(iter(buckets))
+            if buckets[client][2] > now and len(buckets) <= self.max_keys:
+                break
+            del buckets[client]
+
+    def export(self):
+        return {
+            "header": self.header,
+            "tracked_clients": len(self._buckets),
+            "max_keys": self.max_keys,
+            "classes": {
+                c.name: {"rate": c.rate, "burst": c.burst, "weight": c.weight,
+                         "clients": sum(1 for m in self._members.values() if m is c)}
+                for c in self.classes.values()
+            },
+        }
+
+
+def retry_after(wait: float) -> int:
+    return max(1, math.ceil(wait))
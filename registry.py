@@ -0,0 +1,120 @@
+import json
+import os
+
+import latency
+
+# ------------------------------------------------
+# LIVE BACKEND REGISTRY
+# ------------------------------------------------
+# Membership, weight and drain state live in the stats table next to the
+# backend's counters (member / weight / draining columns), so a reload or
+# an admin call never resets stats, and with LB_SHARED_STATE every worker
+# sees the same pool. servers.json is polled; only what changed in the
+# file since the last load is applied, so admin edits survive unrelated
+# file edits.
+#
+# A servers.json entry is {"url": ..., "weight": 1.0, "max_concurrency": 0}:
+# weight is relative capacity, max_concurrency caps in-flight requests to
+# the backend (0 = the balancer's default). Backends that join after start
+# or come back to health get a slow start (strategies.ramp) of
+# `slow_start` seconds.
+DRAINING, REMOVING = 1, 2  # values of the "draining" column
+
+
+def load_specs(path: str) -> dict:
+    """url -> {"weight", "max_concurrency"} from a servers.json list."""
+    with open(path) as f:
+        specs = {
+            s["url"]: {"weight": float(s.get("weight", 1.0)), "max_concurrency": int(s.get("max_concurrency", 0))}
+            for s in json.load(f)
+        }
+    for url, spec in specs.items():
+        if spec["weight"] < 0 or spec["max_concurrency"] < 0:
+            raise ValueError(f"{url}: weight and max_concurrency must be >= 0")
+    return specs
+
+
+class Registry:
+    def __init__(self, table, path="servers.json", slow_start=0.0):
+        self.table = table
+        self.path = path
+        self.slow_start = slow_start
+        self._mtime = None
+        self._file = {}
+
+    # ---- admin operations ----------------------------------------------
+    def add(self, url, weight=None, max_concurrency=None, ramp=True):
+        joining = url not in self
+        row = self.table.add(url)
+        row.update({"member": 1, "draining": 0})
+        if weight is not None:
+            row["weight"] = weight
+        if max_concurrency is not None:
+            row["max_concurrency"] = max_concurrency
+        if joining and ramp:
+            self.ramp(url)
+        return row
+
+    def ramp(self, url):
+        """Start url's slow start: its effective weight ramps up from now."""
+        if self.slow_start > 0:
+            self.table[url].update({"ramp_start": latency.clock(), "ramp_secs": self.slow_start})
+
+    def remove(self, url):
+        """Stop sending new requests; drop it once its in-flight requests and
+        streams (moved off by the stream rebalancer) are done."""
+        self.table[url]["draining"] = REMOVING
+
+    def drain(self, url, on=True):
+        self.table[url]["draining"] = DRAINING if on else 0
+
+    def set_weight(self, url, weight):
+        self.table[url]["weight"] = weight
+
+    def set_max_concurrency(self, url, limit):
+        self.table[url]["max_concurrency"] = limit
+
+    def __contains__(self, url):
+        return url in self.table and self.table[url]["member"]
+
+    # ---- file reload ---------------------------------------------------
+    def reload(self) -> bool:
+        """Apply servers.json changes if its mtime moved; True if it did."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            specs = load_specs(self.path)
+        except (ValueError, KeyError, TypeError):
+            return False  # half-written or invalid: keep the current pool
+        initial = self._mtime is None
+        self._mtime = mtime
+        for url, spec in specs.items():
+            if url not in self._file:
+                self.add(url, **spec, ramp=not initial)  # no slow start for the pool we start with
+            elif url in self:
+                old = self._file[url]
+                if spec["weight"] != old["weight"]:
+                    self.set_weight(url, spec["weight"])
+                if spec["max_concurrency"] != old["max_concurrency"]:
+                    self.set_max_concurrency(url, spec["max_concurrency"])
+        for url in self._file.keys() - specs.keys():
+            if url in self:
+                self.remove(url)
+        self._file = specs
+        return True
+
+    def members(self) -> list:
+        """Current pool; finishes removals with nothing left in flight."""
+        out = []
+        for url, row in self.table.items():
+            if not row["member"]:
+                continue
+            if row["draining"] == REMOVING and row["active"] <= 0 and row["streams"] <= 0:
+                row.update({"member": 0, "draining": 0})
+                continue
+            out.append(url)
+        return out
@@ -0,0 +1,153 @@
+import json
+import os
+
+# ------------------------------------------------
+# ROUTES, BACKEND POOLS AND LEARNED ROUTE COSTS
+# ------------------------------------------------
+# routes.json (LB_ROUTES_FILE, hot-reloaded like servers.json):
+#
+#   {"pools": {"reports": ["http://localhost:8003"]},
+#    "routes": [
+#       {"path": "/reports/**", "pool": "reports"},
+#       {"path": "/api/users/*/export", "methods": ["POST"], "pool": "reports"},
+#       {"path": "/api/**", "name": "api"}]}
+#
+# Paths are matched segment by segment through a trie built once per load,
+# so lookup cost depends on the path's depth, not the number of routes. A
+# literal segment beats "*" (any one segment), which beats a trailing "**"
+# (the rest of the path, possibly empty); among routes on the same pattern
+# the first whose methods include the request's wins. A route without a
+# pool may go to any backend; unmatched paths get the DEFAULT route.
+#
+# Every route learns its cost: an EWMA of upstream time for its requests.
+# A request in flight adds its route's cost to the backend's "work"
+# column, which strategies.LeastWork balances on.
+DEFAULT = "default"
+
+
+class Route:
+    __slots__ = ("name", "pool", "methods", "cost", "samples")
+
+    def __init__(self, name, pool=None, methods=None):
+        self.name = name
+        self.pool = pool
+        self.methods = frozenset(m.upper() for m in methods) if methods else None
+        self.cost = 0.0  # seconds, EWMA
+        self.samples = 0
+
+
+class _Node:
+    __slots__ = ("children", "star", "rest", "routes")
+
+    def __init__(self):
+        self.children = {}
+        self.star = None  # "*"
+        self.rest = []  # routes ending in "**"
+        self.routes = []  # routes ending exactly here
+
+
+def _segments(path):
+    return [s for s in path.split("/") if s]
+
+
+def _first(routes, method):
+    for route in routes:
+        if route.methods is None or method in route.methods:
+            return route
+    return None
+
+
+class Router:
+    def __init__(self, path=None, alpha=0.1, initial_cost=0.01, settle=20):
+        self.path = path
+        self.alpha = alpha
+        self.initial_cost = initial_cost
+        self.settle = settle  # samples before a learned cost is trusted as a baseline
+        self.default = Route(DEFAULT)
+        self.routes = {DEFAULT: self.default}  # name -> Route
+        self.pools = {}  # name -> frozenset of urls
+        self._root = _Node()
+        self._mtime = None
+
+    # ---- config --------------------------------------------------------
+    def load(self, spec: dict):
+        """Build the trie from a routes.json dict; learned costs carry over by route name."""
+        pools = {name: frozenset(u.rstrip("/") for u in urls) for name, urls in spec.get("pools", {}).items()}
+        root = _Node()
+        routes = {DEFAULT: self.default}
+        for r in spec.get("routes", []):
+            pattern = r["path"]
+            pool = r.get("pool")
+            if pool is not None and pool not in pools:
+                raise ValueError(f"route {pattern!r}: unknown pool {pool!r}")
+            segs = _segments(pattern)
+            if "**" in segs[:-1]:
+                raise ValueError(f"route {pattern!r}: '**' must be the last segment")
+            methods = r.get("methods")
+            name = r.get("name") or (f"{' '.join(methods)} {pattern}" if methods else pattern)
+            route = Route(name, pool, methods)
+            old = self.routes.get(name)
+            if old is not None:
+                route.cost, route.samples = old.cost, old.samples
+            routes[name] = route
+            node = root
+            for seg in (segs[:-1] if segs and segs[-1] == "**" else segs):
+                if seg == "*":
+                    node.star = node.star or _Node()
+                    node = node.star
+                else:
+                    node = node.children.setdefault(seg, _Node())
+            (node.rest if segs and segs[-1] == "**" else node.routes).append(route)
+        self._root, self.routes, self.pools = root, routes, pools
+
+    def reload(self) -> bool:
+        """Apply routes.json changes if its mtime moved; True if it did."""
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            with open(self.path) as f:
+                self.load(json.load(f))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False  # half-written or invalid: keep the current routes
+        self._mtime = mtime
+        return True
+
+    # ---- lookup --------------------------------------------------------
+    def match(self, path: str, method: str = "GET") -> Route:
+        return self._match(self._root, _segments(path), 0, method.upper()) or self.default
+
+    def _match(self, node, segs, i, method):
+        if i == len(segs):
+            return _first(node.routes, method) or _first(node.rest, method)
+        child = node.children.get(segs[i])
+        if child is not None:
+            route = self._match(child, segs, i + 1, method)
+            if route is not None:
+                return route
+        if node.star is not None:
+            route = self._match(node.star, segs, i + 1, method)
+            if route is not None:
+                return route
+        return _first(node.rest, method)
+
+    # ---- costs ---------------------------------------------------------
+    def cost(self, route: Route) -> float:
+        """Expected upstream seconds; unseen routes get the mean of the learned ones."""
+        if route.samples:
+            return route.cost
+        known = [r.cost for r in self.routes.values() if r.samples]
+        return sum(known) / len(known) if known else self.initial_cost
+
+    def baseline(self, route: Route) -> float:
+        """The route's own learned cost once it has `settle` samples, else 0 (unknown)."""
+        return route.cost if route.samples >= self.settle else 0.0
+
+    def observe(self, route: Route, seconds: float):
+        route.cost = seconds if not route.samples else route.cost + self.alpha * (seconds - route.cost)
+        route.samples += 1
@@ -0,0 +1,417 @@
+import fcntl
+import hashlib
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    import numpy as np
+except ImportError:  # arrays() is optional; strategies fall back to rows
+    np = None
+
+# ------------------------------------------------
+# BACKEND STATE TABLE
+# ------------------------------------------------
+# Column-major float64 table, either private (bytearray) or in
+# multiprocessing.shared_memory so every `uvicorn --workers N` process
+# balances on the same numbers. Rows behave like the stats dicts the
+# strategies already read: row["active"], row.get("latency"), row.update().
+#
+# Counters (SHARDED) are split per worker: each worker only ever writes its
+# own column and readers sum across them, so increments from different
+# processes never race. Everything else is last-writer-wins, which is fine
+# for health bits and EWMAs.
+#
+# Each process attached to a shared table holds a worker slot, recorded
+# with its pid. A slot's columns are zeroed when it is taken and when its
+# process detaches, and reap() frees the slots of processes that died
+# without detaching, so a crashed worker's in-flight counts don't stay in
+# the totals. Slots are reused, so the columns in use stay bounded.
+#
+# Rows are never freed: a backend removed through the registry just has
+# member=0, so its stats are still there if it comes back.
+FIELDS = ("cpu", "mem", "latency", "stamp", "healthy", "last_ping", "weight", "draining", "member",
+          "max_concurrency", "ramp_start", "ramp_secs", "peer_active", "peer_ejected")
+# values for new rows; everything else starts at 0
+DEFAULTS = {"healthy": 1.0, "weight": 1.0, "member": 1.0}
+# per-worker columns: in-flight requests, open long-lived streams (WebSocket
+# / SSE), each worker's stream message rate (see longlived.py) and the
+# expected work of its in-flight requests in seconds (see routes.py)
+SHARDED = ("active", "streams", "msg_rate", "work")
+MAX_WORKERS = 64
+URL_BYTES = 256
+HEADER = 8  # magic, capacity, count, cursor, workers, attached, worker columns, gossiping pid
+MAGIC = 0x4C42535442  # "LBSTB": header, columns, urls, then a pid per worker slot
+_H_CAPACITY, _H_COUNT, _H_CURSOR, _H_WORKERS, _H_ATTACHED, _H_WCOLS, _H_GOSSIP = 1, 2, 3, 4, 5, 6, 7
+
+_TYPES = {"active": int, "streams": int, "healthy": bool, "draining": int, "member": bool, "max_concurrency": int,
+          "peer_ejected": bool}
+
+
+def table_size(capacity: int, wcols: int = MAX_WORKERS) -> int:
+    ncols = len(FIELDS) + len(SHARDED) * wcols
+    return (HEADER + ncols * capacity) * 8 + capacity * URL_BYTES + wcols * 8
+
+
+class Row:
+    __slots__ = ("_t", "_i")
+
+    def __init__(self, table, i):
+        self._t = table
+        self._i = i
+
+    def __getitem__(self, field):
+        t, i = self._t, self._i
+        offs = t._shard_offs.get(field)
+        if offs is not None:
+            v = sum(t._cols[off + i] for off in offs)
+        else:
+            v = t._cols[t._offs[field] + i]
+        return _TYPES[field](v) if field in _TYPES else v
+
+    def __setitem__(self, field, value):
+        t, i = self._t, self._i
+        if field in t._own:
+            # only exact when no other worker moves in between; prefer incr()
+            t._cols[t._own[field] + i] += value - self[field]
+            return
+        t._cols[t._offs[field] + i] = float(value)
+
+    def __contains__(self, field):
+        return field in self._t._offs or field in self._t._own
+
+    def get(self, field, default=None):
+        return self[field] if field in self else default
+
+    def incr(self, field, n=1):
+        """Atomic across workers for SHARDED fields (own column only)."""
+        t = self._t
+        if field in t._own:
+            t._cols[t._own[field] + self._i] += n
+        else:
+            t._cols[t._offs[field] + self._i] += n
+
+    def set_own(self, field, value):
+        """This worker's share of a SHARDED field, e.g. its own msg_rate."""
+        self._t._cols[self._t._own[field] + self._i] = float(value)
+
+    def update(self, values):
+        for k, v in values.items():
+            self[k] = v
+
+    def copy(self):
+        d = {f: self[f] for f in FIELDS}
+        for f in SHARDED:
+            d[f] = self[f]
+        return d
+
+    def __repr__(self):
+        return f"Row({self.copy()})"
+
+
+class StatsTable:
+    def __init__(self, buf, capacity, wcols=MAX_WORKERS, worker=0, shm=None, lock_path=None):
+        self._shm = shm
+        self._lock_path = lock_path
+        self._cols = memoryview(buf).cast("B")[: (HEADER + (len(FIELDS) + len(SHARDED) * wcols) * capacity) * 8].cast("d")
+        self._urls = memoryview(buf)[len(self._cols) * 8: len(self._cols) * 8 + capacity * URL_BYTES]
+        pids = len(self._cols) * 8 + capacity * URL_BYTES
+        self._pids = memoryview(buf).cast("B")[pids: pids + wcols * 8].cast("d")
+        self.capacity = capacity
+        self.worker = worker
+        self._offs = {f: HEADER + c * capacity for c, f in enumerate(FIELDS)}
+        self._shard_offs = {
+            f: [HEADER + (len(FIELDS) + k * wcols + w) * capacity for w in range(wcols)]
+            for k, f in enumerate(SHARDED)
+        }
+        self._active_offs = self._shard_offs["active"]
+        self._own = {f: offs[worker % wcols] for f, offs in self._shard_offs.items()}
+        self._index = {}
+        self._np = None
+        self._np_sharded = {}
+        self._sync_index()
+
+    # ---- construction -------------------------------------------------
+    @classmethod
+    def local(cls, urls, capacity=1024):
+        capacity = max(capacity, len(urls))
+        table = cls(bytearray(table_size(capacity, 1)), capacity, wcols=1)
+        table._init_header(wcols=1)
+        for url in urls:
+            table.add(url)
+        return table
+
+    @classmethod
+    def shared(cls, urls, name=None, capacity=1024):
+        """
+        Create or attach the segment `name`. The default name is tied to this
+        run of the parent process (the uvicorn supervisor shared by all
+        workers) and its command line, see default_name().
+        """
+        name = name or default_name()
+        lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        with _flock(lock_path):
+            try:
+                shm = _open_segment(name, create=True, size=table_size(capacity))
+                created = True
+            except FileExistsError:
+                shm = _open_segment(name)
+                created = False
+            cols = shm.buf.cast("d")
+            if created:
+                cols[0], cols[_H_CAPACITY], cols[_H_WCOLS] = MAGIC, capacity, MAX_WORKERS
+            magic, capacity = cols[0], int(cols[_H_CAPACITY])
+            cols.release()
+            if magic != MAGIC:
+                shm.close()
+                raise RuntimeError(f"shared memory segment {name} has another layout; remove /dev/shm/{name}")
+            table = cls(shm.buf, capacity, shm=shm, lock_path=lock_path)
+            table._attach()
+            for url in urls:
+                table._add(url)  # already holding the lock
+        return table
+
+    def _attach(self):
+        # take a free slot, after freeing those of dead processes
+        self._reap()
+        free = [w for w in range(len(self._pids)) if not self._pids[w]]
+        if not free:
+            raise RuntimeError(f"more than {len(self._pids)} processes attached to the stats table")
+        self.worker = free[0]
+        self._own = {f: offs[self.worker] for f, offs in self._shard_offs.items()}
+        self._zero(self.worker)
+        self._pids[self.worker] = os.getpid()
+        self._cols[_H_WORKERS] = max(self._cols[_H_WORKERS], self.worker + 1)
+        self._cols[_H_ATTACHED] += 1
+
+    def _zero(self, worker):
+        for offs in self._shard_offs.values():
+            off = offs[worker]
+            self._cols[off:off + self.capacity] = memoryview(bytes(self.capacity * 8)).cast("d")
+
+    def _reap(self) -> int:
+        freed = 0
+        for w in range(len(self._pids)):
+            pid = int(self._pids[w])
+            if pid and not _alive(pid):
+                self._zero(w)
+                self._pids[w] = 0
+                self._cols[_H_ATTACHED] -= 1
+                freed += 1
+        return freed
+
+    def reap(self) -> int:
+        """Free the slots of attached processes that died without close(); returns how many."""
+        if self._shm is None:
+            return 0
+        with _flock(self._lock_path):
+            return self._reap()
+
+    def _init_header(self, wcols):
+        self._cols[0] = MAGIC
+        self._cols[_H_CAPACITY] = self.capacity
+        self._cols[_H_WCOLS] = wcols
+
+    def close(self):
+        """Detach; the last process attached unlinks the segment."""
+        if self._shm is None:
+            return
+        self._np = None  # numpy views pin the buffer
+        self._np_sharded = {}
+        with _flock(self._lock_path):
+            self._zero(self.worker)
+            self._pids[self.worker] = 0
+            self._cols[_H_ATTACHED] -= 1
+            last = self._cols[_H_ATTACHED] <= 0
+            self._cols.release()
+            self._urls.release()
+            self._pids.release()
+            self._shm.close()
+            if last:
+                if not getattr(self._shm, "_track", True):
+                    self._shm.unlink()
+                else:
+                    # pre-3.13 unlink() also unregisters; pair it with a register
+                    resource_tracker.register(self._shm._name, "shared_memory")
+                    self._shm.unlink()
+        self._shm = None
+
+    # ---- rows ---------------------------------------------------------
+    def _sync_index(self):
+        for i in range(len(self._index), int(self._cols[_H_COUNT])):
+            raw = bytes(self._urls[i * URL_BYTES:(i + 1) * URL_BYTES]).rstrip(b"\0")
+            self._index[raw.decode()] = i
+
+    def add(self, url):
+        """Row for `url`, allocating it (see DEFAULTS) if it is new."""
+        if self._lock_path and self._shm is not None:
+            with _flock(self._lock_path):  # workers may add concurrently
+                return self._add(url)
+        return self._add(url)
+
+    def _add(self, url):
+        self._sync_index()
+        if url in self._index:
+            return self[url]
+        raw = url.encode()
+        if len(raw) > URL_BYTES:
+            raise ValueError(f"backend URL longer than {URL_BYTES} bytes: {url}")
+        i = int(self._cols[_H_COUNT])
+        if i >= self.capacity:
+            raise RuntimeError(f"stats table full ({self.capacity} backends)")
+        self._urls[i * URL_BYTES:i * URL_BYTES + len(raw)] = raw
+        for field, value in DEFAULTS.items():
+            self._cols[self._offs[field] + i] = value
+        self._cols[_H_COUNT] = i + 1
+        self._index[url] = i
+        return Row(self, i)
+
+    def __getitem__(self, url):
+        i = self._index.get(url)
+        if i is None:
+            self._sync_index()  # added by another worker
+            i = self._index[url]
+        return Row(self, i)
+
+    def __contains__(self, url):
+        if url not in self._index:
+            self._sync_index()
+        return url in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [Row(self, i) for i in self._index.values()]
+
+    def items(self):
+        self._sync_index()
+        return [(u, Row(self, i)) for u, i in self._index.items()]
+
+    def rows(self, urls):
+        """Row numbers of `urls`, for indexing the arrays() columns."""
+        index = self._index
+        if not all(u in index for u in urls):
+            self._sync_index()
+        return np.fromiter((index[u] for u in urls), dtype=np.intp, count=len(urls))
+
+    def columns(self):
+        """
+        Zero-copy numpy views: a (len(FIELDS), capacity) matrix and the
+        "active" column summed over the worker columns in use, both indexed
+        by row number. None without numpy. Don't hold on to them across
+        awaits: close() needs them gone.
+        """
+        if np is None:
+            return None
+        if self._np is None:
+            flat = np.frombuffer(self._cols, dtype=np.float64)
+            cap = self.capacity
+            fields = flat[HEADER:HEADER + len(FIELDS) * cap].reshape(len(FIELDS), cap)
+            first = self._active_offs[0]
+            workers = flat[first:first + len(self._active_offs) * cap].reshape(-1, cap)
+            self._np = (flat[:HEADER], fields, workers)
+        header, fields, workers = self._np
+        n = max(1, min(int(header[_H_WORKERS]), len(workers)))
+        return fields, workers[0] if n == 1 else workers[:n].sum(axis=0)
+
+    def sharded(self, field):
+        """A SHARDED field summed over the worker columns in use, as columns() does for "active"."""
+        if field == "active":
+            return self.columns()[1]
+        if np is None:
+            return None
+        workers = self._np_sharded.get(field)
+        if workers is None:
+            flat = np.frombuffer(self._cols, dtype=np.float64)
+            offs = self._shard_offs[field]
+            workers = self._np_sharded[field] = flat[offs[0]:offs[0] + len(offs) * self.capacity].reshape(-1, self.capacity)
+        n = max(1, min(int(self._cols[_H_WORKERS]), len(workers)))
+        return workers[0] if n == 1 else workers[:n].sum(axis=0)
+
+    def arrays(self):
+        """columns() as a field -> column dict."""
+        cols = self.columns()
+        if cols is None:
+            return None
+        fields, active = cols
+        out = dict(zip(FIELDS, fields))
+        out["active"] = active
+        return out
+
+    def processes(self) -> int:
+        """Processes attached to the table (1 for a private one)."""
+        return max(1, int(self._cols[_H_ATTACHED])) if self._shm is not None else 1
+
+    def gossiper(self) -> int:
+        """Pid of the process gossiping for this LB in cluster mode (0 if none or it died)."""
+        pid = int(self._cols[_H_GOSSIP])
+        return pid if pid and _alive(pid) else 0
+
+    def set_gossiper(self, on=True):
+        pid = os.getpid()
+        if on:
+            self._cols[_H_GOSSIP] = pid
+        elif int(self._cols[_H_GOSSIP]) == pid:
+            self._cols[_H_GOSSIP] = 0
+
+    def bump_cursor(self):
+        """Shared round-robin position (last_server_index)."""
+        c = int(self._cols[_H_CURSOR])
+        self._cols[_H_CURSOR] = c + 1
+        return c
+
+
+def default_name() -> str:
+    """
+    Segment name for this LB: the parent's pid and start time identify the
+    supervisor run (a reused pid or a restart gets a fresh segment), and the
+    command line and working directory keep apart unrelated LBs started by
+    the same parent, e.g. two single-process instances on different ports.
+    """
+    ppid = os.getppid()
+    try:
+        with open(f"/proc/{ppid}/stat") as f:
+            started = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        started = ""
+    run = hashlib.sha1("\0".join([started, os.getcwd(), *sys.argv]).encode()).hexdigest()[:12]
+    return f"lb_stats_{ppid}_{run}"
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _open_segment(name, create=False, size=0):
+    # lifetime is managed via the attached count, not per-process trackers
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+@contextmanager
+def _flock(path):
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
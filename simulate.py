@@ -0,0 +1,319 @@
+"""
+Discrete-event simulator: runs the real selection strategies (strategies.py)
+against modelled backends on a virtual clock, so strategies and weights
+can be compared in seconds instead of with live servers.
+
+    python simulate.py                                  # built-in scenario, every strategy
+    python simulate.py --strategies p2c,scored --rate 2000 --duration 600
+    python simulate.py --scenario scenario.json --trace arrivals.ndjson --report sim.json
+
+A scenario file looks like:
+
+    {"backends": [
+        {"name": "a", "servers": 4, "dist": "lognormal", "mean_ms": 10, "sigma": 0.5},
+        {"name": "b", "servers": 4, "mean_ms": 10, "slowdowns": [[60, 120, 4.0]]},
+        {"name": "c", "servers": 2, "mean_ms": 25, "failures": [[200, 230]], "error_rate": 0.01}
+     ],
+     "rate": 500, "duration": 300, "clients": 1000, "probe_interval": 5, "slow_start": 30}
+
+A backend's optional "weight" is what the balancer is told about its
+capacity (servers.json weight); "slow_start" ramps a recovered backend
+up to its weight as registry.Registry does.
+
+Trace files have one arrival per line: a bare timestamp in seconds, or an
+NDJSON object with "t" and optionally "method", "size" and "key".
+"""
+import argparse
+import heapq
+import json
+import math
+import random
+import sys
+import time
+from collections import deque
+
+import latency
+import shared_state
+import strategies
+import tuner
+from bench import LatencyHistogram, jain_index
+
+DEFAULT_SCENARIO = {
+    "backends": [
+        {"name": "fast-1", "servers": 8, "dist": "lognormal", "mean_ms": 8, "sigma": 0.6},
+        {"name": "fast-2", "servers": 8, "dist": "lognormal", "mean_ms": 8, "sigma": 0.6,
+         "slowdowns": [[40, 80, 5.0]]},
+        {"name": "slow", "servers": 4, "dist": "lognormal", "mean_ms": 20, "sigma": 0.6},
+        {"name": "flaky", "servers": 8, "dist": "exp", "mean_ms": 8,
+         "failures": [[100, 115]], "error_rate": 0.005},
+    ],
+    "rate": 1500,
+    "duration": 180,
+    "clients": 1000,
+    "probe_interval": 5.0,
+}
+
+
+# ------------------------------------------------
+# MODEL
+# ------------------------------------------------
+class Backend:
+    """`servers` requests in service at once, FIFO queue behind them."""
+
+    def __init__(self, spec, rng):
+        self.name = spec["name"]
+        self.url = f"http://{self.name}"
+        self.servers = int(spec.get("servers", 1))
+        self.weight = float(spec.get("weight", 1.0))
+        self.mean = float(spec.get("mean_ms", 10.0)) / 1000
+        self.dist = spec.get("dist", "exp")
+        self.sigma = float(spec.get("sigma", 0.5))
+        self.alpha = float(spec.get("alpha", 2.5))  # pareto shape
+        self.error_rate = float(spec.get("error_rate", 0.0))
+        self.slowdowns = [tuple(w) for w in spec.get("slowdowns", [])]
+        self.failures = [tuple(w) for w in spec.get("failures", [])]
+        self.rng = rng
+        self.busy = 0
+        self.queue = deque()
+        self.served = 0
+        self.busy_time = 0.0
+
+    def down(self, now):
+        return any(a <= now < b for a, b in self.failures)
+
+    def service_time(self, now):
+        m, r = self.mean, self.rng
+        if self.dist == "const":
+            t = m
+        elif self.dist == "lognormal":
+            t = r.lognormvariate(math.log(m) - self.sigma ** 2 / 2, self.sigma)
+        elif self.dist == "pareto":
+            t = m * (self.alpha - 1) / self.alpha * r.paretovariate(self.alpha)
+        else:
+            t = r.expovariate(1 / m)
+        for a, b, factor in self.slowdowns:
+            if a <= now < b:
+                t *= factor
+        return t
+
+
+def synthetic_arrivals(rate, duration, clients, rng, kind="poisson"):
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate) if kind == "poisson" else 1 / rate
+        if t >= duration:
+            return
+        yield t, "GET", 0, str(rng.randrange(clients))
+
+
+def trace_arrivals(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == "{":
+                r = json.loads(line)
+                yield float(r["t"]), r.get("method", "GET"), int(r.get("size", 0)), r.get("key")
+            else:
+                yield float(line), "GET", 0, None
+
+
+# ------------------------------------------------
+# SIMULATION
+# ------------------------------------------------
+ARRIVE, DONE, PROBE = 0, 1, 2
+
+
+class Simulation:
+    def __init__(self, scenario, strategy, seed=0):
+        self.rng = random.Random(seed)
+        self.backends = [Backend(spec, random.Random(f"{seed}-{spec['name']}")) for spec in scenario["backends"]]
+        self.by_url = {b.url: b for b in self.backends}
+        self.strategy = strategy
+        self.stats = shared_state.StatsTable.local([b.url for b in self.backends])
+        self.rows = {b.url: self.stats[b.url] for b in self.backends}
+        for b in self.backends:
+            self.rows[b.url]["weight"] = b.weight
+        self.slow_start = float(scenario.get("slow_start", 0.0))
+        self.healthy = [b.url for b in self.backends]
+        self.probe_interval = float(scenario.get("probe_interval", 5.0))
+        self.now = 0.0
+        self.response = LatencyHistogram()
+        self.queueing = LatencyHistogram()
+        self.errors = 0
+        self.failed_fast = 0
+        self.completed = 0
+        self.on_done = None  # on_done(rtt, ok) per request, e.g. Tuner.observe
+
+    def run(self, arrivals, duration):
+        latency.clock = lambda: self.now  # strategies read latency on our clock
+        random.seed(self.rng.random())  # strategies sample from the random module
+        if hasattr(self.strategy, "_rng") and strategies.np is not None:
+            self.strategy._rng = strategies.np.random.default_rng(self.rng.randrange(2 ** 32))
+        self.strategy.on_health_change(self.healthy)
+        try:
+            return self._loop(arrivals, duration)
+        finally:
+            latency.clock = time.monotonic
+
+    def _loop(self, arrivals, duration):
+        events = []
+        seq = 0
+        push = heapq.heappush
+        arrivals = iter(arrivals)
+        nxt = next(arrivals, None)
+        if nxt is not None:
+            push(events, (nxt[0], seq, ARRIVE, nxt))
+        push(events, (self.probe_interval, -1, PROBE, None))
+        rows, by_url, pick = self.rows, self.by_url, self.strategy.pick
+
+        while events:
+            now, _, kind, data = heapq.heappop(events)
+            self.now = now
+            seq += 1
+            if kind == ARRIVE:
+                _, method, size, key = data
+                nxt = next(arrivals, None)
+                if nxt is not None:
+                    push(events, (nxt[0], seq, ARRIVE, nxt))
+                url = pick(self.healthy, self.stats, method, size, key)
+                b = by_url[url]
+                row = rows[url]
+                if b.down(now):
+                    # connection refused: the LB sees a fast failure
+                    self.failed_fast += 1
+                    self.errors += 1
+                    latency.observe(row, 0.001, now)
+                    if self.on_done:
+                        self.on_done(0.001, False)
+                    continue
+                row.incr("active")
+                req = [now, b, 0.0]  # arrival, backend, service start
+                if b.busy < b.servers:
+                    b.busy += 1
+                    req[2] = now
+                    push(events, (now + b.service_time(now), seq, DONE, req))
+                else:
+                    b.queue.append(req)
+            elif kind == DONE:
+                arrived, b, started = data
+                rtt = now - arrived
+                row = rows[b.url]
+                row.incr("active", -1)
+                latency.observe(row, rtt, now)
+                self.response.record(rtt)
+                self.queueing.record(started - arrived)
+                b.served += 1
+                b.busy_time += now - started
+                self.completed += 1
+                ok = not (b.error_rate and b.rng.random() < b.error_rate)
+                if not ok:
+                    self.errors += 1
+                if self.on_done:
+                    self.on_done(rtt, ok)
+                if b.queue:
+                    req = b.queue.popleft()
+                    req[2] = now
+                    push(events, (now + b.service_time(now), seq, DONE, req))
+                else:
+                    b.busy -= 1
+            else:
+                self._probe(now)
+                if now + self.probe_interval < duration:
+                    push(events, (now + self.probe_interval, -1, PROBE, None))
+        return self.report(duration)
+
+    def _probe(self, now):
+        for b in self.backends:
+            row = self.rows[b.url]
+            up = not b.down(now)
+            if up and not row["healthy"] and self.slow_start:
+                row.update({"ramp_start": now, "ramp_secs": self.slow_start})
+            row["healthy"] = up
+        healthy = [b.url for b in self.backends if not b.down(now)] or [b.url for b in self.backends]
+        if healthy != self.healthy:
+            self.healthy = healthy
+            self.strategy.on_health_change(healthy)
+
+    def report(self, duration):
+        counts = [b.served for b in self.backends]
+        span = max(duration, self.now)  # includes draining queues after the last arrival
+        return {
+            "requests": self.completed + self.failed_fast,
+            "completed": self.completed,
+            "errors": self.errors,
+            "failed_fast": self.failed_fast,
+            "response_ms": self.response.summary(),
+            "queueing_ms": self.queueing.summary(),
+            "backends": {
+                b.name: {
+                    "served": b.served,
+                    "share": round(b.served / max(self.completed, 1), 4),
+                    "utilization": round(b.busy_time / (b.servers * span), 4) if span else 0.0,
+                }
+                for b in self.backends
+            },
+            # capacity-weighted: a backend with twice the servers should get twice the load
+            "jain": round(jain_index([c / b.servers for c, b in zip(counts, self.backends)]), 4),
+        }
+
+
+# ------------------------------------------------
+# CLI
+# ------------------------------------------------
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scenario", help="scenario JSON (default: built-in)")
+    p.add_argument("--strategies", default=",".join(n for n in strategies.STRATEGIES),
+                   help="comma-separated names from strategies.STRATEGIES")
+    p.add_argument("--rate", type=float, help="requests/s (overrides the scenario)")
+    p.add_argument("--duration", type=float, help="simulated seconds (overrides the scenario)")
+    p.add_argument("--arrivals", choices=("poisson", "constant"), default="poisson")
+    p.add_argument("--trace", help="recorded arrivals instead of synthetic ones")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--tune", action="store_true", help="tune scored weights online (tuner.py) during the run")
+    p.add_argument("--report", help="write the full results as JSON here")
+    args = p.parse_args(argv)
+
+    scenario = dict(DEFAULT_SCENARIO)
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario.update(json.load(f))
+    rate = args.rate or scenario["rate"]
+    duration = args.duration or scenario["duration"]
+
+    results = {}
+    for name in args.strategies.split(","):
+        if args.trace:
+            arrivals = trace_arrivals(args.trace)
+        else:
+            arrivals = synthetic_arrivals(rate, duration, scenario.get("clients", 1000),
+                                          random.Random(args.seed), args.arrivals)
+        sim = Simulation(scenario, strategies.get_strategy(name), args.seed)
+        tuned = None
+        if args.tune and isinstance(sim.strategy, strategies.Scored):
+            tuned = tuner.Tuner(sim.strategy, rng=random.Random(args.seed))
+            sim.on_done = tuned.observe
+        start = time.perf_counter()
+        results[name] = sim.run(arrivals, duration)
+        if tuned:
+            results[name]["tuned"] = tuned.export()
+        results[name]["wall_s"] = round(time.perf_counter() - start, 2)
+        print(f"--- {name}: {results[name]['requests']} requests in {results[name]['wall_s']}s", file=sys.stderr)
+
+    cols = ("strategy", "p50", "p99", "p99.9", "q_p99", "q_mean", "errors", "jain", "max_util")
+    print(("{:<18}" + "{:>10}" * (len(cols) - 1)).format(*cols))
+    for name, r in results.items():
+        resp, q = r["response_ms"], r["queueing_ms"]
+        print(("{:<18}" + "{:>10.1f}" * 5 + "{:>10}" + "{:>10.3f}" * 2).format(
+            name, resp["p50"], resp["p99"], resp["p99.9"], q["p99"], q["mean"], r["errors"], r["jain"],
+            max(b["utilization"] for b in r["backends"].values()),
+        ))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"scenario": scenario, "rate": rate, "duration": duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import itertools
+import random
+from collections import OrderedDict
+import latency
+from affinity import DEFAULT_TABLE_SIZE, MaglevTable
+from shared_state import FIELDS
+
+try:
+    import numpy as np
+except ImportError:  # vectorized scoring is optional
+    np = None
+
+# ------------------------------------------------
+# STRATEGY REGISTRY
+# ------------------------------------------------
+# Every strategy reads the same per-backend stats mapping:
+#   stats[url] -> {"active": int, "latency": float, "stamp": float, "cpu": float, ...}
+# "latency"/"stamp" hold the peak EWMA maintained by latency.observe.
+# Missing keys count as 0, so simpler apps only need to track what they use.
+# When `stats` is a shared_state.StatsTable and numpy is installed, the
+# O(N) strategies score every candidate in one pass over its columns.
+STRATEGIES = {}
+
+
+def register(name):
+    def deco(cls):
+        cls.name = name
+        STRATEGIES[name] = cls
+        return cls
+    return deco
+
+
+def get_strategy(name, **kwargs):
+    try:
+        cls = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"unknown strategy {name!r}, expected one of {sorted(STRATEGIES)}")
+    return cls(**kwargs)
+
+
+class Strategy:
+    name = ""
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        """Return the backend URL for one request."""
+        raise NotImplementedError
+
+    def on_health_change(self, urls):
+        """Called with the new healthy list whenever it changes."""
+
+    def order(self, urls, stats, method="GET", size=0, key=None):
+        """Failover order: the pick first, then the others as listed."""
+        first = self.pick(urls, stats, method, size, key)
+        return [first] + [u for u in urls if u != first]
+
+
+class Snapshot:
+    """
+    A candidate list with its table row numbers. Built once per candidate
+    list and replaced rather than mutated, so readers never need a lock.
+    """
+    __slots__ = ("urls", "rows", "local")
+
+    def __init__(self, urls, stats):
+        self.urls = list(urls)
+        self.rows = stats.rows(self.urls)
+        self.local = np.fromiter(("localhost" in u or "127.0.0.1" in u for u in self.urls), dtype=bool, count=len(self.urls))
+
+
+class Vectorized:
+    """
+    Mixin: (snapshot, fields, active) for the current candidates, where
+    fields[:, snap.rows] are their stats in FIELDS order; or None to use
+    the row path. Snapshots are kept per candidate list object, so
+    alternating between a few lists (e.g. routes.py pools) doesn't rebuild
+    them every time.
+    """
+    _snaps = None
+
+    def _columns(self, urls, stats):
+        if np is None or not hasattr(stats, "columns") or len(urls) < 2:
+            return None
+        if self._snaps is None:
+            self._snaps = {}
+        snap = self._snaps.get(id(urls))
+        if snap is None or snap.urls != urls:
+            if len(self._snaps) >= 32:
+                self._snaps.clear()  # lists replaced many times over
+            snap = self._snaps[id(urls)] = Snapshot(urls, stats)
+        fields, active = stats.columns()
+        return snap, fields, active
+
+    def _weights(self, urls, stats):
+        """effective_weight of each candidate, in urls order."""
+        cols = self._columns(urls, stats)
+        if cols is None:
+            now = latency.clock()
+            return [effective_weight(stats[u], now) for u in urls]
+        snap, fields, _ = cols
+        return _effective_weights(fields[:, snap.rows]).tolist()
+
+
+_LATENCY, _STAMP = FIELDS.index("latency"), FIELDS.index("stamp")
+_WEIGHT, _RAMP_START, _RAMP_SECS = FIELDS.index("weight"), FIELDS.index("ramp_start"), FIELDS.index("ramp_secs")
+_PEER_ACTIVE = FIELDS.index("peer_active")
+
+
+def inflight(st):
+    """Requests in flight to the backend: ours plus, in cluster mode, our peers' (cluster.py)."""
+    return st.get("active", 0) + st.get("peer_active", 0.0)
+
+
+def _inflight(fields, active):
+    # inflight over a block of rows: fields[:, rows], active[rows]
+    return active + fields[_PEER_ACTIVE]
+
+
+def _current_latency(fields, now=None):
+    # latency.current over a block of rows (fields[:, rows])
+    now = latency.clock() if now is None else now
+    return fields[_LATENCY] * np.exp(np.minimum(fields[_STAMP] - now, 0.0) / latency.DECAY)
+
+
+# ------------------------------------------------
+# WEIGHTS AND SLOW START
+# ------------------------------------------------
+# "weight" is a backend's relative capacity (servers.json / admin API). A
+# backend that just joined or came back to health starts at RAMP_FLOOR of
+# its weight and ramps linearly to all of it over "ramp_secs" seconds from
+# "ramp_start" (see registry.Registry.ramp), so a cold backend isn't
+# flooded just because it looks idle. Weighted strategies divide load by
+# the effective weight; with equal weights they pick exactly as before.
+RAMP_FLOOR = 0.1
+_MIN_WEIGHT = 1e-9  # weight 0: only picked when nothing else is left
+
+
+def ramp(st, now=None) -> float:
+    """Slow-start factor in [RAMP_FLOOR, 1]."""
+    secs = st.get("ramp_secs", 0.0)
+    if not secs:
+        return 1.0
+    now = latency.clock() if now is None else now
+    done = (now - st.get("ramp_start", 0.0)) / secs
+    return 1.0 if done >= 1.0 else RAMP_FLOOR + (1.0 - RAMP_FLOOR) * max(done, 0.0)
+
+
+def effective_weight(st, now=None) -> float:
+    return max(st.get("weight", 1.0), 0.0) * ramp(st, now)
+
+
+def _effective_weights(fields, now=None):
+    # effective_weight over a block of rows (fields[:, rows])
+    w = np.maximum(fields[_WEIGHT], 0.0)
+    secs = fields[_RAMP_SECS]
+    if not secs.any():
+        return w
+    now = latency.clock() if now is None else now
+    done = np.clip((now - fields[_RAMP_START]) / np.where(secs > 0, secs, 1.0), 0.0, 1.0)
+    return w * np.where(secs > 0, RAMP_FLOOR + (1.0 - RAMP_FLOOR) * done, 1.0)
+
+
+# ------------------------------------------------
+# PORTED STRATEGIES
+# ------------------------------------------------
+@register("round_robin")
+class RoundRobin(Vectorized, Strategy):
+    # main1.get_next_server; a shared_state table carries the cursor across workers.
+    # Unequal (or ramping) weights switch to smooth weighted round-robin as in
+    # nginx: each pick adds every backend's weight to its credit and takes the
+    # highest, which pays back the total, so 3:1 goes a a b a rather than
+    # a a a b. Credits are per worker.
+    def __init__(self):
+        self._counter = itertools.count()
+        self._credit = {}
+
+    def on_health_change(self, urls):
+        self._credit = {u: c for u, c in self._credit.items() if u in urls}
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        if stats is None:  # main1 / main11 keep no stats
+            return urls[next(self._counter) % len(urls)]
+        weights = self._weights(urls, stats)
+        if min(weights) == max(weights):
+            bump = getattr(stats, "bump_cursor", None)
+            return urls[(bump() if bump else next(self._counter)) % len(urls)]
+        credit = self._credit
+        best, best_credit = None, float("-inf")
+        for url, w in zip(urls, weights):
+            c = credit[url] = credit.get(url, 0.0) + w
+            if c > best_credit:
+                best, best_credit = url, c
+        credit[best] -= sum(weights)
+        return best
+
+
+@register("random")
+class Random(Strategy):
+    # main3: random.choice
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        return random.choice(urls)
+
+
+@register("least_connections")
+class LeastConnections(Vectorized, Strategy):
+    # main2.get_least_loaded_server, ties broken on latency as in main.choose_server;
+    # weighted: (active + 1) / effective weight, so the bigger of two idle
+    # backends goes first
+    def _load(self, st, now):
+        return (inflight(st) + 1) / max(effective_weight(st, now), _MIN_WEIGHT)
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        cols = self._columns(urls, stats)
+        if cols is None:
+            now = latency.clock()
+            return min(urls, key=lambda u: (self._load(stats[u], now), latency.current(stats[u], now)))
+        snap, fields, active = cols
+        block = fields[:, snap.rows]
+        load = (_inflight(block, active[snap.rows]) + 1) / np.maximum(_effective_weights(block), _MIN_WEIGHT)
+        least = np.flatnonzero(load == load.min())
+        if len(least) == 1:
+            return snap.urls[least[0]]
+        return snap.urls[least[np.argmin(_current_latency(block[:, least]))]]
+
+
+@register("scored")
+class Scored(Vectorized, Strategy):
+    # custom1.choose_backends weighted score (custom.choose_server passes its own weights).
+    # The active term is per unit of backend capacity: (active + 1) / effective weight.
+    WEIGHTS = {"cpu": 0.25, "mem": 0.15, "latency": 0.25, "active": 0.35}
+
+    def __init__(self, weights=None, heavy_penalty=1.0, local_bonus=0.1, jitter=0.05, failover=3):
+        self.weights = dict(weights or self.WEIGHTS)
+        self.heavy_penalty = heavy_penalty
+        self.local_bonus = local_bonus
+        self.jitter = jitter
+        # with vectorized scoring, order() returns only the best `failover`
+        self.failover = failover
+        self._rng = np.random.default_rng() if np is not None else None
+        self._wkey = None
+
+    def score(self, url, st, method, size):
+        sc = 0.0
+        for k, w in self.weights.items():
+            if k == "latency":
+                v = latency.current(st)
+            elif k == "active":
+                v = (inflight(st) + 1) / max(effective_weight(st), _MIN_WEIGHT)
+            else:
+                v = st.get(k, 0.0)
+            sc += v * w
+        if method.upper() == "POST" or size > 100_000:
+            sc += self.heavy_penalty
+        if "localhost" in url or "127.0.0.1" in url:
+            sc -= self.local_bonus
+        return sc + random.random() * self.jitter
+
+    def _vector(self):
+        # weights as a FIELDS-ordered vector (latency and active kept apart)
+        key = tuple(self.weights.items())
+        if self._wkey != key:
+            wv = np.zeros(len(FIELDS))
+            for k, w in self.weights.items():
+                if k in FIELDS and k != "latency":
+                    wv[FIELDS.index(k)] = w
+            self._wkey = key
+            self._wvec = (wv if wv.any() else None, self.weights.get("latency", 0.0), self.weights.get("active", 0.0))
+        return self._wvec
+
+    def scores(self, snap, fields, active, method, size):
+        """score() for every candidate in one pass over the columns."""
+        rows = snap.rows
+        block = fields[:, rows]  # one gather for every field
+        wv, w_lat, w_active = self._vector()
+        sc = wv @ block if wv is not None else np.zeros(len(rows))
+        if w_lat:
+            sc += _current_latency(block) * w_lat
+        if w_active:
+            sc += (_inflight(block, active[rows]) + 1) / np.maximum(_effective_weights(block), _MIN_WEIGHT) * w_active
+        if method.upper() == "POST" or size > 100_000:
+            sc += self.heavy_penalty  # same for every candidate; keeps scores equal to score()
+        if self.local_bonus:
+            sc -= snap.local * self.local_bonus
+        if self.jitter:
+            sc += self._rng.random(len(rows)) * self.jitter
+        return sc
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        cols = self._columns(urls, stats)
+        if cols is None:
+            return min(urls, key=lambda u: self.score(u, stats[u], method, size))
+        snap = cols[0]
+        return snap.urls[np.argmin(self.scores(*cols, method, size))]
+
+    def order(self, urls, stats, method="GET", size=0, key=None):
+        cols = self._columns(urls, stats)
+        if cols is None:
+            return sorted(urls, key=lambda u: self.score(u, stats[u], method, size))
+        snap = cols[0]
+        sc = self.scores(*cols, method, size)
+        k = min(self.failover, len(sc))
+        best = np.argpartition(sc, k - 1)[:k] if k < len(sc) else np.arange(len(sc))
+        return [snap.urls[i] for i in best[np.argsort(sc[best])]]
+
+
+@register("least_work")
+class LeastWork(Vectorized, Strategy):
+    """
+    Least expected work outstanding per unit of effective weight: "work" is
+    the sum of the learned route costs (routes.py) of the requests in flight
+    to a backend, so one export in flight counts for many light GETs.
+    `unit` stands in for the new request's own cost, so the bigger of two
+    idle backends goes first; ties are broken on latency.
+    """
+
+    def __init__(self, unit=0.01):
+        self.unit = unit
+
+    def _load(self, st, now):
+        # rounded: float increments and decrements leave residue that would beat the latency tie-break
+        return round((st.get("work", 0.0) + self.unit) / max(effective_weight(st, now), _MIN_WEIGHT), 9)
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        cols = self._columns(urls, stats)
+        if cols is None:
+            now = latency.clock()
+            return min(urls, key=lambda u: (self._load(stats[u], now), latency.current(stats[u], now)))
+        snap, fields, _ = cols
+        block = fields[:, snap.rows]
+        load = (stats.sharded("work")[snap.rows] + self.unit) / np.maximum(_effective_weights(block), _MIN_WEIGHT)
+        least = np.flatnonzero(load <= load.min() * (1 + 1e-9))
+        if len(least) == 1:
+            return snap.urls[least[0]]
+        return snap.urls[least[np.argmin(_current_latency(block[:, least]))]]
+
+
+# ------------------------------------------------
+# POWER OF TWO CHOICES
+# ------------------------------------------------
+@register("p2c")
+class PowerOfTwo(Strategy):
+    """
+    Sample two distinct backends and keep the cheaper one by peak-EWMA cost
+    (latency x in-flight) per unit of effective weight: O(1) per request
+    regardless of pool size.
+    """
+
+    def _load(self, st):
+        w = max(effective_weight(st), _MIN_WEIGHT)
+        n = inflight(st)
+        return latency.current(st) * (n + 1) / w, n / w
+
+    def _two(self, urls, stats):
+        n = len(urls)
+        if n == 1:
+            return urls[0], None
+        i = random.randrange(n)
+        j = random.randrange(n - 1)
+        if j >= i:
+            j += 1
+        a, b = urls[i], urls[j]
+        if self._load(stats[b]) < self._load(stats[a]):
+            a, b = b, a
+        return a, b
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        return self._two(urls, stats)[0]
+
+    def order(self, urls, stats, method="GET", size=0, key=None):
+        # only the two sampled backends are tried, keeping failover O(1) as well
+        a, b = self._two(urls, stats)
+        return [a] if b is None else [a, b]
+
+
+# ------------------------------------------------
+# AFFINITY
+# ------------------------------------------------
+@register("maglev")
+class Maglev(Strategy):
+    """
+    Same key -> same backend, via a Maglev table that is only rebuilt when
+    the healthy set changes. `key` comes from affinity.request_key.
+    Narrower candidate lists (a routes.py pool, say) get their own table,
+    kept per member set, so a pool's keys move as little as the main ones.
+    """
+
+    def __init__(self, table_size=DEFAULT_TABLE_SIZE, max_tables=16):
+        self.table = MaglevTable(size=table_size)
+        self.max_tables = max_tables
+        self._members = frozenset()  # self.table's backends
+        self._tables = OrderedDict()  # other member sets -> table, least recently used first
+
+    def on_health_change(self, urls):
+        self.table.build(urls)
+        self._members = frozenset(self.table.backends)
+
+    def _table_for(self, urls):
+        members = frozenset(urls)
+        if not self.table.backends:
+            self.on_health_change(members)
+        if members == self._members:
+            return self.table
+        table = self._tables.get(members)
+        if table is None:
+            # a pool whose health changed, or one not seen yet
+            table = self._tables[members] = MaglevTable(members, size=self.table.size)
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        else:
+            self._tables.move_to_end(members)
+        return table
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        return self._table_for(urls).lookup(key or "")
+
+
+# ------------------------------------------------
+# LONG-LIVED CONNECTIONS
+# ------------------------------------------------
+@register("least_streams")
+class LeastStreams(Strategy):
+    """
+    For WebSocket / SSE connections: open streams plus message throughput
+    (messages/s * msg_cost), per unit of weight. "active" (short requests)
+    only breaks ties, since one busy stream outweighs many quick requests.
+    """
+
+    def __init__(self, msg_cost=0.01):
+        self.msg_cost = msg_cost
+
+    def load(self, st):
+        return (st.get("streams", 0) + self.msg_cost * st.get("msg_rate", 0.0)) / max(effective_weight(st), _MIN_WEIGHT)
+
+    def pick(self, urls, stats, method="GET", size=0, key=None):
+        return min(urls, key=lambda u: (self.load(stats[u]), stats[u].get("active", 0)))
+
+    def order(self, urls, stats, method="GET", size=0, key=None):
+        return sorted(urls, key=lambda u: (self.load(stats[u]), stats[u].get("active", 0)))
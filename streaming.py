@@ -0,0 +1,90 @@
+import anyio
+import httpx
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+# ------------------------------------------------
+# STREAMING PASS-THROUGH HELPERS
+# ------------------------------------------------
+# Headers that only make sense for a single hop; never forwarded either way.
+HOP_BY_HOP = frozenset({
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"trailers", b"transfer-encoding", b"upgrade",
+})
+
+
+def body_size(request: Request) -> int:
+    """Declared upload size, read from the headers instead of the body."""
+    try:
+        return int(request.headers.get("content-length", 0))
+    except ValueError:
+        return 0
+
+
+def has_body(request: Request) -> bool:
+    return body_size(request) > 0 or "transfer-encoding" in request.headers
+
+
+def upstream_url(backend: str, path: str, request: Request) -> str:
+    query = request.url.query
+    return f"{backend}/{path}?{query}" if query else f"{backend}/{path}"
+
+
+def upstream_headers(request: Request):
+    # Host is dropped so httpx sets it for the backend.
+    return [
+        (k, v) for k, v in request.headers.raw
+        if k.lower() not in HOP_BY_HOP and k.lower() != b"host"
+    ]
+
+
+async def send(client: httpx.AsyncClient, backend: str, path: str, request: Request,
+               extensions=None, timeout=httpx.USE_CLIENT_DEFAULT) -> httpx.Response:
+    """
+    Forward `request` to `backend` and return once the upstream headers arrive.
+    The request body is streamed as the client sends it; the response body
+    is left unread for `relay` to stream back.
+    """
+    upstream = client.build_request(
+        request.method,
+        upstream_url(backend, path, request),
+        headers=upstream_headers(request),
+        content=request.stream() if has_body(request) else None,
+        extensions=extensions,
+        timeout=timeout,
+    )
+    return await client.send(upstream, stream=True)
+
+
+class _Relay(StreamingResponse):
+    # closes upstream and runs on_close however the relay ends: body done,
+    # upstream reset mid-body, client gone, or cancelled before the first byte
+    def __init__(self, resp: httpx.Response, on_close, body=None):
+        super().__init__(body or resp.aiter_raw(), status_code=resp.status_code)
+        self.raw_headers = [
+            (k, v) for k, v in resp.headers.raw if k.lower() not in HOP_BY_HOP
+        ]
+        self._upstream = resp
+        self._on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                try:
+                    await self._upstream.aclose()
+                finally:
+                    for cb in self._on_close:
+                        res = cb()
+                        if hasattr(res, "__await__"):
+                            await res
+
+
+def relay(resp: httpx.Response, *on_close, body=None) -> StreamingResponse:
+    """
+    Stream `resp` back to the client with its original status, headers and
+    raw bytes (or `body`, an iterator over them). `on_close` callbacks (sync
+    or async) run once the relay ends, whether or not the body made it through.
+    """
+    return _Relay(resp, on_close, body)
@@ -0,0 +1,322 @@
+"""
+Layer-4 TCP balancer: backends from servers.json (hot-reloaded), health
+from probe.py TCP connect checks, one backend per connection by weighted
+least connections (as main2), bytes relayed both ways without touching
+them. servers.json weight, max_concurrency (open connections) and slow
+start after recovery apply as in custom1.
+
+    python tcp_lb.py --listen 0.0.0.0:9000 --servers servers.json --metrics-port 9100
+
+Backend addresses are the host:port of each servers.json url. On Linux the
+relay moves data socket -> pipe -> socket with os.splice, so payload bytes
+never enter Python; elsewhere (or with --relay copy) it uses one reusable
+buffer per direction.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+from urllib.parse import urlsplit
+
+import lbmetrics
+import probe
+import registry
+import shared_state
+import strategies
+
+CHUNK = 64 * 1024  # default pipe capacity
+SPLICE = hasattr(os, "splice")
+_SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+# ------------------------------------------------
+# METRICS (served on --metrics-port)
+# ------------------------------------------------
+CONNECTIONS = lbmetrics.Counter("lb_tcp_connections_total", "Client connections relayed to the backend", ["backend"])
+CONNECT_ERRORS = lbmetrics.Counter("lb_tcp_connect_errors_total", "Failed connects to the backend", ["backend"])
+ACTIVE = lbmetrics.Gauge("lb_tcp_active_connections", "Open relayed connections", ["backend"])
+BYTES = lbmetrics.Counter("lb_tcp_bytes_total", "Bytes relayed: up = client to backend", ["backend", "direction"])
+HEALTHY = lbmetrics.Gauge("lb_tcp_backend_healthy", "1 if the last connect check succeeded", ["backend"])
+REJECTED = lbmetrics.Counter("lb_tcp_rejected_total", "Client connections closed with no backend reachable")
+
+
+def address(url):
+    """(host, port) of a servers.json url; the scheme only supplies the default port."""
+    u = urlsplit(url if "//" in url else f"tcp://{url}")
+    return u.hostname, u.port or {"https": 443, "http": 80}.get(u.scheme, 80)
+
+
+# ------------------------------------------------
+# RELAY
+# ------------------------------------------------
+async def _wait(loop, fd, write=False):
+    fut = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if write else (loop.add_reader, loop.remove_reader)
+    add(fd, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        remove(fd)
+
+
+async def _pump_splice(loop, src, dst, count):
+    """src -> kernel pipe -> dst; returns at EOF on src."""
+    rfd, wfd = os.pipe()
+    sfd, dfd = src.fileno(), dst.fileno()
+    try:
+        while True:
+            try:
+                n = os.splice(sfd, wfd, CHUNK, flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                await _wait(loop, sfd)
+                continue
+            if n == 0:
+                return
+            left = n
+            while left:
+                try:
+                    left -= os.splice(rfd, dfd, left, flags=_SPLICE_FLAGS)
+                except BlockingIOError:
+                    await _wait(loop, dfd, write=True)
+            count(n)
+    finally:
+        os.close(rfd)
+        os.close(wfd)
+
+
+async def _pump_copy(loop, src, dst, count):
+    buf = bytearray(CHUNK)
+    view = memoryview(buf)
+    while True:
+        n = await loop.sock_recv_into(src, buf)
+        if n == 0:
+            return
+        await loop.sock_sendall(dst, view[:n])
+        count(n)
+
+
+async def relay(loop, client, upstream, up, down, zero_copy=SPLICE):
+    """Both directions until each side has sent EOF (or either one fails)."""
+    pump = _pump_splice if zero_copy else _pump_copy
+
+    async def one_way(src, dst, counter):
+        try:
+            await pump(loop, src, dst, counter.inc)
+            dst.shutdown(socket.SHUT_WR)  # pass the half-close on
+        except OSError:
+            # reset / broken pipe: tear down the other direction too
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    await asyncio.gather(one_way(client, upstream, up), one_way(upstream, client, down))
+
+
+# ------------------------------------------------
+# BALANCER
+# ------------------------------------------------
+class TcpBalancer:
+    def __init__(self, servers_path, connect_timeout=3.0, zero_copy=SPLICE, reload_interval=1.0,
+                 probe_interval=2.0, slow_start=0.0):
+        self.connect_timeout = connect_timeout
+        self.zero_copy = zero_copy
+        self.reload_interval = reload_interval
+        self.stats = shared_state.StatsTable.local([])
+        self.registry = registry.Registry(self.stats, servers_path, slow_start=slow_start)
+        self.registry.reload()
+        self.urls = self.registry.members()
+        self.healthy = list(self.urls)
+        self.strategy = strategies.get_strategy("least_connections")
+        self.metrics = {}
+        self._tasks = set()  # connections being handled
+        self.prober = probe.ProbeScheduler(self._check, self._probed, self.urls,
+                                           base_interval=probe_interval, timeout=connect_timeout)
+        for url in self.urls:
+            self._track(url)
+
+    # ---- pool ----------------------------------------------------------
+    def _track(self, url):
+        row = self.stats[url]
+        self.metrics[url] = (
+            CONNECTIONS.labels(url), CONNECT_ERRORS.labels(url),
+            BYTES.labels(url, "up"), BYTES.labels(url, "down"),
+        )
+        ACTIVE.labels(url).set_function(lambda: row["active"])
+        HEALTHY.labels(url).set_function(lambda: row["healthy"])
+
+    def _untrack(self, url):
+        self.metrics.pop(url, None)
+        for m, labels in ((CONNECTIONS, (url,)), (CONNECT_ERRORS, (url,)), (ACTIVE, (url,)),
+                          (HEALTHY, (url,)), (BYTES, (url, "up")), (BYTES, (url, "down"))):
+            m.remove(*labels)
+
+    def sync(self):
+        members = self.registry.members()
+        if members != self.urls:
+            for url in set(self.urls) - set(members):
+                self._untrack(url)
+            for url in members:
+                if url not in self.metrics:
+                    self._track(url)
+            self.urls[:] = members
+            self.prober.set_targets(members)
+        self._refresh()
+
+    def _refresh(self):
+        serving = [u for u in self.urls if not self.stats[u]["draining"]] or list(self.urls)
+        self.healthy = [u for u in serving if self.stats[u]["healthy"]] or serving
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                self.registry.reload()
+            except Exception as e:
+                print(f"servers.json reload failed: {e}", file=sys.stderr)
+            self.sync()
+
+    # ---- health --------------------------------------------------------
+    async def _check(self, url, timeout):
+        _, writer = await asyncio.wait_for(asyncio.open_connection(*address(url)), timeout)
+        writer.close()
+
+    def _probed(self, url, ok, _result, _rtt):
+        if url in self.stats and bool(self.stats[url]["healthy"]) != ok:
+            self.stats[url]["healthy"] = ok
+            if ok:
+                self.registry.ramp(url)
+            self._refresh()
+
+    # ---- connections ---------------------------------------------------
+    async def _connect(self, loop, url):
+        host, port = address(url)
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        family, type_, proto, _, addr = infos[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, addr), self.connect_timeout)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def handle(self, client):
+        loop = asyncio.get_running_loop()
+        upstream = row = None
+        try:
+            for candidate in self.strategy.order(self.healthy, self.stats) if self.healthy else ():
+                if candidate not in self.metrics:
+                    continue  # removed since the list was built
+                row = self.stats[candidate]
+                if row["max_concurrency"] and row["active"] >= row["max_concurrency"]:
+                    row = None
+                    continue
+                # counted before connecting, so concurrent accepts spread out
+                # and can't overshoot max_concurrency between them
+                row.incr("active")
+                try:
+                    upstream = await self._connect(loop, candidate)
+                except (OSError, asyncio.TimeoutError):
+                    row.incr("active", -1)
+                    row = None
+                    self.metrics[candidate][1].inc()
+                    self.prober.poke(candidate)
+                    continue
+                except BaseException:
+                    row.incr("active", -1)
+                    row = None
+                    raise
+                url = candidate
+                break
+            if upstream is None:
+                REJECTED.inc()
+                return
+            try:
+                conns, _, up, down = self.metrics[url]
+                conns.inc()
+                for s in (client, upstream):
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                await relay(loop, client, upstream, up, down, self.zero_copy)
+            finally:
+                row.incr("active", -1)
+        finally:
+            client.close()
+            if upstream is not None:
+                upstream.close()
+
+    async def serve(self, host, port, backlog=1024):
+        loop = asyncio.get_running_loop()
+        listener = socket.create_server((host, port), reuse_port=hasattr(socket, "SO_REUSEPORT"), backlog=backlog)
+        listener.setblocking(False)
+        self.prober.start()
+        watcher = asyncio.create_task(self._watch())
+        try:
+            while True:
+                client, _ = await loop.sock_accept(listener)
+                client.setblocking(False)
+                # the loop only keeps weak references to tasks
+                task = asyncio.create_task(self.handle(client))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            watcher.cancel()
+            await self.prober.stop()
+            listener.close()
+
+
+# ------------------------------------------------
+# METRICS ENDPOINT
+# ------------------------------------------------
+async def _metrics(reader, writer):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = lbmetrics.render()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: " + lbmetrics.CONTENT_TYPE.encode()
+                     + b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# ------------------------------------------------
+# CLI
+# ------------------------------------------------
+async def main(args):
+    host, _, port = args.listen.rpartition(":")
+    lb = TcpBalancer(args.servers, args.connect_timeout, args.relay == "splice", args.reload_interval,
+                     args.probe_interval, args.slow_start)
+    if args.metrics_port:
+        await asyncio.start_server(_metrics, host or "0.0.0.0", args.metrics_port)
+    print(f"tcp_lb on {args.listen} ({args.relay} relay), {len(lb.urls)} backends", file=sys.stderr)
+    await lb.serve(host or "0.0.0.0", int(port))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--listen", default=os.environ.get("LB_TCP_LISTEN", "0.0.0.0:9000"))
+    p.add_argument("--servers", default=os.environ.get("LB_SERVERS_FILE") or "servers.json")
+    p.add_argument("--metrics-port", type=int, default=int(os.environ.get("LB_TCP_METRICS_PORT", 9100)),
+                   help="Prometheus text on this port (0 = off)")
+    p.add_argument("--relay", choices=("splice", "copy"), default="splice" if SPLICE else "copy")
+    p.add_argument("--connect-timeout", type=float, default=3.0)
+    p.add_argument("--probe-interval", type=float, default=2.0)
+    p.add_argument("--reload-interval", type=float, default=1.0)
+    p.add_argument("--slow-start", type=float, default=float(os.environ.get("LB_SLOW_START", 30.0)),
+                   help="seconds for a new or recovered backend to ramp up to its weight (0 = off)")
+    args = p.parse_args(argv)
+    if args.relay == "splice" and not SPLICE:
+        p.error("os.splice is not available here (Linux, Python 3.10+); use --relay copy")
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import admission
+
+
+async def _drain(ctl, n):
+    for _ in range(n):
+        ctl.release()
+        await asyncio.sleep(0)
+
+
+async def _queue(ctl, order, requests):
+    async def one(client, weight):
+        await ctl.acquire(client=client, weight=weight)
+        order.append(client)
+    tasks = []
+    for client, weight, n in requests:
+        tasks += [asyncio.create_task(one(client, weight)) for _ in range(n)]
+        await asyncio.sleep(0)
+    return tasks
+
+
+def test_fifo_without_clients():
+    async def main():
+        ctl = admission.Admission(capacity=1, timeout=10)
+        await ctl.acquire()
+        order = []
+
+        async def one(i):
+            await ctl.acquire()
+            order.append(i)
+        tasks = [asyncio.create_task(one(i)) for i in range(5)]
+        await asyncio.sleep(0)
+        assert ctl.depth == 5
+        await _drain(ctl, 5)
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+
+
+def test_quiet_client_goes_ahead_of_a_backlog():
+    async def main():
+        ctl = admission.Admission(capacity=1, timeout=10)
+        await ctl.acquire(client="noisy")
+        order = []
+        tasks = await _queue(ctl, order, [("noisy", 1.0, 10), ("quiet", 1.0, 1)])
+        await _drain(ctl, 11)
+        await asyncio.gather(*tasks)
+        return order
+    order = asyncio.run(main())
+    assert order.index("quiet") <= 1
+
+
+def test_weighted_shares():
+    async def main():
+        ctl = admission.Admission(capacity=1, timeout=10)
+        await ctl.acquire(client="x")
+        order = []
+        tasks = await _queue(ctl, order, [("a", 1.0, 20), ("b", 3.0, 20)])
+        await _drain(ctl, 16)
+        served = list(order)
+        await _drain(ctl, 24)
+        await asyncio.gather(*tasks)
+        return served, ctl
+    served, ctl = asyncio.run(main())
+    served = served[:12]
+    assert 8 <= served.count("b") <= 10  # 3:1
+    assert ctl.depth == 0 and not ctl._clients and ctl._backlog == 0
+
+
+def test_queue_full_and_deadline():
+    async def main():
+        ctl = admission.Admission(capacity=1, max_queue=2, timeout=10)
+        await ctl.acquire()
+        tasks = [asyncio.create_task(ctl.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Overloaded, match="queue full"):
+            await ctl.acquire()
+        ctl.hold = 10.0  # each slot is held for 10s
+        ctl.max_queue = 100
+        with pytest.raises(admission.Overloaded, match="deadline"):
+            await ctl.acquire(timeout=1.0)
+        await _drain(ctl, 2)
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+
+
+def test_timeout_and_cancel_leave_no_state():
+    async def main():
+        ctl = admission.Admission(capacity=1, timeout=0.02)
+        await ctl.acquire(client="a")
+        with pytest.raises(admission.Overloaded, match="queue timeout"):
+            await ctl.acquire(client="b")
+        task = asyncio.create_task(ctl.acquire(client="c", timeout=10))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert ctl.depth == 0 and not ctl._clients
+        ctl.release()
+        assert ctl.inflight == 0
+        assert await ctl.acquire(client="d") == 0.0
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+from starlette.requests import Request
+
+import affinity
+import strategies
+
+URLS = [f"http://b{i}" for i in range(10)]
+KEYS = [f"client-{i}" for i in range(5000)]
+SIZE = 4099  # prime; small keeps the builds quick
+
+
+def _moved(before, after):
+    return sum(before[k] != after[k] for k in KEYS)
+
+
+def test_table_spreads_keys_evenly():
+    t = affinity.MaglevTable(URLS, size=SIZE)
+    counts = {u: 0 for u in URLS}
+    for k in KEYS:
+        counts[t.lookup(k)] += 1
+    assert max(counts.values()) < 1.3 * len(KEYS) / len(URLS)
+
+
+def test_removing_a_backend_only_moves_its_keys():
+    t = affinity.MaglevTable(URLS, size=SIZE)
+    before = {k: t.lookup(k) for k in KEYS}
+    t.build(URLS[1:])
+    after = {k: t.lookup(k) for k in KEYS}
+    # its own keys all move; Maglev allows a little churn among the rest
+    own = sum(v == URLS[0] for v in before.values())
+    assert all(after[k] != URLS[0] for k in KEYS)
+    assert own <= _moved(before, after) < own + 0.02 * len(KEYS)
+
+
+def test_adding_a_backend_moves_about_its_share():
+    t = affinity.MaglevTable(URLS, size=SIZE)
+    before = {k: t.lookup(k) for k in KEYS}
+    t.build(URLS + ["http://b10"])
+    after = {k: t.lookup(k) for k in KEYS}
+    assert _moved(before, after) < 1.5 * len(KEYS) / 11
+
+
+def test_build_is_a_no_op_for_the_same_set():
+    t = affinity.MaglevTable(URLS, size=SIZE)
+    assert not t.build(list(reversed(URLS)))
+
+
+def test_pool_subsets_move_keys_minimally():
+    mg = strategies.Maglev(table_size=SIZE)
+    mg.on_health_change(URLS)
+    pool = URLS[:6]
+    before = {k: mg.pick(pool, None, key=k) for k in KEYS}
+    assert set(before.values()) == set(pool)
+    shrunk = pool[:2] + pool[3:]  # one pool member goes unhealthy
+    after = {k: mg.pick(shrunk, None, key=k) for k in KEYS}
+    own = sum(v == pool[2] for v in before.values())
+    assert own <= _moved(before, after) < own + 0.02 * len(KEYS)
+
+
+def test_pool_tables_are_cached_and_bounded():
+    mg = strategies.Maglev(table_size=SIZE, max_tables=2)
+    mg.on_health_change(URLS)
+    first = mg._table_for(URLS[:3])
+    assert mg._table_for(list(reversed(URLS[:3]))) is first
+    assert mg._table_for(URLS) is mg.table
+    mg._table_for(URLS[:4])
+    mg._table_for(URLS[:5])
+    assert len(mg._tables) == 2 and mg._table_for(URLS[:3]) is not first
+
+
+def test_request_key():
+    def req(headers=None, path="/x"):
+        raw = [(k.encode(), v.encode()) for k, v in (headers or {}).items()]
+        return Request({"type": "http", "method": "GET", "path": path, "headers": raw, "client": ("10.0.0.1", 1)})
+    assert affinity.request_key(req()) == "10.0.0.1"
+    assert affinity.request_key(req(path="/cart"), "path") == "/cart"
+    assert affinity.request_key(req({"x-user": "u1"}), "header:x-user") == "u1"
+    assert affinity.request_key(req(), "header:x-user") == "10.0.0.1"
@@ -0,0 +1,79 @@
+import breaker
+
+URLS = ["a", "b", "c", "d"]
+
+
+def _tripped(url="a", now=0.0):
+    b = breaker.Breakers(URLS, threshold=2, base_ejection=5.0)
+    for _ in range(2):
+        b.record(url, False, now)
+    return b
+
+
+def test_trips_after_threshold_and_ejects():
+    b = _tripped()
+    assert b["a"].state == breaker.OPEN
+    assert b.ejected == {"a"}
+    assert not b.allow("a")
+    assert b.allow("b")
+
+
+def test_half_open_allows_one_trial():
+    b = _tripped()
+    b.poll(now=6.0)
+    assert b["a"].state == breaker.HALF_OPEN and not b.ejected
+    assert b.allow("a")
+    assert not b.allow("a")
+    b.record("a", True, now=6.1)
+    assert b["a"].state == breaker.CLOSED
+    assert b.allow("a")
+
+
+def test_failed_trial_reopens_for_longer():
+    b = _tripped()
+    b.poll(now=6.0)
+    assert b.allow("a")
+    b.record("a", False, now=6.0)
+    assert b["a"].state == breaker.OPEN
+    assert b["a"].until == 16.0  # 5s * 2
+
+
+def test_released_trial_can_be_claimed_again():
+    b = _tripped()
+    b.poll(now=6.0)
+    assert b.allow("a")
+    b.release("a")  # skipped or cancelled: no outcome
+    assert b["a"].state == breaker.HALF_OPEN
+    assert b.allow("a")
+
+
+def test_release_leaves_closed_and_open_alone():
+    b = _tripped()
+    b.release("a")
+    assert b["a"].state == breaker.OPEN and not b.allow("a")
+    b.release("b")
+    assert b.allow("b")
+    b.release("gone")
+
+
+def test_ejection_cap():
+    b = breaker.Breakers(URLS, threshold=1, max_ejected_fraction=0.5)
+    for url in URLS:
+        b.record(url, False, 0.0)
+    assert len(b.ejected) == 2
+
+
+def test_retry_budget():
+    budget = breaker.RetryBudget(ratio=0.5, min_per_sec=0.0)
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_outliers_are_judged_against_the_expected_time():
+    b = breaker.Breakers(URLS, outlier_factor=5.0)
+    assert not b.is_outlier(0.4, 0.0)  # nothing learned yet
+    assert b.is_outlier(0.4, 0.03)
+    assert not b.is_outlier(0.4, 0.41)  # a heavy route at its usual cost
@@ -0,0 +1,118 @@
+import asyncio
+
+import httpx
+from starlette.requests import Request
+
+import cache
+
+
+def _request(path="/a", query="", headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": raw})
+
+
+def _headers(**kv):
+    return httpx.Headers({k.replace("_", "-"): v for k, v in kv.items()})
+
+
+def test_key_includes_accept_encoding():
+    key = cache.ResponseCache.key
+    plain = key(_request())
+    gzip = key(_request(headers={"Accept-Encoding": "gzip, br"}))
+    assert plain != gzip
+    assert gzip == key(_request(headers={"Accept-Encoding": "br,gzip"}))
+
+
+def test_ttl_from_headers_and_vary():
+    c = cache.ResponseCache(path_ttls={"/static": 30})
+    assert c.ttl("/x", 200, _headers(cache_control="max-age=60")) == 60
+    assert c.ttl("/x", 200, _headers(cache_control="max-age=60", vary="Accept-Encoding")) == 60
+    assert c.ttl("/x", 200, _headers(cache_control="max-age=60", vary="Accept-Language")) == 0
+    assert c.ttl("/x", 200, _headers(cache_control="private, max-age=60")) == 0
+    assert c.ttl("/x", 500, _headers(cache_control="max-age=60")) == 0
+    assert c.ttl("/static/app.js", 200, _headers()) == 30
+    assert c.ttl("/x", 200, _headers()) == 0
+
+
+def test_credentialed_requests_only_store_shareable_responses():
+    c = cache.ResponseCache()
+    assert c.credentialed(_request(headers={"Authorization": "Bearer x"}))
+    assert c.credentialed(_request(headers={"Cookie": "s=1"}))
+    assert not c.credentialed(_request())
+    assert c.ttl("/x", 200, _headers(cache_control="max-age=60"), credentialed=True) == 0
+    assert c.ttl("/x", 200, _headers(cache_control="public, max-age=60"), credentialed=True) == 60
+    assert c.ttl("/x", 200, _headers(cache_control="s-maxage=10"), credentialed=True) == 10
+
+
+def test_credentialed_lookups_skip_unshared_entries():
+    c = cache.ResponseCache()
+    c.put("k", cache.Entry(200, [], b"anon", 60))
+    assert c.get("k") is not None
+    assert c.get("k", credentialed=True) is None
+    c.put("k", cache.Entry(200, [], b"pub", 60, shared=True))
+    assert c.get("k", credentialed=True).body == b"pub"
+
+
+def test_lru_bounds():
+    c = cache.ResponseCache(max_entries=2)
+    for k in "abc":
+        c.put(k, cache.Entry(200, [], b"x", 60))
+    assert len(c) == 2 and c.get("a") is None
+
+
+def test_fetch_coalesces_concurrent_misses():
+    c = cache.ResponseCache()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "r"
+
+    async def main():
+        return await asyncio.gather(*(c.fetch("k", load) for _ in range(5)))
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert [r for r, _ in results] == ["r"] * 5
+    assert sum(leader for _, leader in results) == 1
+
+
+def test_cancelled_leader_hands_the_load_to_a_waiter():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        c = cache.ResponseCache()
+        leader = asyncio.ensure_future(c.fetch("k", load))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(c.fetch("k", load)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()  # its client disconnected
+        results = await asyncio.gather(*waiters)
+        return leader, results
+    leader, results = asyncio.run(main())
+    assert leader.cancelled()
+    assert len(calls) == 2  # one waiter took over, the others shared its answer
+    assert sorted(r[1] for r in results) == [False, False, True]
+    assert all(r[0] == 2 for r in results)
+
+
+def test_cancelled_waiter_leaves_the_others_alone():
+    async def load():
+        await asyncio.sleep(0.03)
+        return "ok"
+
+    async def main():
+        c = cache.ResponseCache()
+        leader = asyncio.ensure_future(c.fetch("k", load))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(c.fetch("k", load))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await leader, waiter
+    (result, led), waiter = asyncio.run(main())
+    assert result == "ok" and led and waiter.cancelled()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import socket
+import zlib
+
+import cluster
+import shared_state
+
+URLS = [f"http://backend{i}" for i in range(12)]
+INTERVAL = 0.02
+
+
+def _udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _nodes(n, key=None, **kwargs):
+    ports = [_udp_port() for _ in range(n)]
+    nodes = []
+    for i, port in enumerate(ports):
+        stats = shared_state.StatsTable.local(URLS)
+        ejected = set()
+        c = cluster.Cluster(stats, list(URLS), bind=("127.0.0.1", port), node=f"lb{i}",
+                            seeds=[("127.0.0.1", ports[0])], key=key, interval=INTERVAL, **kwargs)
+        c.ejected = lambda e=ejected: e
+        c.local_ejected = ejected
+        nodes.append(c)
+    return nodes
+
+
+async def _until(cond, timeout=3.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not cond():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(INTERVAL)
+
+
+def _run(nodes, scenario):
+    async def main():
+        for c in nodes:
+            await c.start()
+        try:
+            await scenario()
+        finally:
+            for c in nodes:
+                c.close()
+    asyncio.run(main())
+
+
+def test_membership_and_probe_ownership():
+    nodes = _nodes(3)
+
+    async def scenario():
+        await _until(lambda: all(len(c.live()) == 2 for c in nodes))
+        await asyncio.sleep(3 * INTERVAL)  # let every node refresh its live set
+        for url in URLS:
+            owners = {c.node for c in nodes if url in c.owned(URLS)}
+            assert len(owners) == 2  # replicas
+            assert all(set(c.owners(url)) == owners for c in nodes)
+        # together they cover every backend, and the load is shared
+        assert {u for c in nodes for u in c.owned(URLS)} == set(URLS)
+        assert all(len(c.owned(URLS)) < len(URLS) for c in nodes)
+
+    _run(nodes, scenario)
+
+
+def test_probe_results_propagate():
+    nodes = _nodes(3)
+    changes = []
+    for c in nodes[1:]:
+        c.on_health = lambda url, ok, c=c: (changes.append((c.node, url, ok)), c.stats[url].__setitem__("healthy", ok))
+
+    async def scenario():
+        await _until(lambda: all(len(c.live()) == 2 for c in nodes))
+        nodes[0].stats[URLS[3]]["healthy"] = False
+        nodes[0].record_probe(URLS[3], False)
+        await _until(lambda: all(not c.stats[URLS[3]]["healthy"] for c in nodes))
+        assert {(n, u, ok) for n, u, ok in changes} == {("lb1", URLS[3], False), ("lb2", URLS[3], False)}
+        # a newer result from another node wins everywhere
+        nodes[2].stats[URLS[3]]["healthy"] = True
+        nodes[2].record_probe(URLS[3], True)
+        await _until(lambda: nodes[1].stats[URLS[3]]["healthy"])
+
+    _run(nodes, scenario)
+
+
+def test_peer_ejection_needs_a_quorum_and_peer_load_is_shared():
+    nodes = _nodes(3, eject_quorum=0.5)
+    url = URLS[5]
+
+    async def scenario():
+        await _until(lambda: all(len(c.live()) == 2 for c in nodes))
+        nodes[0].local_ejected.add(url)
+        # lb2 sees 1 of its 2 peers ejecting: quorum 0.5 reached
+        await _until(lambda: url in nodes[2].peer_ejected)
+        nodes[1].stats[url].incr("active", 4)
+        await _until(lambda: nodes[2].stats[url]["peer_active"] == 4)
+        assert nodes[1].stats[url]["peer_active"] == 0  # its own count isn't echoed back
+        nodes[0].local_ejected.discard(url)
+        await _until(lambda: url not in nodes[2].peer_ejected)
+
+    _run(nodes, scenario)
+
+
+def test_dead_node_is_dropped_and_its_backends_move():
+    nodes = _nodes(3, dead_after=10 * INTERVAL)
+
+    async def scenario():
+        await _until(lambda: all(len(c.live()) == 2 for c in nodes))
+        nodes[2].close()
+        await _until(lambda: all(len(c.live()) == 1 for c in nodes[:2]))
+        await asyncio.sleep(3 * INTERVAL)
+        # two nodes, two replicas: each probes everything again
+        assert all(c.owned(URLS) == URLS for c in nodes[:2])
+
+    _run(nodes, scenario)
+
+
+def test_forged_datagrams_are_dropped():
+    good = _nodes(2, key="secret")
+    rogue = _nodes(1, key="other")[0]
+    rogue.node, rogue.seeds = "rogue", [good[0].bind]
+
+    async def scenario():
+        await _until(lambda: all(len(c.live()) == 1 for c in good))
+        await asyncio.sleep(10 * INTERVAL)
+        assert "lb0" in {p.node for p in good[1].live()}
+        assert all(len(c.live()) == 1 for c in good)  # the rogue never joined
+        assert good[0].dropped > 0
+
+    _run(good + [rogue], scenario)
+
+
+def test_large_digests_are_split_across_datagrams(monkeypatch):
+    monkeypatch.setattr(cluster, "MAX_DATAGRAM", 1500)
+    urls = [f"http://b{zlib.crc32(str(i).encode()):08x}.example:{8000 + i}" for i in range(300)]
+    sender = cluster.Cluster(shared_state.StatsTable.local(urls), urls, bind=("127.0.0.1", 1), node="a")
+    receiver = cluster.Cluster(shared_state.StatsTable.local(urls), urls, bind=("127.0.0.1", 2), node="b")
+    for i, url in enumerate(urls):
+        sender.stats[url].incr("active", i % 5 + 1)
+    parts = sender._datagrams(0.0)
+    assert len(parts) > 1 and all(len(d) <= 1500 for d in parts)
+    for data in parts:
+        receiver.datagram_received(data, ("127.0.0.1", 1))
+    assert receiver.peers["a"].active == {u: i % 5 + 1 for i, u in enumerate(urls)}
+    # a later round's first part replaces what came before
+    sender.urls = urls[:10]
+    receiver.datagram_received(sender._datagrams(0.0)[0], ("127.0.0.1", 1))
+    assert set(receiver.peers["a"].active) == set(urls[:10])
+
+
+def test_workers_share_one_gossiping_process():
+    name = f"lb_test_cluster_{os.getpid()}"
+    port, other_port = _udp_port(), _udp_port()
+    tables = [shared_state.StatsTable.shared(URLS, name=name) for _ in range(2)]
+    workers = [cluster.Cluster(t, list(URLS), bind=("127.0.0.1", port), node="lb0", interval=INTERVAL,
+                               seeds=[("127.0.0.1", other_port)]) for t in tables]
+    other = cluster.Cluster(shared_state.StatsTable.local(URLS), list(URLS), bind=("127.0.0.1", other_port),
+                            node="lb1", seeds=[("127.0.0.1", port)], interval=INTERVAL, eject_quorum=0.5)
+    other.ejected = lambda: {URLS[2]}
+    first, second = workers
+
+    async def scenario():
+        assert first._transport is not None and second._transport is None
+        assert second.owned(URLS) == []  # the gossiping worker probes for the instance
+        await _until(lambda: URLS[2] in second.ejections())
+        assert tables[1][URLS[2]]["peer_ejected"]
+        first.close()  # the gossiping worker goes away: another takes over
+        await _until(lambda: second._transport is not None)
+        assert second.owned(URLS)
+
+    try:
+        _run([first, second, other], scenario)
+    finally:
+        for t in tables:
+            t.close()
@@ -0,0 +1,160 @@
+import os
+
+os.environ.update({
+    "LB_CACHE": "1",
+    "LB_RATE_LIMIT": "2",
+    "LB_RATE_BURST": "2",
+    "LB_CLIENT_KEY_HEADER": "x-api-key",
+})
+
+import asyncio  # noqa: E402
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+import asgi_proxy  # noqa: E402
+import cache  # noqa: E402
+import custom1  # noqa: E402
+
+HEADERS = {"accept-encoding": "identity"}
+
+
+@pytest.fixture(autouse=True)
+def cached_page():
+    custom1.response_cache.put("GET /cached? identity", cache.Entry(200, [], b"hit", 60))
+
+
+@pytest.mark.parametrize("app", [custom1.app, asgi_proxy.app], ids=["fastapi", "asgi"])
+def test_cache_hits_spend_tokens(app):
+    client = TestClient(app, client=(f"10.1.0.{1 if app is custom1.app else 2}", 1))
+    codes = [client.get("/cached", headers=HEADERS).status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    r = client.get("/cached", headers=HEADERS)
+    assert r.headers["retry-after"] == "1"
+
+
+@pytest.mark.parametrize("app", [custom1.app, asgi_proxy.app], ids=["fastapi", "asgi"])
+def test_streams_are_rate_limited(app):
+    client = TestClient(app, client=(f"10.2.0.{1 if app is custom1.app else 2}", 1))
+    for _ in range(2):
+        assert client.get("/cached", headers=HEADERS).status_code == 200
+    r = client.get("/events", headers={**HEADERS, "accept": "text/event-stream"})
+    assert r.status_code == 429
+
+
+def test_websockets_are_rate_limited():
+    client = TestClient(custom1.app, client=("10.3.0.1", 1))
+    for _ in range(2):
+        assert client.get("/cached", headers=HEADERS).status_code == 200
+    from starlette.websockets import WebSocketDisconnect
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect("/ws", headers=HEADERS):
+            pass
+    assert e.value.code == custom1.longlived.WS_TRY_AGAIN
+
+
+def test_made_up_keys_share_the_ip_bucket():
+    client = TestClient(custom1.app, client=("10.4.0.1", 1))
+    codes = [client.get("/cached", headers={"x-api-key": f"k{i}", **HEADERS}).status_code for i in range(3)]
+    assert codes == [200, 200, 429]
+
+
+@pytest.mark.parametrize("app", [custom1.app, asgi_proxy.app], ids=["fastapi", "asgi"])
+def test_admin_api_is_off_without_a_token(app, monkeypatch):
+    client = TestClient(app)
+    monkeypatch.setattr(custom1, "ADMIN_TOKEN", None)
+    assert client.get("/admin/backends").status_code == 403
+    r = client.post("/admin/backends", json={"url": "http://evil.example"})
+    assert r.status_code == 403
+    assert "http://evil.example" not in custom1.backend_registry
+
+
+def test_admin_api_needs_the_token(monkeypatch):
+    client = TestClient(custom1.app)
+    monkeypatch.setattr(custom1, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/admin/backends").status_code == 401
+    assert client.get("/admin/backends", headers={"x-admin-token": "wrong"}).status_code == 401
+    assert client.get("/admin/backends", headers={"x-admin-token": "s3cret"}).status_code == 200
+
+
+def test_admission_capacity_is_split_between_workers(monkeypatch):
+    monkeypatch.setattr(custom1, "MAX_CONCURRENCY", 10)
+    urls = ["http://a", "http://b", "http://c"]
+    for url in urls:
+        custom1.server_stats.add(url)
+    assert custom1.admission_capacity(urls) == 30
+    monkeypatch.setattr(custom1.server_stats, "processes", lambda: 4)
+    assert custom1.admission_capacity(urls) == 8  # ceil(30 / 4)
+
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, chunks, close_error=None, close_delay=0):
+        self.chunks = chunks
+        self.close_error = close_error
+        self.close_delay = close_delay
+        self.closed = False
+
+    async def __aiter__(self):
+        for c in self.chunks:
+            yield c
+
+    async def aclose(self):
+        self.closed = True
+        await asyncio.sleep(self.close_delay)
+        if self.close_error:
+            raise self.close_error
+
+
+def test_relay_streams_and_releases():
+    body = _Body([b"a", b"b"])
+    resp = httpx.Response(200, headers={"x-a": "1", "connection": "close"}, stream=body)
+    sent, released = [], []
+
+    async def send(msg):
+        sent.append(msg)
+
+    asyncio.run(asgi_proxy._relay(send, resp, lambda: released.append(1)))
+    assert sent[0]["status"] == 200
+    assert (b"x-a", b"1") in sent[0]["headers"]
+    assert all(k != b"connection" for k, _ in sent[0]["headers"])
+    assert b"".join(m.get("body", b"") for m in sent[1:]) == b"ab"
+    assert released == [1] and body.closed
+
+
+def test_relay_releases_when_the_client_disconnects_mid_body():
+    body = _Body([b"a"] * 100, close_delay=0.05)
+    resp = httpx.Response(200, stream=body)
+    released = []
+    started = None
+
+    async def send(msg):
+        if msg["type"] == "http.response.body":
+            started.set()
+            await asyncio.sleep(3600)  # slow client; the server cancels us
+
+    async def main():
+        nonlocal started
+        started = asyncio.Event()
+        task = asyncio.ensure_future(asgi_proxy._relay(send, resp, lambda: released.append(1)))
+        await started.wait()
+        task.cancel()
+        await asyncio.sleep(0.01)
+        task.cancel()  # again, while upstream is closing
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(main())
+    assert released == [1] and body.closed
+
+
+def test_relay_releases_when_closing_upstream_fails():
+    body = _Body([b"a"], close_error=httpx.ReadError("reset"))
+    resp = httpx.Response(200, stream=body)
+    released = []
+
+    async def gone(msg):
+        raise OSError("client went away")
+
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(asgi_proxy._relay(gone, resp, lambda: released.append(1)))
+    assert released == [1]
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+import hedge
+
+
+class _Budget:
+    def __init__(self, ok=True):
+        self.ok = ok
+
+    def withdraw(self):
+        return self.ok
+
+
+class _Resp:
+    closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _attempt(name, secs, log, fail=False):
+    async def run():
+        await asyncio.sleep(secs)
+        if fail:
+            raise ConnectionError(name)
+        resp = _Resp()
+        log.append((name, resp))
+        return name, resp, lambda: log.append((name, "released"))
+    return run
+
+
+def test_no_hedge_when_primary_is_fast():
+    log, hedged = [], []
+
+    async def main():
+        return await hedge.first_of(_attempt("a", 0, log), _attempt("b", 0, log), 0.05, _Budget(),
+                                    on_hedge=lambda: hedged.append(1))
+    assert asyncio.run(main())[0] == "a"
+    assert not hedged
+
+
+def test_no_hedge_when_primary_fails_before_the_delay():
+    log, hedged = [], []
+
+    async def main():
+        await hedge.first_of(_attempt("a", 0, log, fail=True), _attempt("b", 0, log), 0.05, _Budget(),
+                             on_hedge=lambda: hedged.append(1))
+    with pytest.raises(ConnectionError):
+        asyncio.run(main())
+    assert not hedged
+
+
+def test_no_hedge_without_budget():
+    log, hedged = [], []
+
+    async def main():
+        return await hedge.first_of(_attempt("a", 0.05, log), _attempt("b", 0, log), 0.01, _Budget(False),
+                                    on_hedge=lambda: hedged.append(1))
+    assert asyncio.run(main())[0] == "a"
+    assert not hedged
+
+
+def test_hedge_wins_and_loser_is_released():
+    log, hedged = [], []
+
+    async def main():
+        result = await hedge.first_of(_attempt("a", 0.2, log), _attempt("b", 0, log), 0.01, _Budget(),
+                                      on_hedge=lambda: hedged.append(1))
+        await asyncio.sleep(0.01)
+        return result
+    assert asyncio.run(main())[0] == "b"
+    assert hedged == [1]
+    assert ("a", "released") not in log  # cancelled before it had a response
+
+
+def test_cancelled_caller_cancels_its_attempts():
+    log = []
+
+    async def main():
+        task = asyncio.ensure_future(hedge.first_of(_attempt("a", 0.05, log), _attempt("b", 0.05, log), 0.01, _Budget()))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.1)
+    asyncio.run(main())
+    assert log == []  # neither attempt ran on unowned
+
+
+def test_route_latency_threshold():
+    rl = hedge.RouteLatency(quantile=0.9, min_samples=10)
+    assert rl.threshold("/x") is None
+    for i in range(100):
+        rl.observe("/x", 0.01 if i < 90 else 1.0)
+    assert 0.01 <= rl.threshold("/x") < 0.02
+
+
+def test_simultaneous_finish_releases_the_other_response():
+    log = []
+    gate = None
+
+    def gated(name):
+        async def run():
+            await gate.wait()
+            resp = _Resp()
+            log.append((name, resp))
+            return name, resp, lambda: log.append((name, "released"))
+        return run
+
+    async def main():
+        nonlocal gate
+        gate = asyncio.Event()
+        task = asyncio.ensure_future(hedge.first_of(gated("a"), gated("b"), 0.01, _Budget()))
+        await asyncio.sleep(0.03)  # the hedge is out
+        gate.set()
+        result = await task
+        await asyncio.sleep(0.01)
+        return result
+    winner = asyncio.run(main())[0]
+    loser = "b" if winner == "a" else "a"
+    assert (loser, "released") in log
+    assert (winner, "released") not in log
+    assert next(r for n, r in log if n == loser and r != "released").closed
@@ -0,0 +1,45 @@
+import math
+
+import pytest
+
+import latency
+
+
+def test_a_slower_sample_replaces_the_average_at_once():
+    st = {}
+    latency.observe(st, 0.01, now=0.0)
+    latency.observe(st, 0.5, now=0.001)
+    assert st["latency"] == 0.5 and st["stamp"] == 0.001
+
+
+def test_faster_samples_blend_in_by_time_since_the_last():
+    quick, later = {}, {}
+    for st, gap in ((quick, 0.1), (later, latency.DECAY)):
+        latency.observe(st, 1.0, now=0.0)
+        latency.observe(st, 0.0, now=gap)
+    # a sample right after the last barely moves it, one a decay later weighs 1 - 1/e
+    assert quick["latency"] == pytest.approx(math.exp(-0.1 / latency.DECAY))
+    assert later["latency"] == pytest.approx(math.exp(-1))
+
+
+def test_an_idle_backend_decays_towards_zero():
+    st = {}
+    latency.observe(st, 0.2, now=100.0)
+    assert latency.current(st, now=100.0) == pytest.approx(0.2)
+    assert latency.current(st, now=100.0 + latency.DECAY) == pytest.approx(0.2 / math.e)
+    assert latency.current(st, now=100.0 + 20 * latency.DECAY) < 1e-9
+    assert latency.current(st, now=50.0) == pytest.approx(0.2)  # clock behind the stamp
+    assert latency.current({}) == 0.0
+
+
+def test_cost_scales_with_requests_in_flight():
+    st = {"latency": 0.1, "stamp": 0.0, "active": 3}
+    assert latency.cost(st, now=0.0) == pytest.approx(0.4)
+    assert latency.cost({"active": 5}) == 0.0
+
+
+def test_clock_is_swappable(monkeypatch):
+    monkeypatch.setattr(latency, "clock", lambda: 7.0)
+    st = {}
+    latency.observe(st, 0.3)
+    assert st["stamp"] == 7.0 and latency.current(st) == pytest.approx(0.3)
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import lbmetrics
+
+
+def _text(registry):
+    return registry.render().decode()
+
+
+def test_counters_and_gauges_render_with_escaped_labels():
+    reg = lbmetrics.Registry()
+    c = lbmetrics.Counter("lb_x_total", "x", ["backend"], registry=reg)
+    g = lbmetrics.Gauge("lb_up", "up", registry=reg)
+    c.labels('http://a"\\').inc()
+    c.labels('http://a"\\').inc(2)
+    g.set(3)
+    g.dec()
+    text = _text(reg)
+    assert "# TYPE lb_x_total counter\n" in text
+    assert 'lb_x_total{backend="http://a\\"\\\\"} 3\n' in text
+    assert "lb_up 2\n" in text
+
+
+def test_labels_are_checked_and_children_removable():
+    reg = lbmetrics.Registry()
+    g = lbmetrics.Gauge("lb_g", "g", ["a", "b"], registry=reg)
+    with pytest.raises(ValueError):
+        g.labels("only-one")
+    assert g.labels("1", 2) is g.labels(1, "2")
+    g.remove(1, 2)
+    assert "lb_g{" not in _text(reg)
+    with pytest.raises(ValueError):
+        lbmetrics.Gauge("lb_g", "again", registry=reg)
+
+
+def test_set_function_is_read_at_render_time():
+    reg = lbmetrics.Registry()
+    g = lbmetrics.Gauge("lb_fn", "fn", registry=reg)
+    box = [1]
+    g.set_function(lambda: box[0])
+    box[0] = 5
+    assert "lb_fn 5\n" in _text(reg)
+
+
+def test_histogram_buckets_are_cumulative():
+    reg = lbmetrics.Registry()
+    h = lbmetrics.Histogram("lb_h", "h", ["b"], registry=reg, buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.labels("x").observe(v)
+    text = _text(reg)
+    assert 'lb_h_bucket{b="x",le="0.1"} 2\n' in text  # upper bounds are inclusive
+    assert 'lb_h_bucket{b="x",le="1"} 3\n' in text
+    assert 'lb_h_bucket{b="x",le="+Inf"} 4\n' in text
+    assert 'lb_h_count{b="x"} 4\n' in text
+    assert h.labels("x").count == 4
+
+
+def test_request_metrics_count_status_classes_and_errors():
+    reg = lbmetrics.Registry()
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/boom":
+            raise RuntimeError("boom")
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    mw = lbmetrics.RequestMetrics(app, prefix="t", registry=reg)
+
+    async def call(path):
+        async def send(msg):
+            pass
+        await mw({"type": "http", "path": path}, None, send)
+
+    asyncio.run(call("/a"))
+    asyncio.run(call("/metrics"))  # excluded
+    with pytest.raises(RuntimeError):
+        asyncio.run(call("/boom"))
+    text = _text(reg)
+    assert 't_requests_total{code="4xx"} 1\n' in text
+    assert 't_requests_total{code="5xx"} 1\n' in text
+    assert "t_request_duration_seconds_count 2\n" in text
+    assert "t_inflight 0\n" in text
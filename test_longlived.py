@@ -0,0 +1,72 @@
+import asyncio
+
+import longlived
+
+
+def _tracker(urls):
+    stats = {u: {"weight": 1.0, "streams": 0} for u in urls}
+
+    class Row(dict):
+        def incr(self, field, n=1):
+            self[field] = self.get(field, 0) + n
+
+    return longlived.StreamTracker({u: Row(s) for u, s in stats.items()})
+
+
+def _open(tracker, url, n, pool=None):
+    return [tracker.opened(url, "ws", pool) for _ in range(n)]
+
+
+def test_overloaded_backend_sheds_its_excess():
+    async def main():
+        t = _tracker(["a", "b"])
+        streams = _open(t, "a", 8)
+        closed = t.rebalance(["a", "b"], max_close=10)
+        return closed, sum(s.closing.is_set() for s in streams)
+    closed, flagged = asyncio.run(main())
+    assert closed == flagged == 3  # 8 - (fair 4 + 1)
+
+
+def test_draining_backend_moves_off():
+    async def main():
+        t = _tracker(["a", "b"])
+        streams = _open(t, "a", 3)
+        return t.rebalance(["b"], max_close=2), streams
+    closed, streams = asyncio.run(main())
+    assert closed == 2
+    assert sum(s.closing.is_set() for s in streams) == 2
+
+
+def test_pool_streams_are_weighed_within_their_pool():
+    async def main():
+        t = _tracker(["a", "b", "r"])
+        _open(t, "a", 2)
+        _open(t, "b", 2)
+        pinned = _open(t, "r", 10, pool="reports")
+        closed = t.rebalance(["a", "b", "r"], max_close=10, pools={"reports": ["r"]})
+        return closed, pinned
+    closed, pinned = asyncio.run(main())
+    assert closed == 0  # r holds all of its pool's streams, not an overload
+    assert not any(s.closing.is_set() for s in pinned)
+
+
+def test_pool_backend_leaving_the_pool_drains_its_streams():
+    async def main():
+        t = _tracker(["r1", "r2"])
+        pinned = _open(t, "r1", 2, pool="reports")
+        closed = t.rebalance(["r1", "r2"], max_close=10, pools={"reports": ["r2"]})
+        return closed, pinned
+    closed, pinned = asyncio.run(main())
+    assert closed == 2 and all(s.closing.is_set() for s in pinned)
+
+
+def test_closed_streams_are_uncounted():
+    async def main():
+        t = _tracker(["a"])
+        s = t.opened("a", "sse")
+        assert t.stats["a"]["streams"] == 1
+        t.closed(s)
+        t.closed(s)
+        return t
+    t = asyncio.run(main())
+    assert t.stats["a"]["streams"] == 0 and not t.open
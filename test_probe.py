@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import probe
+
+
+def _scheduler(outcomes, **kwargs):
+    """A scheduler whose check answers from `outcomes` (url -> list of bools)."""
+    results = []
+
+    async def check(url, timeout):
+        if not outcomes[url].pop(0):
+            raise ConnectionError(url)
+        return {"cpu": 1.0}
+
+    s = probe.ProbeScheduler(check, lambda url, ok, result, rtt: results.append((url, ok, result)),
+                             list(outcomes), **kwargs)
+    return s, results
+
+
+def _probe(s, url):
+    asyncio.run(s._probe(s._targets[url]))
+
+
+def test_first_probes_are_spread_over_min_interval():
+    now = time.monotonic()
+    s, _ = _scheduler({f"u{i}": [] for i in range(200)}, min_interval=0.5)
+    dues = [t.due - now for t in s._targets.values()]
+    assert all(-0.01 <= d <= 0.51 for d in dues)
+    assert max(dues) - min(dues) > 0.25  # not all at once
+
+
+def test_health_flips_only_after_fall_and_rise():
+    s, results = _scheduler({"u": [False, True, False, False, True, True]}, rise=2, fall=2)
+    healths = []
+    for _ in range(6):
+        _probe(s, "u")
+        healths.append(results[-1][1])
+    # one failure is ignored; two in a row take it down; two successes bring it back
+    assert healths == [True, True, True, False, False, True]
+
+
+def test_failed_probe_result_is_the_exception():
+    s, results = _scheduler({"u": [False, True]}, fall=1)
+    _probe(s, "u")
+    _probe(s, "u")
+    assert results[0][1] is False and isinstance(results[0][2], ConnectionError)
+    assert results[1][2] == {"cpu": 1.0}
+
+
+def test_on_down_reports_once_per_outage():
+    s, _ = _scheduler({"u": [False, False, False, True, True, False, False]}, rise=2, fall=2)
+    downs = []
+    s.on_down = lambda url, seconds: downs.append(url)
+    for _ in range(7):
+        _probe(s, "u")
+    assert downs == ["u", "u"]
+
+
+def test_backoff_intervals():
+    s, _ = _scheduler({"u": [True, True, True, True, False, False, False]},
+                      base_interval=1.0, min_interval=0.25, max_interval=4.0, jitter=0.0)
+    t = s._targets["u"]
+    intervals = []
+    for _ in range(7):
+        _probe(s, "u")
+        intervals.append(t.interval)
+    # successes double up to max; the first failure re-probes at min, then doubles up to base
+    assert intervals == [2.0, 4.0, 4.0, 4.0, 0.25, 0.5, 1.0]
+
+
+def test_timeout_follows_probe_latency():
+    s, _ = _scheduler({"u": []}, timeout=1.0, min_timeout=0.1, max_timeout=5.0, timeout_factor=4.0)
+    t = s._targets["u"]
+    assert s.timeout_for(t) == 1.0  # nothing measured yet
+    t.rtt = 0.01
+    assert s.timeout_for(t) == 0.1
+    t.rtt = 0.5
+    assert s.timeout_for(t) == 2.0
+    t.rtt = 10.0
+    assert s.timeout_for(t) == 5.0
+
+
+def test_poke_moves_a_far_probe_forward():
+    s, _ = _scheduler({"u": []}, min_interval=0.5)
+    t = s._targets["u"]
+    t.due = time.monotonic() + 10
+    s.poke("u")
+    assert t.due <= time.monotonic()
+    t.busy = True
+    t.due = time.monotonic() + 10
+    s.poke("u")  # a probe is already out
+    assert t.due > time.monotonic() + 5
+
+
+def test_loop_probes_targets_and_drops_removed_ones():
+    seen = []
+
+    async def check(url, timeout):
+        seen.append(url)
+
+    async def main():
+        s = probe.ProbeScheduler(check, lambda *a: None, ["a", "b"], base_interval=0.05, min_interval=0.01)
+        s.start()
+        await asyncio.sleep(0.03)
+        s.set_targets(["b"])
+        seen.clear()
+        await asyncio.sleep(0.2)
+        await s.stop()
+    asyncio.run(main())
+    assert seen and set(seen) == {"b"}
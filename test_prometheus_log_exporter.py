@@ -0,0 +1,64 @@
+import asyncio
+import csv
+import json
+
+import httpx
+import pytest
+
+import prometheus_log_exporter as exporter
+
+
+def _prometheus(request):
+    q = request.url.params["query"]
+    if request.url.path == "/api/v1/query_range":
+        data = {"resultType": "matrix", "result": [
+            {"metric": {"instance": "a"}, "values": [[100, "1"], [105, "2"]]},
+        ]}
+    elif "error_rate" in q or "status!~" in q:
+        data = {"resultType": "vector", "result": [{"metric": {}, "value": [100, "NaN"]}]}
+    elif "histogram_quantile" in q:
+        data = {"resultType": "vector", "result": [
+            {"metric": {"instance": "a"}, "value": [100, "+Inf"]},
+            {"metric": {"instance": "b"}, "value": [100, "-Inf"]},
+        ]}
+    else:
+        data = {"resultType": "vector", "result": [
+            {"metric": {"instance": "a"}, "value": [100, "0.5"]},
+            {"metric": {"instance": "b"}, "value": [100, "1.5"]},
+        ]}
+    return httpx.Response(200, json={"status": "success", "data": data})
+
+
+def _run(argv):
+    asyncio.run(exporter.run(exporter.parse_args(argv), transport=httpx.MockTransport(_prometheus)))
+
+
+def test_ndjson_one_row_per_line(tmp_path):
+    out = tmp_path / "run.ndjson"
+    _run(["--out", str(out)])
+    _run(["--out", str(out)])  # appends
+    lines = out.read_text().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert len(rows) > len(exporter.graph_queries)
+    assert all(set(r) == {"ts", "query", "labels", "value"} for r in rows)
+    assert any(r["value"] is None for r in rows)  # NaN -> null
+
+
+def test_ndjson_infinities_are_null(tmp_path):
+    out = tmp_path / "run.ndjson"
+    _run(["--out", str(out)])
+    rows = [json.loads(line, parse_constant=lambda c: pytest.fail(f"non-JSON constant {c}"))
+            for line in out.read_text().splitlines()]
+    p95 = [r["value"] for r in rows if r["query"] == "backend_p95_latency"]
+    assert p95 == [None, None]
+    assert {r["labels"].get("instance") for r in rows} >= {"a", "b"}
+
+
+def test_csv_range(tmp_path):
+    out = tmp_path / "bench.csv"
+    _run(["--out", str(out), "--start", "100", "--end", "105", "--step", "5"])
+    with open(out) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["ts", "query", "labels", "value"]
+    assert len(rows) == 1 + 2 * len(exporter.graph_queries)
+    assert rows[1][2] == "instance=a"
@@ -0,0 +1,74 @@
+import pytest
+from starlette.requests import Request
+
+import ratelimit
+
+
+def _request(host="10.0.0.1", headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "client": (host, 1234)})
+
+
+def test_burst_then_refill():
+    rl = ratelimit.RateLimiter(rate=2, burst=3)
+    c = rl.default
+    assert [rl.take("a", c, now=0.0) for _ in range(5)] == [0.0, 0.0, 0.0, 0.5, 0.5]
+    assert rl.take("a", c, now=0.5) == 0.0  # one token back after 1 / rate
+    assert rl.take("a", c, now=0.5) > 0
+    assert rl.take("b", c, now=0.5) == 0.0  # other clients are separate
+
+
+def test_unlimited_class_tracks_nothing():
+    rl = ratelimit.RateLimiter()
+    assert not rl.enabled
+    assert rl.take("a", rl.default) == 0.0
+    assert len(rl) == 0
+
+
+def test_full_buckets_are_evicted():
+    rl = ratelimit.RateLimiter(rate=10, burst=10)
+    for i in range(100):
+        rl.take(f"c{i}", rl.default, now=0.0)
+    assert len(rl) == 100
+    rl.take("late", rl.default, now=5.0)  # everyone else refilled long ago
+    assert len(rl) == 1
+
+
+def test_memory_bound():
+    rl = ratelimit.RateLimiter(rate=1, burst=5, max_keys=50)
+    for i in range(10_000):
+        rl.take(f"c{i}", rl.default, now=0.0)
+    assert len(rl) == 50
+
+
+def test_classify_by_header_then_ip():
+    rl = ratelimit.RateLimiter(rate=1, header="X-Api-Key", classes={
+        "gold": {"clients": ["k1"], "rate": 100, "weight": 4},
+        "batch": {"clients": ["10.0.0.9"], "rate": 1, "weight": 0.5},
+    })
+    assert rl.classify(_request(headers={"x-api-key": "k1"})) == ("key:k1", rl.classes["gold"])
+    assert rl.classify(_request(headers={"x-api-key": "k2"})) == ("ip:10.0.0.1", rl.default)  # unknown key
+    assert rl.classify(_request("10.0.0.9")) == ("ip:10.0.0.9", rl.classes["batch"])
+    assert rl.classify(_request()) == ("ip:10.0.0.1", rl.default)
+
+
+def test_rotating_an_unknown_key_does_not_reset_the_bucket():
+    rl = ratelimit.RateLimiter(rate=1, burst=2, header="x-api-key", classes={"gold": {"clients": ["k1"], "rate": 100}})
+    waits = []
+    for i in range(4):
+        client, cls = rl.classify(_request(headers={"x-api-key": f"made-up-{i}"}))
+        waits.append(rl.take(client, cls, now=0.0))
+    assert waits[:2] == [0.0, 0.0] and all(w > 0 for w in waits[2:])
+    assert len(rl) == 1  # one tenant, not four
+
+
+def test_invalid_class():
+    with pytest.raises(ValueError):
+        ratelimit.RateLimiter(classes={"x": {"weight": 0}})
+    with pytest.raises(ValueError):
+        ratelimit.RateLimiter(rate=-1)
+
+
+def test_retry_after():
+    assert ratelimit.retry_after(0.2) == 1
+    assert ratelimit.retry_after(2.5) == 3
@@ -0,0 +1,51 @@
+import json
+
+import registry
+import shared_state
+
+
+def _registry(tmp_path, servers, **kwargs):
+    path = tmp_path / "servers.json"
+    path.write_text(json.dumps(servers))
+    reg = registry.Registry(shared_state.StatsTable.local([]), str(path), **kwargs)
+    reg.reload()
+    return reg, path
+
+
+def test_removed_backend_waits_for_requests_and_streams(tmp_path):
+    reg, _ = _registry(tmp_path, [{"url": "a"}, {"url": "b"}])
+    row = reg.table["a"]
+    row.incr("active")
+    row.incr("streams", 2)
+    reg.remove("a")
+    assert reg.members() == ["a", "b"]
+    row.incr("active", -1)
+    assert reg.members() == ["a", "b"]  # WebSocket / SSE streams still open
+    row.incr("streams", -2)
+    assert reg.members() == ["b"]
+    assert "a" not in reg and reg.table["a"]["draining"] == 0
+
+
+def test_reload_applies_only_file_changes(tmp_path):
+    reg, path = _registry(tmp_path, [{"url": "a", "weight": 2}, {"url": "b"}], slow_start=10)
+    assert reg.members() == ["a", "b"]
+    assert reg.table["a"]["weight"] == 2 and not reg.table["a"]["ramp_secs"]  # no slow start at boot
+    reg.set_weight("b", 5)  # an admin edit
+    path.write_text(json.dumps([{"url": "a", "weight": 3}, {"url": "b"}, {"url": "c"}]))
+    reg._mtime -= 1  # as if the file moved on
+    assert reg.reload()
+    assert reg.table["a"]["weight"] == 3
+    assert reg.table["b"]["weight"] == 5  # untouched in the file: the edit stays
+    assert reg.table["c"]["ramp_secs"] == 10  # joined later: slow start
+    path.write_text(json.dumps([{"url": "a", "weight": 3}]))
+    reg._mtime -= 1
+    reg.reload()
+    assert reg.members() == ["a"]
+
+
+def test_invalid_file_keeps_the_pool(tmp_path):
+    reg, path = _registry(tmp_path, [{"url": "a"}])
+    path.write_text("[{")
+    reg._mtime -= 1
+    assert not reg.reload()
+    assert reg.members() == ["a"]
@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+import routes
+
+SPEC = {
+    "pools": {"reports": ["http://r1/", "http://r2"], "api": ["http://a1"]},
+    "routes": [
+        {"path": "/reports/**", "pool": "reports"},
+        {"path": "/api/users/*/export", "methods": ["POST"], "pool": "reports"},
+        {"path": "/api/users/me", "name": "me"},
+        {"path": "/api/**", "name": "api", "pool": "api"},
+    ],
+}
+
+
+@pytest.fixture
+def router():
+    r = routes.Router()
+    r.load(SPEC)
+    return r
+
+
+@pytest.mark.parametrize("path,method,name", [
+    ("/reports", "GET", "/reports/**"),
+    ("/reports/2024/q1", "GET", "/reports/**"),
+    ("/api/users/7/export", "POST", "POST /api/users/*/export"),
+    ("/api/users/7/export", "GET", "api"),  # method filter: falls back to **
+    ("/api/users/me", "GET", "me"),  # literal beats **
+    ("/api", "GET", "api"),
+    ("/other", "GET", routes.DEFAULT),
+    ("/", "GET", routes.DEFAULT),
+])
+def test_match(router, path, method, name):
+    assert router.match(path, method).name == name
+
+
+def test_pools_are_normalised(router):
+    assert router.pools["reports"] == {"http://r1", "http://r2"}
+    assert router.match("/reports/x").pool == "reports"
+    assert router.match("/api/users/me").pool is None
+
+
+def test_invalid_specs(router):
+    with pytest.raises(ValueError):
+        router.load({"routes": [{"path": "/x", "pool": "nope"}]})
+    with pytest.raises(ValueError):
+        router.load({"routes": [{"path": "/x/**/y"}]})
+    assert router.match("/reports/x").name == "/reports/**"  # unchanged
+
+
+def test_costs(router):
+    heavy, light, new = router.match("/reports/x"), router.match("/api/x"), router.match("/other")
+    assert router.cost(new) == router.initial_cost
+    router.observe(heavy, 0.4)
+    router.observe(light, 0.02)
+    assert router.cost(heavy) == 0.4
+    assert router.cost(new) == pytest.approx(0.21)  # mean of the learned ones
+    router.observe(heavy, 0.5)
+    assert router.cost(heavy) == pytest.approx(0.41)
+
+
+def test_baseline_waits_for_samples(router):
+    heavy = router.match("/reports/x")
+    for _ in range(router.settle - 1):
+        router.observe(heavy, 0.4)
+    assert router.baseline(heavy) == 0.0
+    router.observe(heavy, 0.4)
+    assert router.baseline(heavy) == pytest.approx(0.4)
+
+
+def test_reload_keeps_learned_costs(tmp_path):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps(SPEC))
+    r = routes.Router(str(path))
+    assert r.reload()
+    assert not r.reload()  # unchanged
+    r.observe(r.match("/reports/x"), 0.3)
+    spec = dict(SPEC, routes=SPEC["routes"][:1])
+    path.write_text(json.dumps(spec))
+    os.utime(path, ns=(1, 1))
+    assert r.reload()
+    assert r.match("/api/x").name == routes.DEFAULT
+    assert r.match("/reports/x").cost == 0.3
+    path.write_text("{half")
+    os.utime(path, ns=(2, 2))
+    assert not r.reload()
+    assert r.match("/reports/x").name == "/reports/**"
@@ -2,24 +2,26 @@ import asyncio
 import httpx
 from collections import defaultdict
 
+# Quick distribution check against a running LB; see bench.py for real runs.
 results = defaultdict(int)
 
-async def make_request(i):
+async def make_request(client, i):
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.get("http://localhost:8080")
-            backend = r.json().get("message", "unknown")
-            results[backend] += 1
-            print(f"Request {i} → {backend}")
+        r = await client.get("http://localhost:8080")
+        backend = r.headers.get("x-backend") or r.json().get("server", "unknown")
+        results[backend] += 1
+        print(f"Request {i} → {backend}")
     except Exception as e:
         print(f"Request {i} failed: {e}")
 
 async def main():
-    tasks = [make_request(i) for i in range(100)]
-    await asyncio.gather(*tasks)
+    async with httpx.AsyncClient() as client:
+        tasks = [make_request(client, i) for i in range(100)]
+        await asyncio.gather(*tasks)
 
     print("\n=== Summary ===")
     for server, count in results.items():
-        print(f"{server}: {count} requests")s
+        print(f"{server}: {count} requests")
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import os
+import uuid
+
+import pytest
+
+import shared_state
+
+
+@pytest.fixture
+def name():
+    n = f"lb_test_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    yield n
+    try:
+        shared_state._open_segment(n).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def test_processes_counts_attached_tables(name):
+    assert shared_state.StatsTable.local(["a"]).processes() == 1
+    first = shared_state.StatsTable.shared(["a"], name=name)
+    second = shared_state.StatsTable.shared([], name=name)
+    assert first.processes() == second.processes() == 2
+    second.close()
+    assert first.processes() == 1
+    first.close()
+
+
+def test_sharded_counts_sum_over_workers(name):
+    a = shared_state.StatsTable.shared(["u"], name=name)
+    b = shared_state.StatsTable.shared([], name=name)
+    a["u"].incr("active", 2)
+    b["u"].incr("active", 3)
+    assert a["u"]["active"] == b["u"]["active"] == 5
+    assert list(a.sharded("active")[a.rows(["u"])]) == [5]
+    a["u"]["healthy"] = False  # plain fields are shared as they are
+    assert not b["u"]["healthy"]
+    b.close()
+    a.close()
+
+
+def test_detaching_worker_takes_its_counts_along(name):
+    a = shared_state.StatsTable.shared(["u"], name=name)
+    b = shared_state.StatsTable.shared([], name=name)
+    b["u"].incr("active", 3)
+    b["u"].incr("work", 1.5)
+    b.close()
+    assert a["u"]["active"] == 0 and a["u"]["work"] == 0
+    c = shared_state.StatsTable.shared([], name=name)
+    assert c.worker == b.worker  # the slot is reused
+    c.close()
+    a.close()
+
+
+def test_dead_worker_is_reaped(name, monkeypatch):
+    a = shared_state.StatsTable.shared(["u"], name=name)
+    b = shared_state.StatsTable.shared([], name=name)
+    b["u"].incr("active", 4)
+    b._pids[b.worker] = 2 ** 22 + 1  # a pid that isn't running
+    for view in (b._cols, b._urls, b._pids):  # gone without close()
+        view.release()
+    b._shm.close()
+    monkeypatch.setattr(shared_state, "_alive", lambda pid: pid != 2 ** 22 + 1)
+    assert a["u"]["active"] == 4 and a.processes() == 2
+    assert a.reap() == 1
+    assert a["u"]["active"] == 0 and a.processes() == 1
+    # a new worker attaching also reaps, and gets the freed slot zeroed
+    c = shared_state.StatsTable.shared([], name=name)
+    assert c.worker == b.worker and c["u"]["active"] == 0
+    c.close()
+    a.close()
+
+
+def test_last_close_unlinks(name):
+    a = shared_state.StatsTable.shared(["u"], name=name)
+    a["u"].incr("active")
+    a.close()
+    fresh = shared_state.StatsTable.shared([], name=name)
+    assert "u" not in fresh and fresh.worker == 0
+    fresh.close()
+
+
+def test_other_layouts_are_refused(name):
+    shm = shared_state._open_segment(name, create=True, size=shared_state.table_size(4))
+    cols = shm.buf.cast("d")
+    cols[0] = 1.0  # not our magic
+    cols.release()
+    shm.close()
+    with pytest.raises(RuntimeError):
+        shared_state.StatsTable.shared([], name=name)
+
+
+def test_default_name_is_per_run_and_command_line(monkeypatch):
+    name = shared_state.default_name()
+    assert name.startswith(f"lb_stats_{os.getppid()}_")
+    assert shared_state.default_name() == name
+    monkeypatch.setattr(shared_state.sys, "argv", ["uvicorn", "custom1:app", "--port", "9999"])
+    assert shared_state.default_name() != name
@@ -0,0 +1,65 @@
+import json
+import random
+import time
+
+import pytest
+
+import latency
+import simulate
+import strategies
+
+SCENARIO = {
+    "backends": [
+        {"name": "a", "servers": 2, "dist": "const", "mean_ms": 10},
+        {"name": "b", "servers": 2, "dist": "const", "mean_ms": 10, "failures": [[2.2, 4]]},
+    ],
+    "probe_interval": 0.5,
+}
+
+
+def _run(name, scenario=SCENARIO, rate=100, duration=6, seed=1):
+    arrivals = simulate.synthetic_arrivals(rate, duration, 50, random.Random(seed))
+    sim = simulate.Simulation(scenario, strategies.get_strategy(name), seed)
+    return sim, sim.run(arrivals, duration)
+
+
+def test_every_request_is_accounted_for():
+    sim, r = _run("round_robin")
+    assert r["requests"] == r["completed"] + r["failed_fast"] > 500
+    assert r["response_ms"]["p50"] == pytest.approx(10.0, rel=0.02)  # const service, no queueing
+    assert sum(b["served"] for b in r["backends"].values()) == r["completed"]
+    # probes take the failed backend out, so only the first interval hits it
+    assert 0 < r["failed_fast"] < 0.5 * 100 * 0.5
+
+
+def test_same_seed_same_result():
+    assert _run("p2c")[1] == _run("p2c")[1]
+
+
+def test_run_restores_the_latency_clock():
+    _run("scored")
+    assert latency.clock is time.monotonic
+
+
+def test_slower_backend_gets_less_with_p2c():
+    scenario = {"backends": [
+        {"name": "fast", "servers": 4, "dist": "const", "mean_ms": 5},
+        {"name": "slow", "servers": 4, "dist": "const", "mean_ms": 50},
+    ]}
+    _, r = _run("p2c", scenario, rate=200, duration=10)
+    assert r["backends"]["fast"]["served"] > 2 * r["backends"]["slow"]["served"]
+
+
+def test_trace_arrivals(tmp_path):
+    path = tmp_path / "arrivals.ndjson"
+    path.write_text('0.5\n\n{"t": 1.0, "method": "POST", "size": 10, "key": "k"}\n')
+    assert list(simulate.trace_arrivals(path)) == [(0.5, "GET", 0, None), (1.0, "POST", 10, "k")]
+
+
+def test_cli_writes_a_report(tmp_path, capsys):
+    out = tmp_path / "sim.json"
+    simulate.main(["--strategies", "round_robin,least_connections", "--duration", "2", "--rate", "50",
+                   "--report", str(out)])
+    report = json.loads(out.read_text())
+    assert set(report["results"]) == {"round_robin", "least_connections"}
+    assert "round_robin" in capsys.readouterr().out
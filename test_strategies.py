@@ -0,0 +1,80 @@
+from collections import Counter
+
+import pytest
+
+import shared_state
+import strategies
+
+URLS = ["http://a", "http://b", "http://c"]
+
+
+def _stats(kind, urls=URLS):
+    if kind == "table":
+        return shared_state.StatsTable.local(urls)
+    return {u: {"active": 0, "latency": 0.0, "stamp": 0.0, "weight": 1.0} for u in urls}
+
+
+def test_round_robin_without_stats():
+    # main1 / main11 pass no stats
+    rr = strategies.get_strategy("round_robin")
+    assert [rr.pick(["a", "b"], None) for _ in range(4)] == ["a", "b", "a", "b"]
+
+
+@pytest.mark.parametrize("kind", ["dict", "table"])
+def test_round_robin_equal_weights_cycles(kind):
+    rr = strategies.get_strategy("round_robin")
+    stats = _stats(kind)
+    assert Counter(rr.pick(URLS, stats) for _ in range(30)) == {u: 10 for u in URLS}
+
+
+@pytest.mark.parametrize("kind", ["dict", "table"])
+def test_round_robin_smooth_weights(kind):
+    rr = strategies.get_strategy("round_robin")
+    stats = _stats(kind, URLS[:2])
+    stats["http://a"]["weight"] = 3.0
+    picks = "".join(rr.pick(URLS[:2], stats)[-1] for _ in range(8))
+    assert picks == "aabaaaba"
+
+
+@pytest.mark.parametrize("kind", ["dict", "table"])
+def test_least_connections_is_weighted(kind):
+    lc = strategies.get_strategy("least_connections")
+    stats = _stats(kind)
+    stats["http://a"]["active"] = 2
+    stats["http://b"]["active"] = 3
+    stats["http://b"]["weight"] = 4.0
+    stats["http://c"]["active"] = 1
+    assert lc.pick(URLS, stats) == "http://b"
+
+
+@pytest.mark.parametrize("kind", ["dict", "table"])
+def test_least_work(kind):
+    lw = strategies.get_strategy("least_work")
+    stats = _stats(kind)
+    for u, work in zip(URLS, (0.5, 0.02, 0.1)):
+        if kind == "table":
+            stats[u].incr("work", work)
+        else:
+            stats[u]["work"] = work
+    assert lw.pick(URLS, stats) == "http://b"
+
+
+def test_ramp_and_effective_weight():
+    st = {"weight": 2.0, "ramp_start": 100.0, "ramp_secs": 10.0}
+    assert strategies.ramp(st, 100.0) == pytest.approx(strategies.RAMP_FLOOR)
+    assert strategies.effective_weight(st, 105.0) == pytest.approx(2.0 * (0.1 + 0.9 * 0.5))
+    assert strategies.effective_weight(st, 200.0) == 2.0
+    assert strategies.ramp({}) == 1.0
+
+
+def test_maglev_stays_within_candidates():
+    mg = strategies.get_strategy("maglev")
+    stats = _stats("dict")
+    mg.pick(URLS, stats, key="k")
+    pool = URLS[:1]
+    assert all(mg.pick(pool, stats, key=f"k{i}") == "http://a" for i in range(20))
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        strategies.get_strategy("nope")
@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+
+import streaming
+
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, chunks, fail=False):
+        self.chunks = chunks
+        self.fail = fail
+        self.closed = False
+
+    async def __aiter__(self):
+        for c in self.chunks:
+            yield c
+        if self.fail:
+            raise httpx.ReadError("connection reset")
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _run(response, send=None):
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "method": "GET", "path": "/"}
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def record(msg):
+        sent.append(msg)
+
+    async def main():
+        await response(scope, receive, send or record)
+    return sent, main
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_relay_releases_once_however_the_body_ends(fail):
+    body = _Body([b"a", b"b"], fail=fail)
+    resp = httpx.Response(200, headers={"x-a": "1", "connection": "close"}, stream=body)
+    released = []
+    sent, main = _run(streaming.relay(resp, lambda: released.append(1)))
+    if fail:
+        with pytest.raises(httpx.ReadError):
+            asyncio.run(main())
+    else:
+        asyncio.run(main())
+        assert b"".join(m.get("body", b"") for m in sent[1:]) == b"ab"
+        assert (b"x-a", b"1") in sent[0]["headers"]
+        assert all(k != b"connection" for k, _ in sent[0]["headers"])
+    assert released == [1]
+    assert body.closed
+
+
+def test_relay_releases_when_the_client_is_gone_before_the_headers():
+    body = _Body([b"a"])
+    resp = httpx.Response(200, stream=body)
+    released = []
+
+    async def gone(msg):
+        raise OSError("client went away")
+
+    _, main = _run(streaming.relay(resp, lambda: released.append(1)), send=gone)
+    with pytest.raises(Exception):  # ClientDisconnect on ASGI 2.4
+        asyncio.run(main())
+    assert released == [1]
+    assert body.closed
+
+
+def test_relay_with_a_custom_body():
+    body = _Body([b"raw"])
+    resp = httpx.Response(200, stream=body)
+    released = []
+
+    async def events():
+        yield b"data: 1\n\n"
+        raise httpx.ReadError("reset")
+
+    sent, main = _run(streaming.relay(resp, lambda: released.append(1), body=events()))
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(main())
+    assert sent[1]["body"] == b"data: 1\n\n"
+    assert released == [1] and body.closed
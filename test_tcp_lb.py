@@ -0,0 +1,94 @@
+import asyncio
+import json
+import socket
+from collections import Counter
+
+import tcp_lb
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _backend(name, seen):
+    async def handle(reader, writer):
+        first = True
+        while data := await reader.read(1024):
+            if first:  # not the prober's bare connects
+                seen[name] += 1
+                first = False
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_concurrent_connections_are_spread_by_weight(tmp_path):
+    async def main():
+        seen = Counter()
+        a, b = await _backend("a", seen), await _backend("b", seen)
+        pa, pb = (s.sockets[0].getsockname()[1] for s in (a, b))
+        servers = tmp_path / "servers.json"
+        servers.write_text(json.dumps([
+            {"url": f"tcp://127.0.0.1:{pa}", "weight": 1},
+            {"url": f"tcp://127.0.0.1:{pb}", "weight": 2},
+        ]))
+        lb = tcp_lb.TcpBalancer(str(servers), zero_copy=False, probe_interval=60)
+        port = _free_port()
+        serving = asyncio.create_task(lb.serve("127.0.0.1", port))
+        await asyncio.sleep(0.05)
+
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"ping")
+            assert await reader.readexactly(4) == b"ping"
+            return writer
+
+        writers = await asyncio.gather(*(client() for _ in range(6)))
+        active = {u: lb.stats[u]["active"] for u in lb.urls}
+        for w in writers:
+            w.close()
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+        a.close()
+        b.close()
+        return seen, active
+
+    seen, active = asyncio.run(main())
+    assert seen == {"a": 2, "b": 4}
+    assert sorted(active.values()) == [2, 4]
+
+
+def test_max_concurrency_is_not_exceeded(tmp_path):
+    async def main():
+        seen = Counter()
+        a = await _backend("a", seen)
+        pa = a.sockets[0].getsockname()[1]
+        servers = tmp_path / "servers.json"
+        servers.write_text(json.dumps([{"url": f"tcp://127.0.0.1:{pa}", "max_concurrency": 2}]))
+        lb = tcp_lb.TcpBalancer(str(servers), zero_copy=False, probe_interval=60)
+        port = _free_port()
+        serving = asyncio.create_task(lb.serve("127.0.0.1", port))
+        await asyncio.sleep(0.05)
+
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"ping")
+            try:
+                return await asyncio.wait_for(reader.read(4), 1.0), writer
+            except ConnectionError:
+                return b"", writer
+
+        results = await asyncio.gather(*(client() for _ in range(5)))
+        for _, w in results:
+            w.close()
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+        a.close()
+        return seen, [r for r, _ in results]
+
+    seen, replies = asyncio.run(main())
+    assert seen["a"] == 2
+    assert replies.count(b"ping") == 2
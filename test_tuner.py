@@ -0,0 +1,85 @@
+import asyncio
+import json
+import math
+import random
+
+import strategies
+import tuner
+
+
+def _tuner(**kwargs):
+    return tuner.Tuner(strategies.Scored(), epoch=10, rng=random.Random(1), **kwargs)
+
+
+def _epoch(t, rtt, ok=True):
+    for _ in range(t.epoch):
+        t.observe(rtt, ok)
+
+
+def test_perturbs_by_c_in_opposite_directions():
+    t = _tuner(perturbation=0.1)
+    centre = t.weights()
+    plus = dict(t.strategy.weights)
+    _epoch(t, 0.01)
+    minus = t.strategy.weights
+    for n in ("cpu", "mem", "latency", "active"):
+        assert math.isclose(math.log(plus[n] / centre[n]), -math.log(minus[n] / centre[n]))
+        assert math.isclose(abs(math.log(plus[n] / centre[n])), 0.1)
+
+
+def test_one_update_moves_at_most_max_step():
+    t = _tuner(max_step=0.05, learning_rate=10.0)
+    before = dict(t.theta)
+    _epoch(t, 0.01)
+    _epoch(t, 1.0)  # a huge difference between the two epochs
+    assert t.updates == 1
+    for n, v in t.theta.items():
+        assert math.isclose(abs(v - before[n]), 0.05)
+
+
+def test_weights_stay_within_bounds():
+    t = _tuner(max_step=1.0, learning_rate=10.0, bound=2.0)
+    init = t.weights()
+    for i in range(40):
+        _epoch(t, 0.01 if i % 2 else 1.0)
+    for n, w in t.weights().items():
+        assert init[n] / 2.0 - 1e-9 <= w <= init[n] * 2.0 + 1e-9
+
+
+def test_frozen_applies_the_centre_and_stops_learning():
+    t = _tuner()
+    t.freeze()
+    centre = t.weights()
+    for _ in range(4):
+        _epoch(t, random.random())
+    assert t.updates == 0
+    assert t.weights() == centre
+    assert all(math.isclose(t.strategy.weights[n], w) for n, w in centre.items() if n != "local_bonus")
+
+
+def test_updates_are_saved_in_the_background(tmp_path):
+    path = tmp_path / "tuner.json"
+    t = _tuner(state_path=str(path))
+    _epoch(t, 0.01)
+    _epoch(t, 0.02)
+    assert t.dirty and not path.exists()  # nothing written on the request path
+
+    asyncio.run(t.flush())
+    assert not t.dirty
+    assert json.loads(path.read_text())["updates"] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+    restored = _tuner(state_path=str(path))
+    assert all(math.isclose(restored.weights()[n], w) for n, w in t.weights().items())
+
+
+def test_failed_save_is_logged_and_retried(tmp_path, caplog):
+    path = tmp_path / "missing" / "tuner.json"
+    t = _tuner(state_path=str(path))
+    t.set_weights({"cpu": 0.5})
+    asyncio.run(t.flush())  # no exception
+    assert t.dirty
+    assert "saving tuner state" in caplog.text
+    path.parent.mkdir()
+    asyncio.run(t.flush())
+    assert not t.dirty and path.exists()
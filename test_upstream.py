@@ -0,0 +1,83 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+import upstream
+
+URL = "http://backend1"
+
+
+def _request():
+    return Request({"type": "http", "method": "GET", "path": "/x", "query_string": b"", "headers": []})
+
+
+class _Body(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"ok"
+
+
+def _mock(pools, url=URL):
+    # swap the pool's client for one that answers locally, body unread
+    pool = pools._pools[url]
+    pool.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200, stream=_Body())))
+    return pool
+
+
+@pytest.mark.parametrize("value,mode", [
+    ("1", True), ("true", True), ("TRUE", True), ("prior", "prior"),
+    (None, False), ("", False), ("0", False), ("false", False), ("off", False), ("yes please", False),
+])
+def test_http2_mode(value, mode):
+    assert upstream.http2_mode(value) == mode
+
+
+def test_pool_size_follows_weight_and_peak():
+    pools = upstream.Pools(per_weight=10, min_connections=4, max_connections=50, headroom=2.0)
+    pools.add("a", 0.1)
+    pools.add("b", 3.0)
+    assert pools.limit("a") == 4  # floor
+    assert pools.limit("b") == 30
+    assert pools._target("b", 40) == 50  # capped
+
+
+def test_responses_are_counted_until_closed():
+    async def main():
+        pools = upstream.Pools([URL])
+        pool = _mock(pools)
+        resp = await pools.send(URL, "x", _request())
+        assert pool.inflight == 1 and pool.peak == 1
+        assert await resp.aread() == b"ok"
+        await resp.aclose()
+        await resp.aclose()  # only counted down once
+        assert pool.inflight == 0
+        await pools.aclose()
+    asyncio.run(main())
+
+
+def test_resized_pool_closes_after_its_last_response():
+    async def main():
+        pools = upstream.Pools([URL], per_weight=4, min_connections=1, headroom=2.0)
+        old = _mock(pools)
+        resp = await pools.send(URL, "x", _request())
+        old.peak = 10
+        await pools.maintain()  # grows to peak * headroom
+        assert pools.limit(URL) == 20 and old.retired
+        assert not old.client.is_closed  # still streaming
+        await resp.aclose()
+        assert old.client.is_closed
+        await pools.aclose()
+    asyncio.run(main())
+
+
+def test_idle_pool_is_reaped_and_reopened():
+    async def main():
+        pools = upstream.Pools([URL], idle=0.0)
+        pool = _mock(pools)
+        pool.last_used -= 1
+        await pools.maintain()
+        assert pool.client.is_closed
+        assert pools._pool(URL) is not pool  # a fresh client on the next request
+        await pools.aclose()
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+
+# ------------------------------------------------
+# ONLINE WEIGHT TUNING (SPSA)
+# ------------------------------------------------
+# Tunes a Scored strategy's weights (and local_bonus) against the live
+# objective  mean upstream latency + error_cost * error rate.
+# Simultaneous-perturbation stochastic approximation: every parameter is
+# nudged at once by +-c in log space for one epoch, then by the opposite
+# sign for the next; the relative difference of the two epochs' objective
+# gives a gradient estimate for all parameters from two measurements.
+# Working in log space keeps weights positive and makes steps relative, so
+# cpu (percent), latency (seconds) and active (count) tune alike.
+#
+# Safety: every parameter stays within [initial / bound, initial * bound],
+# one update moves a parameter by at most max_step (in log space), and
+# freeze() pins the current centre weights. heavy_penalty is not tuned: it
+# is the same for every candidate, so it never changes which one wins.
+#
+# Persistence: updates only mark the state dirty; persist() writes it from
+# a background task, off the request path. With --workers N each worker
+# tunes its own copy on its own traffic; they all load the same state file
+# at start and each saves over it, so it holds the most recent worker's
+# weights as the starting point for the next run.
+log = logging.getLogger("lb.tuner")
+
+
+class Tuner:
+    def __init__(self, strategy, epoch=500, perturbation=0.1, learning_rate=0.05,
+                 max_step=0.1, bound=10.0, error_cost=1.0, state_path=None, rng=None):
+        self.strategy = strategy
+        self.epoch = epoch  # requests per measurement
+        self.c = perturbation
+        self.a = learning_rate
+        self.max_step = max_step
+        self.error_cost = error_cost  # seconds of latency one unit of error rate is worth
+        self.state_path = state_path
+        self.rng = rng or random.Random()
+        # tunable parameters: non-zero weights plus the localhost bonus
+        self.names = [k for k, w in strategy.weights.items() if w > 0]
+        if strategy.local_bonus > 0:
+            self.names.append("local_bonus")
+        init = self._read()
+        self.bounds = {n: (math.log(init[n] / bound), math.log(init[n] * bound)) for n in self.names}
+        self.theta = {n: math.log(init[n]) for n in self.names}
+        self.frozen = False
+        self.updates = 0
+        self.dirty = False  # updated since the last save
+        self.objective = None  # last epoch's objective
+        self._delta = None
+        self._phase = 0  # 0: +c epoch, 1: -c epoch
+        self._plus = None
+        self._reset_epoch()
+        if state_path and os.path.exists(state_path):
+            self.load(state_path)
+        self._apply()
+
+    # ---- parameters ----------------------------------------------------
+    def _read(self):
+        s = self.strategy
+        return {n: (s.local_bonus if n == "local_bonus" else s.weights[n]) for n in self.names}
+
+    def _write(self, theta):
+        s = self.strategy
+        for n, v in theta.items():
+            if n == "local_bonus":
+                s.local_bonus = math.exp(v)
+            else:
+                s.weights[n] = math.exp(v)
+
+    def weights(self) -> dict:
+        """Centre (learned) parameters, without the current perturbation."""
+        return {n: math.exp(v) for n, v in self.theta.items()}
+
+    def _apply(self):
+        if self.frozen or not self.names:
+            self._write(self.theta)
+            return
+        if self._delta is None:
+            self._delta = {n: self.rng.choice((-1.0, 1.0)) for n in self.names}
+        sign = 1.0 if self._phase == 0 else -1.0
+        self._write({n: self._clip(n, v + sign * self.c * self._delta[n]) for n, v in self.theta.items()})
+
+    def _clip(self, name, v):
+        lo, hi = self.bounds[name]
+        return min(max(v, lo), hi)
+
+    # ---- measurements --------------------------------------------------
+    def _reset_epoch(self):
+        self._n = 0
+        self._errors = 0
+        self._latency = 0.0
+
+    def observe(self, rtt: float, ok: bool):
+        """One upstream attempt under the weights currently applied."""
+        self._n += 1
+        self._latency += rtt
+        if not ok:
+            self._errors += 1
+        if self._n >= self.epoch:
+            self._end_epoch()
+
+    def _end_epoch(self):
+        j = self._latency / self._n + self.error_cost * self._errors / self._n
+        self.objective = j
+        self._reset_epoch()
+        if self.frozen or not self.names:
+            return
+        if self._phase == 0:
+            self._plus, self._phase = j, 1
+        else:
+            self._step(self._plus, j)
+            self._phase, self._delta = 0, None
+        self._apply()
+
+    def _step(self, j_plus, j_minus):
+        scale = (j_plus + j_minus) / 2
+        if scale <= 0:
+            return
+        # relative difference, so the step doesn't depend on latency units
+        diff = (j_plus - j_minus) / scale
+        for n in self.names:
+            g = diff / (2 * self.c * self._delta[n])
+            step = max(-self.max_step, min(self.max_step, self.a * g))
+            self.theta[n] = self._clip(n, self.theta[n] - step)
+        self.updates += 1
+        self._persist()
+
+    # ---- control -------------------------------------------------------
+    def freeze(self, on=True):
+        self.frozen = on
+        self._phase, self._delta, self._plus = 0, None, None
+        self._reset_epoch()
+        self._apply()
+        self._persist()
+
+    def set_weights(self, weights: dict):
+        """Import weights (e.g. exported from another instance); clipped to bounds."""
+        for n, w in weights.items():
+            if n in self.theta and w > 0:
+                self.theta[n] = self._clip(n, math.log(w))
+        self._apply()
+        self._persist()
+
+    def export(self) -> dict:
+        return {"weights": self.weights(), "frozen": self.frozen, "updates": self.updates,
+                "objective": self.objective}
+
+    def _persist(self):
+        self.dirty = bool(self.state_path)
+
+    async def persist(self, interval=10.0):
+        """Save the state every `interval` seconds while it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        # snapshot on the loop; only the file I/O goes to a thread
+        if not await asyncio.to_thread(self._save, self.state_path, self.export()):
+            self.dirty = True
+
+    def save(self, path):
+        self._save(path, self.export())
+
+    @staticmethod
+    def _save(path, state) -> bool:
+        # tmp name per process: workers share the path
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp, path)
+            return True
+        except OSError as e:
+            log.warning("saving tuner state to %s failed: %s", path, e)
+            return False
+
+    def load(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        self.set_weights(state.get("weights", {}))
+        if state.get("frozen"):
+            self.freeze()
@@ -0,0 +1,273 @@
+import asyncio
+import math
+import time
+
+import httpx
+from fastapi import Request
+
+import streaming
+
+# ------------------------------------------------
+# PER-BACKEND UPSTREAM POOLS
+# ------------------------------------------------
+# One httpx client per backend, so a slow or busy backend only exhausts its
+# own connection slots. A pool is sized from the backend's weight and the
+# peak concurrency seen since the last check:
+#     limit = clamp(max(per_weight * weight, peak * headroom), min, max)
+# and is replaced by a resized client when that moves far enough; the old
+# client is closed once its last streamed response finishes.
+#
+# Pools are pre-warmed (a few concurrent HEAD requests) when a backend is
+# added or comes back to health, and a backend idle for longer than
+# `idle` seconds has its client closed, which drops its keep-alive
+# connections; the next request opens a fresh one.
+#
+# http2: False, True (negotiated via ALPN, https backends) or "prior"
+# (cleartext h2c with prior knowledge). Both need the `h2` package.
+
+
+def http2_mode(value: str):
+    """Pools' http2 from a setting: "1"/"true" on, "prior" for h2c, anything else off."""
+    value = (value or "").strip().lower()
+    if value == "prior":
+        return "prior"
+    return value in ("1", "true")
+
+
+class _Pool:
+    __slots__ = ("url", "client", "limit", "inflight", "peak", "last_used", "retired", "metrics")
+
+    def __init__(self, url, client, limit, metrics):
+        self.url = url
+        self.client = client
+        self.limit = limit
+        self.inflight = 0
+        self.peak = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+        self.metrics = metrics
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """Response body wrapper: lets the pool know when a response is done."""
+
+    def __init__(self, stream, pools, pool):
+        self._stream = stream
+        self._pools = pools
+        self._pool = pool
+        self._open = True
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._open:
+                self._open = False
+                await self._pools._finished(self._pool)
+
+
+class Pools:
+    def __init__(self, urls=(), weights=None, timeout=5.0, per_weight=20, min_connections=4,
+                 max_connections=200, headroom=1.5, warm=2, warm_path="/", idle=30.0,
+                 http2=False, interval=5.0, metrics=False):
+        self.timeout = timeout
+        self.per_weight = per_weight
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.headroom = headroom
+        self.warm_connections = warm
+        self.warm_path = warm_path
+        self.idle = idle
+        self.http2 = http2
+        self.interval = interval
+        self._weights = {}
+        self._pools = {}
+        self._retired = []
+        self._task = None
+        self._metrics = _metrics() if metrics else None
+        for url in urls:
+            self.add(url, (weights or {}).get(url, 1.0))
+
+    # ---- membership ----------------------------------------------------
+    def add(self, url, weight=1.0):
+        self._weights[url] = weight
+        if url not in self._pools:
+            self._pools[url] = self._new_pool(url, self._target(url, 0))
+
+    def set_weight(self, url, weight):
+        if url in self._weights:
+            self._weights[url] = weight
+
+    def remove(self, url):
+        self._weights.pop(url, None)
+        pool = self._pools.pop(url, None)
+        if pool is not None:
+            self._retire(pool)
+        if self._metrics:
+            wait, conns, size = self._metrics
+            wait.remove(url)
+            size.remove(url)
+            for kind in ("new", "reused"):
+                conns.remove(url, kind)
+
+    def __contains__(self, url):
+        return url in self._pools
+
+    def limit(self, url):
+        return self._pools[url].limit
+
+    # ---- pools ---------------------------------------------------------
+    def _target(self, url, peak):
+        want = max(self.per_weight * self._weights.get(url, 1.0), peak * self.headroom)
+        return int(min(max(math.ceil(want), self.min_connections), self.max_connections))
+
+    def _new_pool(self, url, limit):
+        client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit,
+                                keepalive_expiry=self.idle),
+            http1=self.http2 != "prior",
+            http2=bool(self.http2),
+        )
+        metrics = None
+        if self._metrics:
+            wait, conns, size = self._metrics
+            size.labels(url).set(limit)
+            metrics = (wait.labels(url), conns.labels(url, "new"), conns.labels(url, "reused"))
+        return _Pool(url, client, limit, metrics)
+
+    def _retire(self, pool):
+        # closed by _finished after its last response, or by maintain if idle
+        pool.retired = True
+        self._retired.append(pool)
+
+    async def _finished(self, pool):
+        pool.inflight -= 1
+        pool.last_used = time.monotonic()
+        if pool.retired and not pool.inflight:
+            if pool in self._retired:
+                self._retired.remove(pool)
+            await pool.client.aclose()
+
+    def _pool(self, url):
+        pool = self._pools.get(url)
+        if pool is None or pool.client.is_closed:
+            # unknown backend (e.g. not in servers.json yet) or reaped while idle
+            self._weights.setdefault(url, 1.0)
+            pool = self._pools[url] = self._new_pool(url, pool.limit if pool else self._target(url, 0))
+        return pool
+
+    # ---- requests ------------------------------------------------------
+    async def send(self, backend: str, path: str, request: Request,
+                   timeout=httpx.USE_CLIENT_DEFAULT) -> httpx.Response:
+        """streaming.send on the backend's own pool."""
+        pool = self._pool(backend)
+        pool.inflight += 1
+        if pool.inflight > pool.peak:
+            pool.peak = pool.inflight
+        try:
+            resp = await streaming.send(pool.client, backend, path, request,
+                                        extensions=self._trace(pool) if pool.metrics else None, timeout=timeout)
+        except BaseException:
+            await self._finished(pool)
+            raise
+        resp.stream = _CountedStream(resp.stream, self, pool)
+        return resp
+
+    @staticmethod
+    def _trace(pool):
+        # pool wait: from send until a connection is picked, i.e. until it
+        # starts connecting (new) or writing headers on an idle one (reused)
+        start = time.perf_counter()
+        seen = False
+
+        async def trace(event, info):
+            nonlocal seen
+            if seen:
+                return
+            if event == "connection.connect_tcp.started":
+                seen = True
+                pool.metrics[0].observe(time.perf_counter() - start)
+                pool.metrics[1].inc()
+            elif event.endswith("send_request_headers.started"):
+                seen = True
+                pool.metrics[0].observe(time.perf_counter() - start)
+                pool.metrics[2].inc()
+        return {"trace": trace}
+
+    # ---- warming -------------------------------------------------------
+    async def warm(self, url, n=None):
+        """Open up to n connections to url now, with concurrent HEAD requests."""
+        if url not in self._pools:
+            return  # removed meanwhile
+        pool = self._pool(url)
+        n = min(n or self.warm_connections, pool.limit)
+        if n <= 0:
+            return
+        target = f"{url}/{self.warm_path.lstrip('/')}"
+
+        async def one():
+            try:
+                await pool.client.head(target)
+            except httpx.HTTPError:
+                pass  # the health probes decide whether it is up
+        await asyncio.gather(*(one() for _ in range(n)))
+
+    async def warm_all(self):
+        await asyncio.gather(*(self.warm(url) for url in list(self._pools)))
+
+    # ---- maintenance ---------------------------------------------------
+    async def maintain(self):
+        """Resize pools to recent peak concurrency and close idle ones."""
+        now = time.monotonic()
+        for pool in [p for p in self._retired if not p.inflight]:
+            self._retired.remove(pool)
+            await pool.client.aclose()
+        for url, pool in list(self._pools.items()):
+            if pool.client.is_closed:
+                continue
+            if not pool.inflight and now - pool.last_used > self.idle:
+                await pool.client.aclose()  # reaped; reopened on the next request
+                continue
+            target = self._target(url, pool.peak)
+            pool.peak = pool.inflight
+            # grow as soon as the pool was full, shrink only when far oversized
+            if target > pool.limit or target * 2 < pool.limit:
+                self._pools[url] = self._new_pool(url, target)
+                self._retire(pool)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                print(f"upstream pool maintenance failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for pool in [*self._pools.values(), *self._retired]:
+            await pool.client.aclose()
+        self._pools.clear()
+        self._retired.clear()
+
+
+def _metrics():
+    from lbmetrics import Counter, Gauge, Histogram
+    return (
+        Histogram("lb_upstream_pool_wait_seconds", "Time waiting for an upstream connection", ["backend"],
+                  buckets=(1e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)),
+        Counter("lb_upstream_connections_total", "Upstream requests by connection: new or reused",
+                ["backend", "kind"]),
+        Gauge("lb_upstream_pool_size", "Connection limit of the backend's pool", ["backend"]),
+    )